@@ -16,6 +16,9 @@ Script to integrate CARLA and SUMO simulations
 import argparse
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 # ==================================================================================================
 # -- find carla module -----------------------------------------------------------------------------
@@ -66,7 +69,9 @@ class SimulationSynchronization(object):
                  carla_simulation,
                  tls_manager='none',
                  sync_vehicle_color=False,
-                 sync_vehicle_lights=False):
+                 sync_vehicle_lights=False,
+                 batch_commands=True,
+                 pipelined=False):
 
         self.sumo = sumo_simulation
         self.carla = carla_simulation
@@ -75,6 +80,18 @@ class SimulationSynchronization(object):
         self.sync_vehicle_color = sync_vehicle_color
         self.sync_vehicle_lights = sync_vehicle_lights
 
+        # Whether the spawns, destructions and updates of the sumo actors are sent to carla with
+        # one batch of commands per frame instead of one call per actor.
+        self.batch_commands = batch_commands
+
+        # In pipelined mode, sumo computes its next step in a worker thread while carla ticks. The
+        # state of the carla actors then reaches sumo one step later than in lockstep. Unsetting
+        # pipelined falls back to the serial and deterministic tick, and can be done at any time.
+        self.pipelined = pipelined
+        self._sumo_executor = None
+        self._sumo_step = None  # Future of the sumo step running in the worker thread.
+        self._sumo_ahead = False  # Whether the sumo step of the next tick was already computed.
+
         if tls_manager == 'carla':
             self.sumo.switch_off_traffic_lights()
         elif tls_manager == 'sumo':
@@ -100,49 +117,115 @@ class SimulationSynchronization(object):
         """
         Tick to simulation synchronization
         """
-        # -----------------
-        # sumo-->carla sync
-        # -----------------
-        self.sumo.tick()
+        self.wait_sumo()
+        if self._sumo_ahead:
+            self._sumo_ahead = False
+        else:
+            self.sumo.tick()
+
+        self._synchronize_sumo_to_carla()
+
+        if self.pipelined:
+            if self._sumo_executor is None:
+                self._sumo_executor = ThreadPoolExecutor(max_workers=1)
+            self._sumo_step = self._sumo_executor.submit(self.sumo.tick)
+            self._tick_carla()
+        else:
+            self._tick_carla()
+            self._synchronize_carla_to_sumo()
+
+    def wait_sumo(self):
+        """
+        Waits for the sumo step computed in the worker thread while carla was ticking, if any. Sumo
+        can't be accessed through traci while the step is running, so this has to be called before
+        any other use of traci between ticks.
+        """
+        if self._sumo_step is None:
+            return
 
-        # Spawning new sumo actors in carla (i.e, not controlled by carla).
-        sumo_spawned_actors = self.sumo.spawned_actors - set(self.carla2sumo_ids.values())
-        for sumo_actor_id in sumo_spawned_actors:
-            self.sumo.subscribe(sumo_actor_id)
-            sumo_actor = self.sumo.get_actor(sumo_actor_id)
+        self._sumo_step.result()
+        self._sumo_step = None
+        self._sumo_ahead = True
 
-            carla_blueprint = BridgeHelper.get_carla_blueprint(sumo_actor, self.sync_vehicle_color)
-            if carla_blueprint is not None:
-                carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
-                                                                   sumo_actor.extent)
+        # The carla actors are updated in sumo now that the step is finished.
+        self._synchronize_carla_to_sumo()
 
-                carla_actor_id = self.carla.spawn_actor(carla_blueprint, carla_transform)
-                if carla_actor_id != INVALID_ACTOR_ID:
-                    self.sumo2carla_ids[sumo_actor_id] = carla_actor_id
-            else:
-                self.sumo.unsubscribe(sumo_actor_id)
+    def _tick_carla(self):
+        """
+        Tick to carla simulation.
+        """
+        self.carla.tick()
+        logging.debug('Commands sent to carla: %s',
+                      self._format_commands(self.carla.frame_commands))
+
+    def _synchronize_sumo_to_carla(self):
+        """
+        Updates carla with the state of the last sumo step.
+        """
+        # Spawning new sumo actors in carla (i.e, not controlled by carla).
+        sumo_spawned_actors = self.sumo.spawned_actors - set(self.carla2sumo_ids.values())
+        if self.batch_commands:
+            self._spawn_sumo_actors(sumo_spawned_actors)
+        else:
+            for sumo_actor_id in sumo_spawned_actors:
+                self.sumo.subscribe(sumo_actor_id)
+                sumo_actor = self.sumo.get_actor(sumo_actor_id)
+                if sumo_actor is None:
+                    # The actor has already left the sumo simulation.
+                    continue
+
+                carla_blueprint = BridgeHelper.get_carla_blueprint(sumo_actor,
+                                                                   self.sync_vehicle_color)
+                if carla_blueprint is not None:
+                    carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
+                                                                       sumo_actor.extent)
+
+                    carla_actor_id = self.carla.spawn_actor(carla_blueprint, carla_transform)
+                    if carla_actor_id != INVALID_ACTOR_ID:
+                        self.sumo2carla_ids[sumo_actor_id] = carla_actor_id
+                else:
+                    self.sumo.unsubscribe(sumo_actor_id)
 
         # Destroying sumo arrived actors in carla.
-        for sumo_actor_id in self.sumo.destroyed_actors:
-            if sumo_actor_id in self.sumo2carla_ids:
-                self.carla.destroy_actor(self.sumo2carla_ids.pop(sumo_actor_id))
+        destroyed_carla_actors = [
+            self.sumo2carla_ids.pop(sumo_actor_id) for sumo_actor_id in self.sumo.destroyed_actors
+            if sumo_actor_id in self.sumo2carla_ids
+        ]
+        if self.batch_commands:
+            self.carla.destroy_actors(destroyed_carla_actors)
+        else:
+            for carla_actor_id in destroyed_carla_actors:
+                self.carla.destroy_actor(carla_actor_id)
 
         # Updating sumo actors in carla.
-        for sumo_actor_id in self.sumo2carla_ids:
-            carla_actor_id = self.sumo2carla_ids[sumo_actor_id]
+        if self.batch_commands:
+            self._synchronize_sumo_actors()
+        else:
+            if self.sync_vehicle_lights:
+                current_lights = dict(
+                    zip(self.sumo2carla_ids.values(),
+                        self.carla.get_actor_light_states(list(self.sumo2carla_ids.values()))))
 
-            sumo_actor = self.sumo.get_actor(sumo_actor_id)
-            carla_actor = self.carla.get_actor(carla_actor_id)
+            for sumo_actor_id in self.sumo2carla_ids:
+                carla_actor_id = self.sumo2carla_ids[sumo_actor_id]
 
-            carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
-                                                               sumo_actor.extent)
-            if self.sync_vehicle_lights:
-                carla_lights = BridgeHelper.get_carla_lights_state(carla_actor.get_light_state(),
-                                                                   sumo_actor.signals)
-            else:
-                carla_lights = None
+                sumo_actor = self.sumo.get_actor(sumo_actor_id)
+                if sumo_actor is None:
+                    # The actor has already left the sumo simulation.
+                    continue
+
+                carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
+                                                                   sumo_actor.extent)
+                if self.sync_vehicle_lights:
+                    if current_lights[carla_actor_id] is None:
+                        # The actor has been removed from carla by another client.
+                        continue
+                    carla_lights = BridgeHelper.get_carla_lights_state(
+                        current_lights[carla_actor_id], sumo_actor.signals)
+                else:
+                    carla_lights = None
 
-            self.carla.synchronize_vehicle(carla_actor_id, carla_transform, carla_lights)
+                self.carla.synchronize_vehicle(carla_actor_id, carla_transform, carla_lights)
 
         # Updates traffic lights in carla based on sumo information.
         if self.tls_manager == 'sumo':
@@ -153,11 +236,10 @@ class SimulationSynchronization(object):
 
                 self.carla.synchronize_traffic_light(landmark_id, carla_tl_state)
 
-        # -----------------
-        # carla-->sumo sync
-        # -----------------
-        self.carla.tick()
-
+    def _synchronize_carla_to_sumo(self):
+        """
+        Updates sumo with the state of the last carla tick.
+        """
         # Spawning new carla actors (not controlled by sumo)
         carla_spawned_actors = self.carla.spawned_actors - set(self.sumo2carla_ids.values())
         for carla_actor_id in carla_spawned_actors:
@@ -177,25 +259,7 @@ class SimulationSynchronization(object):
                 self.sumo.destroy_actor(self.carla2sumo_ids.pop(carla_actor_id))
 
         # Updating carla actors in sumo.
-        for carla_actor_id in self.carla2sumo_ids:
-            sumo_actor_id = self.carla2sumo_ids[carla_actor_id]
-
-            carla_actor = self.carla.get_actor(carla_actor_id)
-            sumo_actor = self.sumo.get_actor(sumo_actor_id)
-
-            sumo_transform = BridgeHelper.get_sumo_transform(carla_actor.get_transform(),
-                                                             carla_actor.bounding_box.extent)
-            if self.sync_vehicle_lights:
-                carla_lights = self.carla.get_actor_light_state(carla_actor_id)
-                if carla_lights is not None:
-                    sumo_lights = BridgeHelper.get_sumo_lights_state(sumo_actor.signals,
-                                                                     carla_lights)
-                else:
-                    sumo_lights = None
-            else:
-                sumo_lights = None
-
-            self.sumo.synchronize_vehicle(sumo_actor_id, sumo_transform, sumo_lights)
+        self._synchronize_carla_actors()
 
         # Updates traffic lights in sumo based on carla information.
         if self.tls_manager == 'carla':
@@ -207,10 +271,137 @@ class SimulationSynchronization(object):
                 # Updates all the sumo links related to this landmark.
                 self.sumo.synchronize_traffic_light(landmark_id, sumo_tl_state)
 
+    def _spawn_sumo_actors(self, sumo_actor_ids):
+        """
+        Spawns the given sumo actors in carla with a single batch of commands.
+        """
+        spawned_sumo_actors = []
+        carla_actors = []
+        for sumo_actor_id in sumo_actor_ids:
+            self.sumo.subscribe(sumo_actor_id)
+            sumo_actor = self.sumo.get_actor(sumo_actor_id)
+            if sumo_actor is None:
+                # The actor has already left the sumo simulation.
+                continue
+
+            carla_blueprint = BridgeHelper.get_carla_blueprint(sumo_actor, self.sync_vehicle_color)
+            if carla_blueprint is not None:
+                carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
+                                                                   sumo_actor.extent)
+                spawned_sumo_actors.append(sumo_actor_id)
+                carla_actors.append((carla_blueprint, carla_transform))
+            else:
+                self.sumo.unsubscribe(sumo_actor_id)
+
+        carla_actor_ids = self.carla.spawn_actors(carla_actors)
+        for sumo_actor_id, carla_actor_id in zip(spawned_sumo_actors, carla_actor_ids):
+            if carla_actor_id != INVALID_ACTOR_ID:
+                self.sumo2carla_ids[sumo_actor_id] = carla_actor_id
+
+    def _synchronize_sumo_actors(self):
+        """
+        Updates the sumo actors in carla, sending all their transforms and light states with a
+        single batch of commands.
+        """
+        carla_actor_ids = []
+        sumo_actors = []
+        current_lights = []
+        if self.sync_vehicle_lights:
+            all_lights = self.carla.get_actor_light_states(list(self.sumo2carla_ids.values()))
+        else:
+            all_lights = [None] * len(self.sumo2carla_ids)
+        for (sumo_actor_id, carla_actor_id), lights in zip(self.sumo2carla_ids.items(), all_lights):
+            sumo_actor = self.sumo.get_actor(sumo_actor_id)
+            if sumo_actor is None:
+                # The actor has already left the sumo simulation.
+                continue
+            if self.sync_vehicle_lights:
+                if lights is None:
+                    # The actor has been removed from carla by another client.
+                    continue
+                current_lights.append(int(lights))
+
+            carla_actor_ids.append(carla_actor_id)
+            sumo_actors.append(sumo_actor)
+
+        if not carla_actor_ids:
+            return
+
+        locations = np.array([(actor.transform.location.x, actor.transform.location.y,
+                               actor.transform.location.z) for actor in sumo_actors])
+        rotations = np.array([(actor.transform.rotation.pitch, actor.transform.rotation.yaw,
+                               actor.transform.rotation.roll) for actor in sumo_actors])
+        extents = np.array([actor.extent.x for actor in sumo_actors])
+        carla_transforms = BridgeHelper.get_carla_transforms(locations, rotations, extents)
+
+        if self.sync_vehicle_lights:
+            carla_lights = BridgeHelper.get_carla_lights_states(
+                current_lights, [actor.signals for actor in sumo_actors]).tolist()
+        else:
+            carla_lights = [None] * len(carla_actor_ids)
+
+        self.carla.synchronize_vehicles([
+            (carla_actor_id, BridgeHelper.to_transform(transform), lights)
+            for carla_actor_id, transform, lights in zip(carla_actor_ids, carla_transforms,
+                                                         carla_lights)
+        ])
+
+    def _synchronize_carla_actors(self):
+        """
+        Updates the carla actors in sumo, converting all their transforms and light states at once.
+        """
+        if not self.carla2sumo_ids:
+            return
+
+        carla_actor_ids = list(self.carla2sumo_ids)
+        locations, rotations, extents = self.carla.get_actor_transforms(carla_actor_ids)
+        sumo_transforms = BridgeHelper.get_sumo_transforms(locations, rotations, extents)
+
+        sumo_lights = [None] * len(carla_actor_ids)
+        if self.sync_vehicle_lights:
+            indices, current_signals, carla_lights = [], [], []
+            all_lights = self.carla.get_actor_light_states(carla_actor_ids)
+            for i, (carla_actor_id, lights) in enumerate(zip(carla_actor_ids, all_lights)):
+                sumo_actor = self.sumo.get_actor(self.carla2sumo_ids[carla_actor_id])
+                if lights is not None and sumo_actor is not None:
+                    indices.append(i)
+                    current_signals.append(sumo_actor.signals)
+                    carla_lights.append(int(lights))
+
+            if indices:
+                new_signals = BridgeHelper.get_sumo_lights_states(current_signals, carla_lights)
+                for i, signals in zip(indices, new_signals.tolist()):
+                    sumo_lights[i] = signals
+
+        for carla_actor_id, transform, signals in zip(carla_actor_ids, sumo_transforms,
+                                                      sumo_lights):
+            self.sumo.synchronize_vehicle(self.carla2sumo_ids[carla_actor_id],
+                                          BridgeHelper.to_transform(transform), signals)
+
+    @staticmethod
+    def _format_commands(commands):
+        """
+        Returns a readable summary of the commands sent to carla during a frame.
+        """
+        if not commands:
+            return 'none'
+        return ', '.join('%s %d' % (kind, commands[kind]) for kind in sorted(commands))
+
     def close(self):
         """
         Cleans synchronization.
         """
+        # Waiting for the sumo step running in the worker thread, if any.
+        if self._sumo_executor is not None:
+            if self._sumo_step is not None:
+                try:
+                    self._sumo_step.result()
+                except Exception as error:  # pylint: disable=broad-except
+                    logging.error('Sumo step failed. %s', error)
+                self._sumo_step = None
+            self._sumo_executor.shutdown()
+            self._sumo_executor = None
+
         # Configuring carla simulation in async mode.
         settings = self.carla.world.get_settings()
         settings.synchronous_mode = False
@@ -218,8 +409,11 @@ class SimulationSynchronization(object):
         self.carla.world.apply_settings(settings)
 
         # Destroying synchronized actors.
-        for carla_actor_id in self.sumo2carla_ids.values():
-            self.carla.destroy_actor(carla_actor_id)
+        if self.batch_commands:
+            self.carla.destroy_actors(list(self.sumo2carla_ids.values()))
+        else:
+            for carla_actor_id in self.sumo2carla_ids.values():
+                self.carla.destroy_actor(carla_actor_id)
 
         for sumo_actor_id in self.carla2sumo_ids.values():
             self.sumo.destroy_actor(sumo_actor_id)
@@ -234,11 +428,13 @@ def synchronization_loop(args):
     Entry point for sumo-carla co-simulation.
     """
     sumo_simulation = SumoSimulation(args.sumo_cfg_file, args.step_length, args.sumo_host,
-                                     args.sumo_port, args.sumo_gui, args.client_order)
+                                     args.sumo_port, args.sumo_gui, args.client_order,
+                                     args.sumo_backend)
     carla_simulation = CarlaSimulation(args.carla_host, args.carla_port, args.step_length)
 
     synchronization = SimulationSynchronization(sumo_simulation, carla_simulation, args.tls_manager,
-                                                args.sync_vehicle_color, args.sync_vehicle_lights)
+                                                args.sync_vehicle_color, args.sync_vehicle_lights,
+                                                not args.no_batch_commands, args.pipelined)
     try:
         while True:
             start = time.time()
@@ -281,6 +477,11 @@ if __name__ == '__main__':
                            type=int,
                            help='TCP port to listen to (default: 8813)')
     argparser.add_argument('--sumo-gui', action='store_true', help='run the gui version of sumo')
+    argparser.add_argument('--sumo-backend',
+                           choices=['traci', 'libsumo'],
+                           default='traci',
+                           help='python api used to run sumo. libsumo runs it in process, without '
+                           'gui nor additional clients (default: traci)')
     argparser.add_argument('--step-length',
                            default=0.05,
                            type=float,
@@ -304,6 +505,14 @@ if __name__ == '__main__':
                            choices=['none', 'sumo', 'carla'],
                            help="select traffic light manager (default: none)",
                            default='none')
+    argparser.add_argument('--no-batch-commands',
+                           action='store_true',
+                           help='send one command per actor to carla instead of a batch per frame '
+                           '(default: False)')
+    argparser.add_argument('--pipelined',
+                           action='store_true',
+                           help='compute the next sumo step while carla ticks, sending the carla '
+                           'actors to sumo one step later (default: False)')
     argparser.add_argument('--debug', action='store_true', help='enable debug messages')
     arguments = argparser.parse_args()
 
@@ -52,9 +52,9 @@ else:
 # ==================================================================================================
 
 import sumolib  # pylint: disable=wrong-import-position
-import traci  # pylint: disable=wrong-import-position
 
 from sumo_integration.carla_simulation import CarlaSimulation  # pylint: disable=wrong-import-position
+from sumo_integration.sumo_backend import traci  # pylint: disable=wrong-import-position
 from sumo_integration.sumo_simulation import SumoSimulation  # pylint: disable=wrong-import-position
 
 from run_synchronization import SimulationSynchronization  # pylint: disable=wrong-import-position
@@ -119,13 +119,15 @@ def main(args):
                                      host=args.sumo_host,
                                      port=args.sumo_port,
                                      sumo_gui=args.sumo_gui,
-                                     client_order=args.client_order)
+                                     client_order=args.client_order,
+                                     backend=args.sumo_backend)
 
     # ---------------
     # synchronization
     # ---------------
     synchronization = SimulationSynchronization(sumo_simulation, carla_simulation, args.tls_manager,
-                                                args.sync_vehicle_color, args.sync_vehicle_lights)
+                                                args.sync_vehicle_color, args.sync_vehicle_lights,
+                                                not args.no_batch_commands, args.pipelined)
 
     try:
         # ----------
@@ -183,6 +185,9 @@ def main(args):
 
             synchronization.tick()
 
+            # In pipelined mode, the next sumo step may still be running.
+            synchronization.wait_sumo()
+
             # Updates vehicle routes
             for vehicle_id in traci.vehicle.getIDList():
                 route = traci.vehicle.getRoute(vehicle_id)
@@ -257,6 +262,11 @@ if __name__ == '__main__':
                            default='walker.pedestrian.*',
                            help='pedestrians filter (default: "walker.pedestrian.*")')
     argparser.add_argument('--sumo-gui', action='store_true', help='run the gui version of sumo')
+    argparser.add_argument('--sumo-backend',
+                           choices=['traci', 'libsumo'],
+                           default='traci',
+                           help='python api used to run sumo. libsumo runs it in process, without '
+                           'gui nor additional clients (default: traci)')
     argparser.add_argument('--step-length',
                            default=0.05,
                            type=float,
@@ -285,6 +295,14 @@ if __name__ == '__main__':
                            choices=['none', 'sumo', 'carla'],
                            help="select traffic light manager (default: none)",
                            default='none')
+    argparser.add_argument('--no-batch-commands',
+                           action='store_true',
+                           help='send one command per actor to carla instead of a batch per frame '
+                           '(default: False)')
+    argparser.add_argument('--pipelined',
+                           action='store_true',
+                           help='compute the next sumo step while carla ticks, sending the carla '
+                           'actors to sumo one step later (default: False)')
     argparser.add_argument('--debug', action='store_true', help='enable debug messages')
     args = argparser.parse_args()
 
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+""" This module keeps track of the carla actors of the co-simulation from the world snapshots. """
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import numpy as np
+
+import carla  # pylint: disable=import-error
+
+# ==================================================================================================
+# -- actor registry --------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class ActorRegistry(object):
+    """
+    ActorRegistry keeps the handles, type ids and extents of the carla actors whose type id starts
+    with a given prefix, keyed by actor id. It is updated from a world snapshot: the ids of the
+    snapshot give the spawned and destroyed actors, and the transforms of all the tracked actors are
+    copied into numpy arrays. Only the actors that appear in the snapshot are queried to the server,
+    with a single call.
+
+    The arrays have one row per tracked actor, in the order of 'ids':
+        - locations: x, y, z (carla reference system).
+        - rotations: pitch, yaw, roll, in degrees.
+        - extents: x, y, z of the bounding box extent.
+        - lights: vehicle light state, or -1 if unknown. It is only filled by 'update_lights', as
+          reading the light states is an additional call to the server.
+    """
+    def __init__(self, world, type_prefix='vehicle.'):
+        self._world = world
+        self._type_prefix = type_prefix
+
+        self._actors = {}  # {actor_id: carla_actor}
+        self._extents = {}  # {actor_id: carla_extent}
+        self._ignored = set()  # ids of the actors in the snapshot with another type.
+        self._rows = {}  # {actor_id: row}
+
+        self.frame = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.locations = np.zeros((0, 3))
+        self.rotations = np.zeros((0, 3))
+        self.extents = np.zeros((0, 3))
+        self.lights = np.zeros(0, dtype=np.int64)
+        self.lights_frame = None  # Frame of the last update of the lights.
+
+    def __len__(self):
+        return len(self._actors)
+
+    def __contains__(self, actor_id):
+        return actor_id in self._actors
+
+    @property
+    def actor_ids(self):
+        """
+        Ids of the tracked actors.
+        """
+        return set(self._actors)
+
+    def update(self, snapshot):
+        """
+        Updates the registry from a world snapshot.
+
+            :param snapshot: carla.WorldSnapshot of the current frame.
+            :return: (spawned, destroyed) sets with the ids of the tracked actors that appeared and
+                disappeared since the last update.
+        """
+        snapshot_ids = set(actor_snapshot.id for actor_snapshot in snapshot)
+
+        destroyed = set(self._actors) - snapshot_ids
+        for actor_id in destroyed:
+            del self._actors[actor_id]
+            del self._extents[actor_id]
+        self._ignored &= snapshot_ids
+
+        spawned = set()
+        new_ids = snapshot_ids - self._ignored - set(self._actors)
+        if new_ids:
+            for actor in self._world.get_actors(list(new_ids)):
+                if actor.type_id.startswith(self._type_prefix):
+                    self._actors[actor.id] = actor
+                    self._extents[actor.id] = actor.bounding_box.extent
+                    spawned.add(actor.id)
+                else:
+                    self._ignored.add(actor.id)
+
+        self._update_arrays(snapshot)
+        self.frame = snapshot.frame
+        return spawned, destroyed
+
+    def _update_arrays(self, snapshot):
+        """
+        Copies the transforms of the tracked actors from the snapshot into the arrays.
+        """
+        ids = sorted(self._actors)
+        num_actors = len(ids)
+        if set(self._rows) != set(self._actors):
+            self.ids = np.array(ids, dtype=np.int64)
+            self._rows = {actor_id: row for row, actor_id in enumerate(ids)}
+            self.extents = np.array([(self._extents[actor_id].x, self._extents[actor_id].y,
+                                      self._extents[actor_id].z) for actor_id in ids],
+                                    dtype=np.float64).reshape(num_actors, 3)
+            self.locations = np.zeros((num_actors, 3))
+            self.rotations = np.zeros((num_actors, 3))
+            self.lights = np.full(num_actors, -1, dtype=np.int64)
+
+        for row, actor_id in enumerate(ids):
+            transform = snapshot.find(actor_id).get_transform()
+            location = transform.location
+            rotation = transform.rotation
+            self.locations[row] = (location.x, location.y, location.z)
+            self.rotations[row] = (rotation.pitch, rotation.yaw, rotation.roll)
+
+    def update_lights(self, light_states):
+        """
+        Copies the light states of the tracked actors into the lights column.
+
+            :param light_states: dictionary {actor_id: carla_light_state} of all the vehicles, as
+                returned by 'world.get_vehicles_light_states'.
+        """
+        self.lights = np.array([int(light_states.get(actor_id, -1)) for actor_id in self.ids.tolist()],
+                               dtype=np.int64)
+        self.lights_frame = self.frame
+
+    def get_actor(self, actor_id):
+        """
+        Returns the handle of a tracked actor, or None if it is not tracked.
+        """
+        return self._actors.get(actor_id)
+
+    def get_extent(self, actor_id):
+        """
+        Returns the bounding box extent of a tracked actor, or None if it is not tracked.
+        """
+        return self._extents.get(actor_id)
+
+    def get_row(self, actor_id):
+        """
+        Returns the row of the arrays of a tracked actor, or None if it is not tracked.
+        """
+        return self._rows.get(actor_id)
+
+    def get_transform(self, actor_id):
+        """
+        Returns the transform of a tracked actor in the last snapshot, or None if it is not tracked.
+        """
+        row = self._rows.get(actor_id)
+        if row is None:
+            return None
+        location = self.locations[row]
+        rotation = self.rotations[row]
+        return carla.Transform(
+            carla.Location(float(location[0]), float(location[1]), float(location[2])),
+            carla.Rotation(float(rotation[0]), float(rotation[1]), float(rotation[2])))
@@ -13,15 +13,89 @@
 
 import json
 import logging
-import math
 import os
 import random
 
+import numpy as np
+
 import carla  # pylint: disable=import-error
-import traci  # pylint: disable=import-error
 
+from .sumo_backend import traci
 from .sumo_simulation import SumoSignalState, SumoVehSignal
 
+# ==================================================================================================
+# -- vectorized conversions ------------------------------------------------------------------------
+# ==================================================================================================
+
+# Transforms of several vehicles. Locations are (x, y, z) and rotations (pitch, yaw, roll), in
+# degrees.
+TRANSFORM_DTYPE = np.dtype([('location', np.float64, (3, )), ('rotation', np.float64, (3, ))])
+
+# carla light -> sumo signals that switch it on.
+_SUMO_TO_CARLA_LIGHTS = [
+    (carla.VehicleLightState.RightBlinker,
+     SumoVehSignal.BLINKER_RIGHT | SumoVehSignal.BLINKER_EMERGENCY),
+    (carla.VehicleLightState.LeftBlinker,
+     SumoVehSignal.BLINKER_LEFT | SumoVehSignal.BLINKER_EMERGENCY),
+    (carla.VehicleLightState.Brake, SumoVehSignal.BRAKELIGHT),
+    (carla.VehicleLightState.LowBeam, SumoVehSignal.FRONTLIGHT),
+    (carla.VehicleLightState.Fog, SumoVehSignal.FOGLIGHT),
+    (carla.VehicleLightState.HighBeam, SumoVehSignal.HIGHBEAM),
+    (carla.VehicleLightState.Reverse, SumoVehSignal.BACKDRIVE),
+    (carla.VehicleLightState.Position,
+     SumoVehSignal.DOOR_OPEN_LEFT | SumoVehSignal.DOOR_OPEN_RIGHT),
+]
+
+# sumo signal -> carla light that switches it on. The emergency signal is handled apart.
+_CARLA_TO_SUMO_LIGHTS = [
+    (SumoVehSignal.BLINKER_RIGHT, carla.VehicleLightState.RightBlinker),
+    (SumoVehSignal.BLINKER_LEFT, carla.VehicleLightState.LeftBlinker),
+    (SumoVehSignal.BRAKELIGHT, carla.VehicleLightState.Brake),
+    (SumoVehSignal.FRONTLIGHT, carla.VehicleLightState.LowBeam),
+    (SumoVehSignal.FOGLIGHT, carla.VehicleLightState.Fog),
+    (SumoVehSignal.HIGHBEAM, carla.VehicleLightState.HighBeam),
+    (SumoVehSignal.BACKDRIVE, carla.VehicleLightState.Reverse),
+]
+
+
+def _build_lights_tables():
+    """
+    Builds the lookup tables that map the light bits between both simulators.
+
+        :return: (carla managed mask, sumo index mask, sumo -> carla table,
+                  sumo managed mask, carla index mask, carla -> sumo table)
+    """
+    carla_managed = 0
+    sumo_index_mask = 0
+    for carla_light, sumo_signals in _SUMO_TO_CARLA_LIGHTS:
+        carla_managed |= int(carla_light)
+        sumo_index_mask |= sumo_signals
+
+    indices = np.arange(sumo_index_mask + 1, dtype=np.int64)
+    sumo_to_carla = np.zeros(sumo_index_mask + 1, dtype=np.int64)
+    for carla_light, sumo_signals in _SUMO_TO_CARLA_LIGHTS:
+        sumo_to_carla[(indices & sumo_signals) != 0] |= int(carla_light)
+
+    blinkers = int(carla.VehicleLightState.RightBlinker) | int(carla.VehicleLightState.LeftBlinker)
+    sumo_managed = SumoVehSignal.BLINKER_EMERGENCY
+    carla_index_mask = blinkers
+    for sumo_signal, carla_light in _CARLA_TO_SUMO_LIGHTS:
+        sumo_managed |= sumo_signal
+        carla_index_mask |= int(carla_light)
+
+    # Indexed by [emergency signal currently on, carla lights].
+    indices = np.arange(carla_index_mask + 1, dtype=np.int64)
+    carla_to_sumo = np.zeros((2, carla_index_mask + 1), dtype=np.int64)
+    for sumo_signal, carla_light in _CARLA_TO_SUMO_LIGHTS:
+        carla_to_sumo[:, (indices & int(carla_light)) != 0] |= sumo_signal
+
+    # The emergency signal is switched on when both blinkers are on and it was off, and switched
+    # off otherwise, so it alternates while both blinkers stay on.
+    carla_to_sumo[0, (indices & blinkers) == blinkers] |= SumoVehSignal.BLINKER_EMERGENCY
+
+    return (carla_managed, sumo_index_mask, sumo_to_carla, sumo_managed, carla_index_mask,
+            carla_to_sumo)
+
 # ==================================================================================================
 # -- Bridge helper (SUMO <=> CARLA) ----------------------------------------------------------------
 # ==================================================================================================
@@ -40,60 +114,117 @@ class BridgeHelper(object):
     with open(_vtypes_path) as f:
         _VTYPES = json.load(f)['carla_blueprints']
 
+    (_CARLA_MANAGED_LIGHTS, _SUMO_INDEX_MASK, _SUMO_TO_CARLA_TABLE, _SUMO_MANAGED_SIGNALS,
+     _CARLA_INDEX_MASK, _CARLA_TO_SUMO_TABLE) = _build_lights_tables()
+
     @staticmethod
-    def get_carla_transform(in_sumo_transform, extent):
+    def get_carla_transforms(locations, rotations, extents):
         """
-        Returns carla transform based on sumo transform.
+        Returns the carla transforms of several vehicles based on their sumo transforms.
+
+            :param locations: (N, 3) array with the sumo locations.
+            :param rotations: (N, 3) array with the sumo rotations (pitch, yaw, roll) in degrees.
+            :param extents: (N, 3) array with the extents of the vehicles, or (N, ) with their x.
+            :return: structured array of TRANSFORM_DTYPE with the carla transforms.
         """
         offset = BridgeHelper.offset
-        in_location = in_sumo_transform.location
-        in_rotation = in_sumo_transform.rotation
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+        rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 3)
+        extents = np.asarray(extents, dtype=np.float64)
+        extent_x = extents[:, 0] if extents.ndim == 2 else extents
 
         # From front-center-bumper to center (sumo reference system).
         # (http://sumo.sourceforge.net/userdoc/Purgatory/Vehicle_Values.html#angle)
-        yaw = -1 * in_rotation.yaw + 90
-        pitch = in_rotation.pitch
-        out_location = (in_location.x - math.cos(math.radians(yaw)) * extent.x,
-                        in_location.y - math.sin(math.radians(yaw)) * extent.x,
-                        in_location.z - math.sin(math.radians(pitch)) * extent.x)
-        out_rotation = (in_rotation.pitch, in_rotation.yaw, in_rotation.roll)
+        yaw = np.radians(-1 * rotations[:, 1] + 90)
+        pitch = np.radians(rotations[:, 0])
+
+        out = np.empty(len(locations), dtype=TRANSFORM_DTYPE)
+        out_location = out['location']
+        out_location[:, 0] = locations[:, 0] - np.cos(yaw) * extent_x
+        out_location[:, 1] = locations[:, 1] - np.sin(yaw) * extent_x
+        out_location[:, 2] = locations[:, 2] - np.sin(pitch) * extent_x
 
         # Applying offset sumo-carla net.
-        out_location = (out_location[0] - offset[0], out_location[1] - offset[1], out_location[2])
+        out_location[:, 0] -= offset[0]
+        out_location[:, 1] -= offset[1]
 
         # Transform to carla reference system (left-handed system).
-        out_transform = carla.Transform(
-            carla.Location(out_location[0], -out_location[1], out_location[2]),
-            carla.Rotation(out_rotation[0], out_rotation[1] - 90, out_rotation[2]))
+        out_location[:, 1] *= -1
+        out['rotation'] = rotations
+        out['rotation'][:, 1] -= 90
 
-        return out_transform
+        return out
 
     @staticmethod
-    def get_sumo_transform(in_carla_transform, extent):
+    def get_sumo_transforms(locations, rotations, extents):
         """
-        Returns sumo transform based on carla transform.
+        Returns the sumo transforms of several vehicles based on their carla transforms.
+
+            :param locations: (N, 3) array with the carla locations.
+            :param rotations: (N, 3) array with the carla rotations (pitch, yaw, roll) in degrees.
+            :param extents: (N, 3) array with the extents of the vehicles, or (N, ) with their x.
+            :return: structured array of TRANSFORM_DTYPE with the sumo transforms.
         """
         offset = BridgeHelper.offset
-        in_location = in_carla_transform.location
-        in_rotation = in_carla_transform.rotation
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+        rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 3)
+        extents = np.asarray(extents, dtype=np.float64)
+        extent_x = extents[:, 0] if extents.ndim == 2 else extents
 
         # From center to front-center-bumper (carla reference system).
-        yaw = -1 * in_rotation.yaw
-        pitch = in_rotation.pitch
-        out_location = (in_location.x + math.cos(math.radians(yaw)) * extent.x,
-                        in_location.y - math.sin(math.radians(yaw)) * extent.x,
-                        in_location.z - math.sin(math.radians(pitch)) * extent.x)
-        out_rotation = (in_rotation.pitch, in_rotation.yaw, in_rotation.roll)
+        yaw = np.radians(-1 * rotations[:, 1])
+        pitch = np.radians(rotations[:, 0])
+
+        out = np.empty(len(locations), dtype=TRANSFORM_DTYPE)
+        out_location = out['location']
+        out_location[:, 0] = locations[:, 0] + np.cos(yaw) * extent_x
+        out_location[:, 1] = locations[:, 1] - np.sin(yaw) * extent_x
+        out_location[:, 2] = locations[:, 2] - np.sin(pitch) * extent_x
 
         # Applying offset carla-sumo net
-        out_location = (out_location[0] + offset[0], out_location[1] - offset[1], out_location[2])
+        out_location[:, 0] += offset[0]
+        out_location[:, 1] -= offset[1]
 
         # Transform to sumo reference system.
-        out_transform = carla.Transform(
-            carla.Location(out_location[0], -out_location[1], out_location[2]),
-            carla.Rotation(out_rotation[0], out_rotation[1] + 90, out_rotation[2]))
+        out_location[:, 1] *= -1
+        out['rotation'] = rotations
+        out['rotation'][:, 1] += 90
+
+        return out
 
-        return out_transform
+    @staticmethod
+    def to_transform(transform):
+        """
+        Returns the carla.Transform of an element of a TRANSFORM_DTYPE array.
+        """
+        location = transform['location'].tolist()
+        rotation = transform['rotation'].tolist()
+        return carla.Transform(carla.Location(location[0], location[1], location[2]),
+                               carla.Rotation(rotation[0], rotation[1], rotation[2]))
+
+    @staticmethod
+    def get_carla_transform(in_sumo_transform, extent):
+        """
+        Returns carla transform based on sumo transform.
+        """
+        in_location = in_sumo_transform.location
+        in_rotation = in_sumo_transform.rotation
+        out = BridgeHelper.get_carla_transforms(
+            [in_location.x, in_location.y, in_location.z],
+            [in_rotation.pitch, in_rotation.yaw, in_rotation.roll], [extent.x])
+        return BridgeHelper.to_transform(out[0])
+
+    @staticmethod
+    def get_sumo_transform(in_carla_transform, extent):
+        """
+        Returns sumo transform based on carla transform.
+        """
+        in_location = in_carla_transform.location
+        in_rotation = in_carla_transform.rotation
+        out = BridgeHelper.get_sumo_transforms(
+            [in_location.x, in_location.y, in_location.z],
+            [in_rotation.pitch, in_rotation.yaw, in_rotation.roll], [extent.x])
+        return BridgeHelper.to_transform(out[0])
 
     @staticmethod
     def _get_recommended_carla_blueprint(sumo_actor):
@@ -224,111 +355,52 @@ class BridgeHelper(object):
             return type_id
         return BridgeHelper._create_sumo_vtype(carla_actor)
 
+    @staticmethod
+    def get_carla_lights_states(current_carla_lights, sumo_lights):
+        """
+        Returns the carla vehicle light states of several vehicles based on their sumo signals.
+
+            :param current_carla_lights: (N, ) array with the current carla light states.
+            :param sumo_lights: (N, ) array with the sumo signals.
+            :return: (N, ) array with the new carla light states.
+        """
+        current_lights = np.asarray(current_carla_lights, dtype=np.int64)
+        sumo_lights = np.asarray(sumo_lights, dtype=np.int64)
+        new_lights = BridgeHelper._SUMO_TO_CARLA_TABLE[sumo_lights & BridgeHelper._SUMO_INDEX_MASK]
+        return (current_lights & ~BridgeHelper._CARLA_MANAGED_LIGHTS) | new_lights
+
+    @staticmethod
+    def get_sumo_lights_states(current_sumo_lights, carla_lights):
+        """
+        Returns the sumo signals of several vehicles based on their carla vehicle light states.
+
+            :param current_sumo_lights: (N, ) array with the current sumo signals.
+            :param carla_lights: (N, ) array with the carla light states.
+            :return: (N, ) array with the new sumo signals.
+        """
+        current_lights = np.asarray(current_sumo_lights, dtype=np.int64)
+        carla_lights = np.asarray(carla_lights, dtype=np.int64)
+        emergency = ((current_lights & SumoVehSignal.BLINKER_EMERGENCY) != 0).astype(np.int64)
+        carla_index = carla_lights & BridgeHelper._CARLA_INDEX_MASK
+        new_lights = BridgeHelper._CARLA_TO_SUMO_TABLE[emergency, carla_index]
+        return (current_lights & ~BridgeHelper._SUMO_MANAGED_SIGNALS) | new_lights
+
     @staticmethod
     def get_carla_lights_state(current_carla_lights, sumo_lights):
         """
         Returns carla vehicle light state based on sumo signals.
         """
-        current_lights = current_carla_lights
-
-        # Blinker right / emergency.
-        if (any([
-                bool(sumo_lights & SumoVehSignal.BLINKER_RIGHT),
-                bool(sumo_lights & SumoVehSignal.BLINKER_EMERGENCY)
-        ]) != bool(current_lights & carla.VehicleLightState.RightBlinker)):
-            current_lights ^= carla.VehicleLightState.RightBlinker
-
-        # Blinker left / emergency.
-        if (any([
-                bool(sumo_lights & SumoVehSignal.BLINKER_LEFT),
-                bool(sumo_lights & SumoVehSignal.BLINKER_EMERGENCY)
-        ]) != bool(current_lights & carla.VehicleLightState.LeftBlinker)):
-            current_lights ^= carla.VehicleLightState.LeftBlinker
-
-        # Break.
-        if (bool(sumo_lights & SumoVehSignal.BRAKELIGHT) !=
-                bool(current_lights & carla.VehicleLightState.Brake)):
-            current_lights ^= carla.VehicleLightState.Brake
-
-        # Front (low beam).
-        if (bool(sumo_lights & SumoVehSignal.FRONTLIGHT) !=
-                bool(current_lights & carla.VehicleLightState.LowBeam)):
-            current_lights ^= carla.VehicleLightState.LowBeam
-
-        # Fog.
-        if (bool(sumo_lights & SumoVehSignal.FOGLIGHT) !=
-                bool(current_lights & carla.VehicleLightState.Fog)):
-            current_lights ^= carla.VehicleLightState.Fog
-
-        # High beam.
-        if (bool(sumo_lights & SumoVehSignal.HIGHBEAM) !=
-                bool(current_lights & carla.VehicleLightState.HighBeam)):
-            current_lights ^= carla.VehicleLightState.HighBeam
-
-        # Backdrive (reverse).
-        if (bool(sumo_lights & SumoVehSignal.BACKDRIVE) !=
-                bool(current_lights & carla.VehicleLightState.Reverse)):
-            current_lights ^= carla.VehicleLightState.Reverse
-
-        # Door open left/right.
-        if (any([
-                bool(sumo_lights & SumoVehSignal.DOOR_OPEN_LEFT),
-                bool(sumo_lights & SumoVehSignal.DOOR_OPEN_RIGHT)
-        ]) != bool(current_lights & carla.VehicleLightState.Position)):
-            current_lights ^= carla.VehicleLightState.Position
-
-        return current_lights
+        new_lights = BridgeHelper.get_carla_lights_states([int(current_carla_lights)],
+                                                          [sumo_lights])
+        return int(new_lights[0])
 
     @staticmethod
     def get_sumo_lights_state(current_sumo_lights, carla_lights):
         """
         Returns sumo signals based on carla vehicle light state.
         """
-        current_lights = current_sumo_lights
-
-        # Blinker right.
-        if (bool(carla_lights & carla.VehicleLightState.RightBlinker) !=
-                bool(current_lights & SumoVehSignal.BLINKER_RIGHT)):
-            current_lights ^= SumoVehSignal.BLINKER_RIGHT
-
-        # Blinker left.
-        if (bool(carla_lights & carla.VehicleLightState.LeftBlinker) !=
-                bool(current_lights & SumoVehSignal.BLINKER_LEFT)):
-            current_lights ^= SumoVehSignal.BLINKER_LEFT
-
-        # Emergency.
-        if (all([
-                bool(carla_lights & carla.VehicleLightState.RightBlinker),
-                bool(carla_lights & carla.VehicleLightState.LeftBlinker)
-        ]) != (current_lights & SumoVehSignal.BLINKER_EMERGENCY)):
-            current_lights ^= SumoVehSignal.BLINKER_EMERGENCY
-
-        # Break.
-        if (bool(carla_lights & carla.VehicleLightState.Brake) !=
-                bool(current_lights & SumoVehSignal.BRAKELIGHT)):
-            current_lights ^= SumoVehSignal.BRAKELIGHT
-
-        # Front (low beam)
-        if (bool(carla_lights & carla.VehicleLightState.LowBeam) !=
-                bool(current_lights & SumoVehSignal.FRONTLIGHT)):
-            current_lights ^= SumoVehSignal.FRONTLIGHT
-
-        # Fog light.
-        if (bool(carla_lights & carla.VehicleLightState.Fog) !=
-                bool(current_lights & SumoVehSignal.FOGLIGHT)):
-            current_lights ^= SumoVehSignal.FOGLIGHT
-
-        # High beam ligth.
-        if (bool(carla_lights & carla.VehicleLightState.HighBeam) !=
-                bool(current_lights & SumoVehSignal.HIGHBEAM)):
-            current_lights ^= SumoVehSignal.HIGHBEAM
-
-        # Backdrive (reverse)
-        if (bool(carla_lights & carla.VehicleLightState.Reverse) !=
-                bool(current_lights & SumoVehSignal.BACKDRIVE)):
-            current_lights ^= SumoVehSignal.BACKDRIVE
-
-        return current_lights
+        new_lights = BridgeHelper.get_sumo_lights_states([current_sumo_lights], [int(carla_lights)])
+        return int(new_lights[0])
 
     @staticmethod
     def get_carla_traffic_light_state(sumo_tl_state):
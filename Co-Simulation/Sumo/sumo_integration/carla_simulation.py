@@ -11,10 +11,14 @@
 # -- imports ---------------------------------------------------------------------------------------
 # ==================================================================================================
 
+import collections
 import logging
 
+import numpy as np
+
 import carla  # pylint: disable=import-error
 
+from .actor_registry import ActorRegistry
 from .constants import INVALID_ACTOR_ID, SPAWN_OFFSET_Z
 
 # ==================================================================================================
@@ -34,11 +38,19 @@ class CarlaSimulation(object):
         self.blueprint_library = self.world.get_blueprint_library()
         self.step_length = step_length
 
+        # Vehicles of the simulation, updated from the world snapshot of each frame.
+        self.registry = ActorRegistry(self.world, 'vehicle.')
+
         # The following sets contain updated information for the current frame.
-        self._active_actors = set()
         self.spawned_actors = set()
         self.destroyed_actors = set()
 
+        # Number of commands sent to carla, by kind, during the current and the last frame. The
+        # 'rpc' entry counts the calls made to the server to send them, and to query the light
+        # states of the vehicles ('light_queries').
+        self._commands = collections.Counter()
+        self.frame_commands = collections.Counter()
+
         # Set traffic lights.
         self._tls = {}  # {landmark_id: traffic_ligth_actor}
 
@@ -55,20 +67,109 @@ class CarlaSimulation(object):
         """
         Accessor for carla actor.
         """
-        return self.world.get_actor(actor_id)
+        actor = self.registry.get_actor(actor_id)
+        if actor is None:
+            actor = self.world.get_actor(actor_id)
+        return actor
+
+    def get_actor_transform(self, actor_id):
+        """
+        Accessor for carla actor transform, as of the last tick.
+        """
+        transform = self.registry.get_transform(actor_id)
+        if transform is None:
+            transform = self.world.get_actor(actor_id).get_transform()
+        return transform
+
+    def get_actor_transforms(self, actor_ids):
+        """
+        Accessor for the transforms and bounding box extents of several carla actors, as of the last
+        tick.
+
+            :param actor_ids: list of actor ids.
+            :return: (locations, rotations, extents) arrays of shape (N, 3), in the order of the
+                ids. Rotations are (pitch, yaw, roll) in degrees.
+        """
+        registry = self.registry
+        rows = [registry.get_row(actor_id) for actor_id in actor_ids]
+        if all(row is not None for row in rows):
+            rows = np.array(rows, dtype=np.int64)
+            return registry.locations[rows], registry.rotations[rows], registry.extents[rows]
+
+        # Actors not tracked by the registry are read one by one.
+        locations = np.zeros((len(actor_ids), 3))
+        rotations = np.zeros((len(actor_ids), 3))
+        extents = np.zeros((len(actor_ids), 3))
+        for i, (actor_id, row) in enumerate(zip(actor_ids, rows)):
+            if row is not None:
+                locations[i] = registry.locations[row]
+                rotations[i] = registry.rotations[row]
+                extents[i] = registry.extents[row]
+            else:
+                transform = self.get_actor_transform(actor_id)
+                extent = self.get_actor_extent(actor_id)
+                locations[i] = (transform.location.x, transform.location.y, transform.location.z)
+                rotations[i] = (transform.rotation.pitch, transform.rotation.yaw,
+                                transform.rotation.roll)
+                extents[i] = (extent.x, extent.y, extent.z)
+        return locations, rotations, extents
+
+    def get_actor_extent(self, actor_id):
+        """
+        Accessor for carla actor bounding box extent.
+        """
+        extent = self.registry.get_extent(actor_id)
+        if extent is None:
+            extent = self.world.get_actor(actor_id).bounding_box.extent
+        return extent
 
-    # This is a workaround to fix synchronization issues when other carla clients remove an actor in
-    # carla without waiting for tick (e.g., running sumo co-simulation and manual control at the
-    # same time)
     def get_actor_light_state(self, actor_id):
         """
         Accessor for carla actor light state.
 
         If the actor is not alive, returns None.
         """
+        return self.get_actor_light_states([actor_id])[0]
+
+    def get_actor_light_states(self, actor_ids):
+        """
+        Accessor for the light states of several carla actors, as of the last tick. The lights
+        column of the registry is filled with a single call to the server per frame.
+
+            :param actor_ids: list of actor ids.
+            :return: list with the light state of each actor, as an int, or None if the actor is not
+                alive.
+        """
+        registry = self.registry
+        if registry.lights_frame != registry.frame:
+            registry.update_lights(self.world.get_vehicles_light_states())
+            self._count_commands(light_queries=1)
+
+        light_states = []
+        for actor_id in actor_ids:
+            row = registry.get_row(actor_id)
+            if row is not None:
+                lights = int(registry.lights[row])
+                light_states.append(lights if lights >= 0 else None)
+            else:
+                # Actors not tracked by the registry, such as the ones spawned since the last
+                # tick, are read one by one.
+                light_states.append(self._query_light_state(actor_id))
+        return light_states
+
+    # This is a workaround to fix synchronization issues when other carla clients remove an actor in
+    # carla without waiting for tick (e.g., running sumo co-simulation and manual control at the
+    # same time)
+    def _query_light_state(self, actor_id):
+        """
+        Reads the light state of an actor from the server, or None if the actor is not alive.
+        """
         try:
             actor = self.get_actor(actor_id)
-            return actor.get_light_state()
+            if actor is None:
+                return None
+            self._count_commands(light_queries=1)
+            return int(actor.get_light_state())
         except RuntimeError:
             return None
 
@@ -112,6 +213,7 @@ class CarlaSimulation(object):
             carla.command.SpawnActor(blueprint, transform).then(
                 carla.command.SetSimulatePhysics(carla.command.FutureActor, False))
         ]
+        self._count_commands(spawn=1)
         response = self.client.apply_batch_sync(batch, False)[0]
         if response.error:
             logging.error('Spawn carla actor failed. %s', response.error)
@@ -119,15 +221,55 @@ class CarlaSimulation(object):
 
         return response.actor_id
 
+    def spawn_actors(self, actors):
+        """
+        Spawns several actors with a single batch of commands.
+
+            :param actors: list of (blueprint, transform) of the actors to be spawned.
+            :return: list with the id of each actor if it is successfully spawned. Otherwise,
+                INVALID_ACTOR_ID.
+        """
+        if not actors:
+            return []
+
+        batch = []
+        for blueprint, transform in actors:
+            transform = carla.Transform(transform.location + carla.Location(0, 0, SPAWN_OFFSET_Z),
+                                        transform.rotation)
+            batch.append(
+                carla.command.SpawnActor(blueprint, transform).then(
+                    carla.command.SetSimulatePhysics(carla.command.FutureActor, False)))
+
+        self._count_commands(spawn=len(batch))
+        actor_ids = []
+        for response in self.client.apply_batch_sync(batch, False):
+            if response.error:
+                logging.error('Spawn carla actor failed. %s', response.error)
+                actor_ids.append(INVALID_ACTOR_ID)
+            else:
+                actor_ids.append(response.actor_id)
+        return actor_ids
+
     def destroy_actor(self, actor_id):
         """
         Destroys the given actor.
         """
-        actor = self.world.get_actor(actor_id)
+        actor = self.get_actor(actor_id)
         if actor is not None:
+            self._count_commands(destroy=1)
             return actor.destroy()
         return False
 
+    def destroy_actors(self, actor_ids):
+        """
+        Destroys the given actors with a single batch of commands. Actors that no longer exist are
+        ignored by the server.
+        """
+        batch = [carla.command.DestroyActor(actor_id) for actor_id in actor_ids]
+        if batch:
+            self._count_commands(destroy=len(batch))
+            self.client.apply_batch(batch)
+
     def synchronize_vehicle(self, vehicle_id, transform, lights=None):
         """
         Updates vehicle state.
@@ -137,15 +279,39 @@ class CarlaSimulation(object):
             :param lights: new vehicle light state.
             :return: True if successfully updated. Otherwise, False.
         """
-        vehicle = self.world.get_actor(vehicle_id)
+        vehicle = self.get_actor(vehicle_id)
         if vehicle is None:
             return False
 
         vehicle.set_transform(transform)
+        self._count_commands(transform=1)
         if lights is not None:
             vehicle.set_light_state(carla.VehicleLightState(lights))
+            self._count_commands(lights=1)
         return True
 
+    def synchronize_vehicles(self, vehicles):
+        """
+        Updates the state of several vehicles, sending all the transforms and light states of the
+        frame with a single batch of commands. Vehicles that no longer exist are ignored by the
+        server.
+
+            :param vehicles: list of (vehicle id, transform, lights) of the vehicles to be updated.
+                lights is the new vehicle light state, or None to leave it unchanged.
+        """
+        batch = []
+        num_lights = 0
+        for vehicle_id, transform, lights in vehicles:
+            batch.append(carla.command.ApplyTransform(vehicle_id, transform))
+            if lights is not None:
+                batch.append(
+                    carla.command.SetVehicleLightState(vehicle_id, carla.VehicleLightState(lights)))
+                num_lights += 1
+
+        if batch:
+            self._count_commands(transform=len(batch) - num_lights, lights=num_lights)
+            self.client.apply_batch(batch)
+
     def synchronize_traffic_light(self, landmark_id, state):
         """
         Updates traffic light state.
@@ -160,20 +326,27 @@ class CarlaSimulation(object):
 
         traffic_light = self._tls[landmark_id]
         traffic_light.set_state(state)
+        self._count_commands(traffic_light=1)
         return True
 
+    def _count_commands(self, **commands):
+        """
+        Adds the commands sent to carla with one call to the server to the counts of the frame.
+        """
+        self._commands.update(commands)
+        self._commands['rpc'] += 1
+
     def tick(self):
         """
         Tick to carla simulation.
         """
         self.world.tick()
 
+        self.frame_commands = self._commands
+        self._commands = collections.Counter()
+
         # Update data structures for the current frame.
-        current_actors = set(
-            [vehicle.id for vehicle in self.world.get_actors().filter('vehicle.*')])
-        self.spawned_actors = current_actors.difference(self._active_actors)
-        self.destroyed_actors = self._active_actors.difference(current_actors)
-        self._active_actors = current_actors
+        self.spawned_actors, self.destroyed_actors = self.registry.update(self.world.get_snapshot())
 
     def close(self):
         """
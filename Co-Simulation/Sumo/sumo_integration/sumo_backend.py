@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+""" This module selects the python API used to control sumo: traci or libsumo. """
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import logging
+
+import traci as _traci  # pylint: disable=import-error
+
+# Importing libsumo replaces the exceptions of the traci module by its own ones, but the traci
+# connections keep raising the original classes.
+_TRACI_EXCEPTION = _traci.exceptions.TraCIException
+
+try:
+    import libsumo as _libsumo  # pylint: disable=import-error
+except ImportError:
+    _libsumo = None
+
+# ==================================================================================================
+# -- sumo backend ----------------------------------------------------------------------------------
+# ==================================================================================================
+
+BACKENDS = ('traci', 'libsumo')
+
+
+class SumoBackend(object):
+    """
+    SumoBackend forwards the calls to the python module of the sumo backend in use:
+
+        * traci: sumo runs in its own process and is controlled through a TCP socket. It supports
+          sumo-gui, remote servers and several clients.
+        * libsumo: sumo runs inside the python process, without any socket. It is faster, but
+          doesn't support sumo-gui nor additional clients.
+
+    Both modules share the same API, so the co-simulation uses the module level 'traci' instance of
+    this class in place of the traci module. The constants and exceptions of traci are valid for
+    both backends.
+    """
+
+    constants = _traci.constants
+    exceptions = _traci.exceptions
+
+    def __init__(self):
+        self.name = 'traci'
+        self.module = _traci
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+    @property
+    def is_libsumo(self):
+        return self.name == 'libsumo'
+
+    @staticmethod
+    def is_available(name):
+        """
+        Returns whether the given backend can be used.
+        """
+        if name == 'libsumo':
+            return _libsumo is not None
+        return name == 'traci'
+
+    def select(self, name):
+        """
+        Selects the backend used by the following calls. Falls back to traci if libsumo is not
+        available.
+
+            :param name: 'traci' or 'libsumo'.
+            :return: name of the selected backend.
+        """
+        if name not in BACKENDS:
+            raise ValueError('Unknown sumo backend {}'.format(name))
+
+        if not self.is_available(name):
+            logging.warning('libsumo is not available, using traci instead')
+            name = 'traci'
+
+        self.name = name
+        self.module = _libsumo if name == 'libsumo' else _traci
+        return name
+
+    @property
+    def errors(self):
+        """
+        Exceptions raised by the backend when a command fails.
+        """
+        if self.is_libsumo:
+            return (_TRACI_EXCEPTION, _libsumo.TraCIException)
+        return (_TRACI_EXCEPTION, )
+
+
+traci = SumoBackend()  # pylint: disable=invalid-name
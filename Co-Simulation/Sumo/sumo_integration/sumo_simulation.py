@@ -18,9 +18,9 @@ import os
 
 import carla  # pylint: disable=import-error
 import sumolib  # pylint: disable=import-error
-import traci  # pylint: disable=import-error
 
 from .constants import INVALID_ACTOR_ID
+from .sumo_backend import traci
 
 import lxml.etree as ET  # pylint: disable=import-error
 
@@ -101,6 +101,14 @@ class SumoActorClass(enum.Enum):
 
 SumoActor = collections.namedtuple('SumoActor', 'type_id vclass transform signals extent color')
 
+# Variables of the vehicles retrieved at each step.
+VEHICLE_VARIABLES = [
+    traci.constants.VAR_TYPE, traci.constants.VAR_VEHICLECLASS, traci.constants.VAR_COLOR,
+    traci.constants.VAR_LENGTH, traci.constants.VAR_WIDTH, traci.constants.VAR_HEIGHT,
+    traci.constants.VAR_POSITION3D, traci.constants.VAR_ANGLE, traci.constants.VAR_SLOPE,
+    traci.constants.VAR_SPEED, traci.constants.VAR_SPEED_LAT, traci.constants.VAR_SIGNALS
+]
+
 # ==================================================================================================
 # -- sumo traffic lights ---------------------------------------------------------------------------
 # ==================================================================================================
@@ -284,6 +292,11 @@ class SumoTLManager(object):
 # -- sumo simulation -------------------------------------------------------------------------------
 # ==================================================================================================
 
+# Range of the context subscription of the vehicles. It is ignored for the simulation domain, which
+# returns all the vehicles.
+_VEHICLES_CONTEXT_RANGE = 1e6
+
+
 def _get_sumo_net(cfg_file):
     """
     Returns sumo net.
@@ -301,21 +314,27 @@ def _get_sumo_net(cfg_file):
     net_file = os.path.join(os.path.dirname(cfg_file), tag.get('value'))
     logging.debug('Reading net file: %s', net_file)
 
-    sumo_net = traci.sumolib.net.readNet(net_file)
+    sumo_net = sumolib.net.readNet(net_file)
     return sumo_net
 
 class SumoSimulation(object):
     """
     SumoSimulation is responsible for the management of the sumo simulation.
     """
-    def __init__(self, cfg_file, step_length, host=None, port=None, sumo_gui=False, client_order=1):
+    def __init__(self, cfg_file, step_length, host=None, port=None, sumo_gui=False, client_order=1,
+                 backend='traci'):
+        if backend == 'libsumo' and (sumo_gui is True or (host is not None and port is not None)):
+            logging.warning('libsumo runs sumo in process without gui, using traci instead')
+            backend = 'traci'
+        self.backend = traci.select(backend)
+
         if sumo_gui is True:
             sumo_binary = sumolib.checkBinary('sumo-gui')
         else:
             sumo_binary = sumolib.checkBinary('sumo')
 
         if host is None or port is None:
-            logging.info('Starting new sumo server...')
+            logging.info('Starting new sumo server (%s)...', self.backend)
             if sumo_gui is True:
                 logging.info('Remember to press the play button to start the simulation')
 
@@ -330,7 +349,17 @@ class SumoSimulation(object):
             logging.info('Connection to sumo server. Host: %s Port: %s', host, port)
             traci.init(host=host, port=port)
 
-        traci.setOrder(client_order)
+        if not traci.is_libsumo:
+            traci.setOrder(client_order)
+
+        # The variables of all the vehicles, and the departed and arrived vehicles, are retrieved
+        # with the results of each step, instead of subscribing to each vehicle.
+        traci.simulation.subscribe([
+            traci.constants.VAR_DEPARTED_VEHICLES_IDS, traci.constants.VAR_ARRIVED_VEHICLES_IDS
+        ])
+        traci.simulation.subscribeContext('', traci.constants.CMD_GET_VEHICLE_VARIABLE,
+                                          _VEHICLES_CONTEXT_RANGE, VEHICLE_VARIABLES)
+        self._vehicles = {}  # {actor_id: {variable: value}}
 
         # Retrieving net from configuration file.
         self.net = _get_sumo_net(cfg_file)
@@ -352,8 +381,15 @@ class SumoSimulation(object):
     def traffic_light_ids(self):
         return self.traffic_light_manager.get_all_landmarks()
 
+    @property
+    def actor_ids(self):
+        """
+        Ids of the vehicles in the simulation at the last step.
+        """
+        return set(self._vehicles)
+
     @staticmethod
-    def subscribe(actor_id):
+    def subscribe(actor_id):  # pylint: disable=unused-argument
         """
         Subscribe the given actor to the following variables:
 
@@ -366,20 +402,18 @@ class SumoSimulation(object):
             * Speed.
             * Lateral speed.
             * Signals.
+
+        All the vehicles are already subscribed to these variables with a single context
+        subscription, so this does nothing.
         """
-        traci.vehicle.subscribe(actor_id, [
-            traci.constants.VAR_TYPE, traci.constants.VAR_VEHICLECLASS, traci.constants.VAR_COLOR,
-            traci.constants.VAR_LENGTH, traci.constants.VAR_WIDTH, traci.constants.VAR_HEIGHT,
-            traci.constants.VAR_POSITION3D, traci.constants.VAR_ANGLE, traci.constants.VAR_SLOPE,
-            traci.constants.VAR_SPEED, traci.constants.VAR_SPEED_LAT, traci.constants.VAR_SIGNALS
-        ])
 
     @staticmethod
-    def unsubscribe(actor_id):
+    def unsubscribe(actor_id):  # pylint: disable=unused-argument
         """
         Unsubscribe the given actor from receiving updated information each step.
+
+        All the vehicles are subscribed with a single context subscription, so this does nothing.
         """
-        traci.vehicle.unsubscribe(actor_id)
 
     def get_net_offset(self):
         """
@@ -389,12 +423,15 @@ class SumoSimulation(object):
             return (0, 0)
         return self.net.getLocationOffset()
 
-    @staticmethod
-    def get_actor(actor_id):
+    def get_actor(self, actor_id):
         """
         Accessor for sumo actor.
+
+        If the actor is not in the simulation at the last step, returns None.
         """
-        results = traci.vehicle.getSubscriptionResults(actor_id)
+        results = self._vehicles.get(actor_id)
+        if results is None:
+            return None
 
         type_id = results[traci.constants.VAR_TYPE]
         vclass = SumoActorClass(results[traci.constants.VAR_VEHICLECLASS])
@@ -438,7 +475,7 @@ class SumoSimulation(object):
                     return INVALID_ACTOR_ID
 
             traci.vehicle.add(actor_id, 'carla_route_{}'.format(vclass), typeID=type_id)
-        except traci.exceptions.TraCIException as error:
+        except traci.errors as error:
             logging.error('Spawn sumo actor failed: %s', error)
             return INVALID_ACTOR_ID
 
@@ -506,8 +543,10 @@ class SumoSimulation(object):
         self.traffic_light_manager.tick()
 
         # Update data structures for the current frame.
-        self.spawned_actors = set(traci.simulation.getDepartedIDList())
-        self.destroyed_actors = set(traci.simulation.getArrivedIDList())
+        results = traci.simulation.getSubscriptionResults()
+        self.spawned_actors = set(results[traci.constants.VAR_DEPARTED_VEHICLES_IDS])
+        self.destroyed_actors = set(results[traci.constants.VAR_ARRIVED_VEHICLES_IDS])
+        self._vehicles = traci.simulation.getContextSubscriptionResults('') or {}
 
     @staticmethod
     def close():
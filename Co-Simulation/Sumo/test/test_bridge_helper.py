@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+"""
+Tests of the vectorized conversions of the BridgeHelper against the per vehicle implementation
+they replaced.
+"""
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import math
+import os
+import sys
+import unittest
+
+import numpy as np
+
+import carla  # pylint: disable=import-error
+
+if 'SUMO_HOME' in os.environ:
+    sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sumo_integration.bridge_helper import BridgeHelper  # pylint: disable=wrong-import-position
+from sumo_integration.sumo_simulation import SumoVehSignal  # pylint: disable=wrong-import-position
+
+# ==================================================================================================
+# -- reference implementation ----------------------------------------------------------------------
+# ==================================================================================================
+
+# Number of bits of the carla light states and the sumo signals.
+CARLA_LIGHT_BITS = 11
+SUMO_SIGNAL_BITS = 14
+
+
+def reference_carla_transform(location, rotation, extent_x, offset):
+    """
+    Per vehicle conversion of a sumo transform, as (location, rotation) tuples.
+    """
+    yaw = -1 * rotation[1] + 90
+    pitch = rotation[0]
+    out_location = (location[0] - math.cos(math.radians(yaw)) * extent_x,
+                    location[1] - math.sin(math.radians(yaw)) * extent_x,
+                    location[2] - math.sin(math.radians(pitch)) * extent_x)
+    out_location = (out_location[0] - offset[0], out_location[1] - offset[1], out_location[2])
+    return ((out_location[0], -out_location[1], out_location[2]),
+            (rotation[0], rotation[1] - 90, rotation[2]))
+
+
+def reference_sumo_transform(location, rotation, extent_x, offset):
+    """
+    Per vehicle conversion of a carla transform, as (location, rotation) tuples.
+    """
+    yaw = -1 * rotation[1]
+    pitch = rotation[0]
+    out_location = (location[0] + math.cos(math.radians(yaw)) * extent_x,
+                    location[1] - math.sin(math.radians(yaw)) * extent_x,
+                    location[2] - math.sin(math.radians(pitch)) * extent_x)
+    out_location = (out_location[0] + offset[0], out_location[1] - offset[1], out_location[2])
+    return ((out_location[0], -out_location[1], out_location[2]),
+            (rotation[0], rotation[1] + 90, rotation[2]))
+
+
+def reference_carla_lights_state(current_carla_lights, sumo_lights):
+    """
+    Per vehicle conversion of sumo signals into a carla light state.
+    """
+    current_lights = current_carla_lights
+
+    # Blinker right / emergency.
+    if (any([
+            bool(sumo_lights & SumoVehSignal.BLINKER_RIGHT),
+            bool(sumo_lights & SumoVehSignal.BLINKER_EMERGENCY)
+    ]) != bool(current_lights & carla.VehicleLightState.RightBlinker)):
+        current_lights ^= carla.VehicleLightState.RightBlinker
+
+    # Blinker left / emergency.
+    if (any([
+            bool(sumo_lights & SumoVehSignal.BLINKER_LEFT),
+            bool(sumo_lights & SumoVehSignal.BLINKER_EMERGENCY)
+    ]) != bool(current_lights & carla.VehicleLightState.LeftBlinker)):
+        current_lights ^= carla.VehicleLightState.LeftBlinker
+
+    # Break.
+    if (bool(sumo_lights & SumoVehSignal.BRAKELIGHT) !=
+            bool(current_lights & carla.VehicleLightState.Brake)):
+        current_lights ^= carla.VehicleLightState.Brake
+
+    # Front (low beam).
+    if (bool(sumo_lights & SumoVehSignal.FRONTLIGHT) !=
+            bool(current_lights & carla.VehicleLightState.LowBeam)):
+        current_lights ^= carla.VehicleLightState.LowBeam
+
+    # Fog.
+    if (bool(sumo_lights & SumoVehSignal.FOGLIGHT) !=
+            bool(current_lights & carla.VehicleLightState.Fog)):
+        current_lights ^= carla.VehicleLightState.Fog
+
+    # High beam.
+    if (bool(sumo_lights & SumoVehSignal.HIGHBEAM) !=
+            bool(current_lights & carla.VehicleLightState.HighBeam)):
+        current_lights ^= carla.VehicleLightState.HighBeam
+
+    # Backdrive (reverse).
+    if (bool(sumo_lights & SumoVehSignal.BACKDRIVE) !=
+            bool(current_lights & carla.VehicleLightState.Reverse)):
+        current_lights ^= carla.VehicleLightState.Reverse
+
+    # Door open left/right.
+    if (any([
+            bool(sumo_lights & SumoVehSignal.DOOR_OPEN_LEFT),
+            bool(sumo_lights & SumoVehSignal.DOOR_OPEN_RIGHT)
+    ]) != bool(current_lights & carla.VehicleLightState.Position)):
+        current_lights ^= carla.VehicleLightState.Position
+
+    return current_lights
+
+
+def reference_sumo_lights_state(current_sumo_lights, carla_lights):
+    """
+    Per vehicle conversion of a carla light state into sumo signals. The emergency signal
+    compares a bool with the signal bit, so it is switched off whenever it is on, and switched on
+    when both blinkers are on.
+    """
+    current_lights = current_sumo_lights
+
+    # Blinker right.
+    if (bool(carla_lights & carla.VehicleLightState.RightBlinker) !=
+            bool(current_lights & SumoVehSignal.BLINKER_RIGHT)):
+        current_lights ^= SumoVehSignal.BLINKER_RIGHT
+
+    # Blinker left.
+    if (bool(carla_lights & carla.VehicleLightState.LeftBlinker) !=
+            bool(current_lights & SumoVehSignal.BLINKER_LEFT)):
+        current_lights ^= SumoVehSignal.BLINKER_LEFT
+
+    # Emergency.
+    if (all([
+            bool(carla_lights & carla.VehicleLightState.RightBlinker),
+            bool(carla_lights & carla.VehicleLightState.LeftBlinker)
+    ]) != (current_lights & SumoVehSignal.BLINKER_EMERGENCY)):
+        current_lights ^= SumoVehSignal.BLINKER_EMERGENCY
+
+    # Break.
+    if (bool(carla_lights & carla.VehicleLightState.Brake) !=
+            bool(current_lights & SumoVehSignal.BRAKELIGHT)):
+        current_lights ^= SumoVehSignal.BRAKELIGHT
+
+    # Front (low beam)
+    if (bool(carla_lights & carla.VehicleLightState.LowBeam) !=
+            bool(current_lights & SumoVehSignal.FRONTLIGHT)):
+        current_lights ^= SumoVehSignal.FRONTLIGHT
+
+    # Fog light.
+    if (bool(carla_lights & carla.VehicleLightState.Fog) !=
+            bool(current_lights & SumoVehSignal.FOGLIGHT)):
+        current_lights ^= SumoVehSignal.FOGLIGHT
+
+    # High beam ligth.
+    if (bool(carla_lights & carla.VehicleLightState.HighBeam) !=
+            bool(current_lights & SumoVehSignal.HIGHBEAM)):
+        current_lights ^= SumoVehSignal.HIGHBEAM
+
+    # Backdrive (reverse)
+    if (bool(carla_lights & carla.VehicleLightState.Reverse) !=
+            bool(current_lights & SumoVehSignal.BACKDRIVE)):
+        current_lights ^= SumoVehSignal.BACKDRIVE
+
+    return current_lights
+
+
+# ==================================================================================================
+# -- tests -----------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class TestBridgeHelper(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.offset = BridgeHelper.offset
+        BridgeHelper.offset = (123.4, -56.7)
+
+    def tearDown(self):
+        BridgeHelper.offset = self.offset
+
+    def random_transforms(self, n):
+        locations = self.rng.uniform(-1000.0, 1000.0, (n, 3))
+        rotations = self.rng.uniform(-180.0, 180.0, (n, 3))
+        extents = self.rng.uniform(0.5, 10.0, (n, 3))
+        return locations, rotations, extents
+
+    def check_transforms(self, convert, reference):
+        locations, rotations, extents = self.random_transforms(500)
+        for extent_argument in (extents, extents[:, 0]):
+            transforms = convert(locations, rotations, extent_argument)
+            self.assertEqual(len(transforms), len(locations))
+            for i, transform in enumerate(transforms):
+                expected_location, expected_rotation = reference(
+                    locations[i].tolist(), rotations[i].tolist(), float(extents[i, 0]),
+                    BridgeHelper.offset)
+                np.testing.assert_allclose(transform['location'], expected_location, atol=1e-9)
+                np.testing.assert_allclose(transform['rotation'], expected_rotation, atol=1e-9)
+
+    def test_carla_transforms(self):
+        self.check_transforms(BridgeHelper.get_carla_transforms, reference_carla_transform)
+
+    def test_sumo_transforms(self):
+        self.check_transforms(BridgeHelper.get_sumo_transforms, reference_sumo_transform)
+
+    def test_single_transforms(self):
+        locations, rotations, extents = self.random_transforms(20)
+        for location, rotation, extent in zip(locations, rotations, extents):
+            transform = carla.Transform(carla.Location(*location.tolist()),
+                                        carla.Rotation(*rotation.tolist()))
+            extent = carla.Vector3D(*extent.tolist())
+            conversions = ((BridgeHelper.get_carla_transform, reference_carla_transform),
+                           (BridgeHelper.get_sumo_transform, reference_sumo_transform))
+            for convert, reference in conversions:
+                out = convert(transform, extent)
+                expected_location, expected_rotation = reference(
+                    location.tolist(), rotation.tolist(), extent.x, BridgeHelper.offset)
+                np.testing.assert_allclose([out.location.x, out.location.y, out.location.z],
+                                           expected_location, atol=1e-6)
+                np.testing.assert_allclose(
+                    [out.rotation.pitch, out.rotation.yaw, out.rotation.roll], expected_rotation,
+                    atol=1e-6)
+
+    def test_carla_lights_states(self):
+        # Every sumo signal combination with random carla lights, and every carla light
+        # combination with random sumo signals.
+        all_signals = np.arange(1 << SUMO_SIGNAL_BITS)
+        all_lights = np.arange(1 << CARLA_LIGHT_BITS)
+        for current_lights, sumo_lights in (
+                (self.rng.randint(0, 1 << CARLA_LIGHT_BITS, len(all_signals)), all_signals),
+                (all_lights, self.rng.randint(0, 1 << SUMO_SIGNAL_BITS, len(all_lights)))):
+            new_lights = BridgeHelper.get_carla_lights_states(current_lights, sumo_lights)
+            expected = [reference_carla_lights_state(current, signals)
+                        for current, signals in zip(current_lights.tolist(), sumo_lights.tolist())]
+            self.assertEqual(new_lights.tolist(), expected)
+
+    def test_sumo_lights_states(self):
+        # Every carla light combination with and without the emergency signal on, and every sumo
+        # signal combination with random carla lights.
+        all_lights = np.arange(1 << CARLA_LIGHT_BITS)
+        all_signals = np.arange(1 << SUMO_SIGNAL_BITS)
+        for current_signals, carla_lights in (
+                (np.zeros(len(all_lights), dtype=np.int64), all_lights),
+                (np.full(len(all_lights), SumoVehSignal.BLINKER_EMERGENCY), all_lights),
+                (all_signals, self.rng.randint(0, 1 << CARLA_LIGHT_BITS, len(all_signals)))):
+            new_signals = BridgeHelper.get_sumo_lights_states(current_signals, carla_lights)
+            expected = [reference_sumo_lights_state(current, lights)
+                        for current, lights in zip(current_signals.tolist(), carla_lights.tolist())]
+            self.assertEqual(new_signals.tolist(), expected)
+
+    def test_emergency_signal_toggles(self):
+        # With both blinkers on, the emergency signal alternates between frames.
+        blinkers = (int(carla.VehicleLightState.RightBlinker) |
+                    int(carla.VehicleLightState.LeftBlinker))
+        signals = 0
+        emergency = []
+        for _ in range(4):
+            signals = BridgeHelper.get_sumo_lights_state(signals, blinkers)
+            emergency.append(bool(signals & SumoVehSignal.BLINKER_EMERGENCY))
+        self.assertEqual(emergency, [True, False, True, False])
+
+    def test_single_lights_states(self):
+        for current, signals in self.rng.randint(0, 1 << CARLA_LIGHT_BITS, (50, 2)).tolist():
+            self.assertEqual(BridgeHelper.get_carla_lights_state(current, signals),
+                             reference_carla_lights_state(current, signals))
+            self.assertEqual(BridgeHelper.get_sumo_lights_state(signals, current),
+                             reference_sumo_lights_state(signals, current))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Benchmark of the sumo backends of the co-simulation.
+
+Runs the sumo simulation alone with traci and libsumo, keeping a given number of vehicles on the
+net, and measures the latency of each step, including the retrieval of the state of all the
+vehicles.
+"""
+
+# ==================================================================================================
+# -- imports ---------------------------------------------------------------------------------------
+# ==================================================================================================
+
+import argparse
+import glob
+import itertools
+import logging
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+# ==================================================================================================
+# -- find carla module -----------------------------------------------------------------------------
+# ==================================================================================================
+
+try:
+    sys.path.append(
+        glob.glob('../../../PythonAPI/carla/dist/carla-*%d.%d-%s.egg' %
+                  (sys.version_info.major, sys.version_info.minor,
+                   'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+# ==================================================================================================
+# -- find traci module -----------------------------------------------------------------------------
+# ==================================================================================================
+
+if 'SUMO_HOME' in os.environ:
+    sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+# ==================================================================================================
+# -- sumo integration imports ----------------------------------------------------------------------
+# ==================================================================================================
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sumo_integration.sumo_backend import traci  # pylint: disable=wrong-import-position
+from sumo_integration.sumo_simulation import SumoSimulation  # pylint: disable=wrong-import-position
+
+# ==================================================================================================
+# -- main ------------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+# Sequential id of the vehicles added by the benchmark.
+_VEHICLE_IDS = itertools.count()
+
+
+def add_vehicles(edges, count):
+    """
+    Adds vehicles with random routes between the given edges.
+    """
+    added = 0
+    while added < count:
+        origin, destination = random.sample(edges, 2)
+        route = traci.simulation.findRoute(origin.getID(), destination.getID()).edges
+        if len(route) < 2:
+            continue
+
+        vehicle_id = 'benchmark_{}'.format(next(_VEHICLE_IDS))
+        traci.route.add(vehicle_id, route)
+        traci.vehicle.add(vehicle_id, vehicle_id, departLane='best', departPos='random')
+        added += 1
+
+
+def run(args, backend, num_vehicles):
+    """
+    Runs the sumo simulation with the given backend and number of vehicles.
+
+        :return: (step times in seconds, mean number of vehicles).
+    """
+    sumo_simulation = SumoSimulation(args.sumo_cfg_file, args.step_length, backend=backend)
+    edges = [edge for edge in sumo_simulation.net.getEdges() if edge.allows('passenger')]
+
+    try:
+        add_vehicles(edges, num_vehicles)
+        for _ in range(args.warmup):
+            sumo_simulation.tick()
+
+        times = []
+        vehicles = []
+        for _ in range(args.steps):
+            start = time.time()
+            sumo_simulation.tick()
+            actors = [sumo_simulation.get_actor(actor_id) for actor_id in sumo_simulation.actor_ids]
+            times.append(time.time() - start)
+            vehicles.append(len(actors))
+
+            # Keeping the number of vehicles.
+            add_vehicles(edges, len(sumo_simulation.destroyed_actors))
+
+        return times, np.mean(vehicles)
+
+    finally:
+        sumo_simulation.close()
+
+
+def main(args):
+    """
+    Runs the benchmark for all the backends and number of vehicles.
+    """
+    random.seed(args.seed)
+
+    print('{:<10} {:>10} {:>10} {:>12} {:>10} {:>14}'.format('backend', 'vehicles', 'present',
+                                                              'mean (ms)', 'p95', 'per vehicle'))
+    for backend in args.backends.split(','):
+        if not traci.is_available(backend):
+            print('{:<10} not available'.format(backend))
+            continue
+
+        for num_vehicles in [int(n) for n in args.vehicles.split(',')]:
+            times, present = run(args, backend, num_vehicles)
+            times = np.array(times) * 1000.0
+            print('{:<10} {:>10} {:>10.0f} {:>12.3f} {:>10.3f} {:>14.4f}'.format(
+                backend, num_vehicles, present, np.mean(times), np.percentile(times, 95),
+                np.mean(times) / max(present, 1.0)))
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('sumo_cfg_file', type=str, help='sumo configuration file')
+    argparser.add_argument('--backends',
+                           default='traci,libsumo',
+                           help='comma separated sumo backends (default: traci,libsumo)')
+    argparser.add_argument('-n',
+                           '--vehicles',
+                           default='100,500,1000',
+                           help='comma separated number of vehicles (default: 100,500,1000)')
+    argparser.add_argument('--steps',
+                           default=500,
+                           type=int,
+                           help='number of measured steps (default: 500)')
+    argparser.add_argument('--warmup',
+                           default=100,
+                           type=int,
+                           help='number of steps before measuring, to insert the vehicles '
+                           '(default: 100)')
+    argparser.add_argument('--step-length',
+                           default=0.05,
+                           type=float,
+                           help='set fixed delta seconds (default: 0.05s)')
+    argparser.add_argument('-s', '--seed', default=0, type=int, help='random seed (default: 0)')
+    argparser.add_argument('--debug', action='store_true', help='enable debug messages')
+    arguments = argparser.parse_args()
+
+    if arguments.debug:
+        logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
+    else:
+        logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
+
+    try:
+        main(arguments)
+    except KeyboardInterrupt:
+        print('\nCancelled by user. Bye!')
@@ -11,11 +11,15 @@ It can also make use of the global route planner to follow a specifed route
 
 import carla
 from enum import Enum
-from shapely.geometry import Polygon
+import numpy as np
 
 from agents.navigation.local_planner import LocalPlanner
 from agents.navigation.global_route_planner import GlobalRoutePlanner
-from agents.tools.misc import get_speed, is_within_distance, get_trafficlight_trigger_location, compute_distance
+from agents.tools.geometry import convex_polygons_intersect, corridor_polygons
+from agents.tools.misc import is_within_distance, compute_distance
+from agents.tools.profiler import AgentProfiler
+from agents.tools.traffic_light_index import TrafficLightIndex
+from agents.tools.world_state import WorldStateCache
 
 
 class BasicAgent(object):
@@ -26,7 +30,7 @@ class BasicAgent(object):
     as well as to change its parameters in case a different driving mode is desired.
     """
 
-    def __init__(self, vehicle, target_speed=20, opt_dict={}):
+    def __init__(self, vehicle, target_speed=20, opt_dict=None):
         """
         Initialization the agent paramters, the local and the global planner.
 
@@ -49,8 +53,13 @@ class BasicAgent(object):
         self._base_tlight_threshold = 5.0  # meters
         self._base_vehicle_threshold = 5.0  # meters
         self._max_brake = 0.5
+        self._topology_cache_dir = None
+        self._incremental_planning = False
+        self._route_array = False
+        self._profiler = AgentProfiler()
 
-        # Change parameters according to the dictionary
+        # Change parameters according to the dictionary, without modifying the one of the caller
+        opt_dict = dict(opt_dict) if opt_dict is not None else {}
         opt_dict['target_speed'] = target_speed
         if 'ignore_traffic_lights' in opt_dict:
             self._ignore_traffic_lights = opt_dict['ignore_traffic_lights']
@@ -66,10 +75,23 @@ class BasicAgent(object):
             self._base_vehicle_threshold = opt_dict['base_vehicle_threshold']
         if 'max_brake' in opt_dict:
             self._max_steering = opt_dict['max_brake']
+        if 'topology_cache_dir' in opt_dict:
+            self._topology_cache_dir = opt_dict['topology_cache_dir']
+        if 'incremental_planning' in opt_dict:
+            self._incremental_planning = opt_dict['incremental_planning']
+        if 'route_array' in opt_dict:
+            self._route_array = opt_dict['route_array']
+        if 'profiler' in opt_dict:
+            self._profiler = opt_dict['profiler']
+
+        # State of the actors, shared with the other agents of the process
+        self._world_state = WorldStateCache.get(self._world, self._map)
+        self._traffic_light_index = TrafficLightIndex.get(self._world, self._map)
 
         # Initialize the planners
-        self._local_planner = LocalPlanner(self._vehicle, opt_dict=opt_dict)
-        self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+        self._local_planner = LocalPlanner(self._vehicle, opt_dict=dict(opt_dict, profiler=self._profiler))
+        self._global_planner = GlobalRoutePlanner(
+            self._map, self._sampling_resolution, cache_dir=self._topology_cache_dir)
 
     def add_emergency_stop(self, control):
         """
@@ -106,6 +128,10 @@ class BasicAgent(object):
         """Get method for protected member local planner"""
         return self._global_planner
 
+    def get_profiler(self):
+        """Get method for protected member profiler, disabled unless enabled by the user"""
+        return self._profiler
+
     def set_destination(self, end_location, start_location=None):
         """
         This method creates a list of waypoints between a starting and ending location,
@@ -126,14 +152,19 @@ class BasicAgent(object):
         start_waypoint = self._map.get_waypoint(start_location)
         end_waypoint = self._map.get_waypoint(end_location)
 
-        route_trace = self.trace_route(start_waypoint, end_waypoint)
+        if self._route_array:
+            # The local planner only retrieves the waypoints of the route as they become targets
+            route_trace = self._global_planner.trace_route_array(
+                start_waypoint.transform.location, end_waypoint.transform.location, self._incremental_planning)
+        else:
+            route_trace = self.trace_route(start_waypoint, end_waypoint)
         self._local_planner.set_global_plan(route_trace, clean_queue=clean_queue)
 
     def set_global_plan(self, plan, stop_waypoint_creation=True, clean_queue=True):
         """
         Adds a specific plan to the agent.
 
-            :param plan: list of [carla.Waypoint, RoadOption] representing the route to be followed
+            :param plan: list of [carla.Waypoint, RoadOption], or RouteArray, representing the route to be followed
             :param stop_waypoint_creation: stops the automatic random creation of waypoints
             :param clean_queue: resets the current agent's plan
         """
@@ -146,38 +177,44 @@ class BasicAgent(object):
     def trace_route(self, start_waypoint, end_waypoint):
         """
         Calculates the shortest route between a starting and ending waypoint.
+        With incremental planning, consecutive routes towards the same destination repair the previous
+        search instead of starting from scratch, accounting for the edge costs changed in between.
 
             :param start_waypoint (carla.Waypoint): initial waypoint
             :param end_waypoint (carla.Waypoint): final waypoint
         """
         start_location = start_waypoint.transform.location
         end_location = end_waypoint.transform.location
+        if self._incremental_planning:
+            return self._global_planner.replan_route(start_location, end_location)
         return self._global_planner.trace_route(start_location, end_location)
 
     def run_step(self):
         """Execute one step of navigation."""
         hazard_detected = False
+        profiler = self._profiler
 
         # Retrieve all relevant actors
-        actor_list = self._world.get_actors()
-        vehicle_list = actor_list.filter("*vehicle*")
-        lights_list = actor_list.filter("*traffic_light*")
-
-        vehicle_speed = get_speed(self._vehicle) / 3.6
+        with profiler.phase('actors'):
+            self._world_state.update()
+            vehicle_speed = self._world_state.speed(self._vehicle) / 3.6
 
         # Check for possible vehicle obstacles
-        max_vehicle_distance = self._base_vehicle_threshold + vehicle_speed
-        affected_by_vehicle, _, _ = self._vehicle_obstacle_detected(vehicle_list, max_vehicle_distance)
+        with profiler.phase('obstacles'):
+            max_vehicle_distance = self._base_vehicle_threshold + vehicle_speed
+            affected_by_vehicle, _, _ = self._vehicle_obstacle_detected(max_distance=max_vehicle_distance)
         if affected_by_vehicle:
             hazard_detected = True
 
         # Check if the vehicle is affected by a red traffic light
-        max_tlight_distance = self._base_tlight_threshold + vehicle_speed
-        affected_by_tlight, _ = self._affected_by_traffic_light(lights_list, max_tlight_distance)
+        with profiler.phase('traffic_lights'):
+            max_tlight_distance = self._base_tlight_threshold + vehicle_speed
+            affected_by_tlight, _ = self._affected_by_traffic_light(max_distance=max_tlight_distance)
         if affected_by_tlight:
             hazard_detected = True
 
-        control = self._local_planner.run_step()
+        with profiler.phase('local_planner'):
+            control = self._local_planner.run_step()
         if hazard_detected:
             control = self.add_emergency_stop(control)
 
@@ -211,8 +248,8 @@ class BasicAgent(object):
         if self._ignore_traffic_lights:
             return (False, None)
 
-        if not lights_list:
-            lights_list = self._world.get_actors().filter("*traffic_light*")
+        self._world_state.update()
+        light_ids = set(traffic_light.id for traffic_light in lights_list) if lights_list else None
 
         if not max_distance:
             max_distance = self._base_tlight_threshold
@@ -223,19 +260,17 @@ class BasicAgent(object):
             else:
                 return (True, self._last_traffic_light)
 
-        ego_vehicle_location = self._vehicle.get_location()
-        ego_vehicle_waypoint = self._map.get_waypoint(ego_vehicle_location)
+        ego_vehicle_waypoint = self._world_state.waypoint(self._vehicle)
+        ve_dir = ego_vehicle_waypoint.transform.get_forward_vector()
 
-        for traffic_light in lights_list:
-            object_location = get_trafficlight_trigger_location(traffic_light)
-            object_waypoint = self._map.get_waypoint(object_location)
-
-            if object_waypoint.road_id != ego_vehicle_waypoint.road_id:
+        # Only the lights whose trigger volume is on the road of the ego can affect it
+        for trigger in self._traffic_light_index.on_road(ego_vehicle_waypoint.road_id):
+            traffic_light = trigger.traffic_light
+            if light_ids is not None and traffic_light.id not in light_ids:
                 continue
 
-            ve_dir = ego_vehicle_waypoint.transform.get_forward_vector()
-            wp_dir = object_waypoint.transform.get_forward_vector()
-            dot_ve_wp = ve_dir.x * wp_dir.x + ve_dir.y * wp_dir.y + ve_dir.z * wp_dir.z
+            wp_dir = trigger.direction
+            dot_ve_wp = ve_dir.x * wp_dir[0] + ve_dir.y * wp_dir[1] + ve_dir.z * wp_dir[2]
 
             if dot_ve_wp < 0:
                 continue
@@ -243,7 +278,8 @@ class BasicAgent(object):
             if traffic_light.state != carla.TrafficLightState.Red:
                 continue
 
-            if is_within_distance(object_waypoint.transform, self._vehicle.get_transform(), max_distance, [0, 90]):
+            if is_within_distance(trigger.waypoint.transform, self._world_state.transform(self._vehicle),
+                                  max_distance, [0, 90]):
                 self._last_traffic_light = traffic_light
                 return (True, traffic_light)
 
@@ -261,14 +297,13 @@ class BasicAgent(object):
         if self._ignore_vehicles:
             return (False, None, -1)
 
-        if not vehicle_list:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
+        self._world_state.update()
 
         if not max_distance:
             max_distance = self._base_vehicle_threshold
 
-        ego_transform = self._vehicle.get_transform()
-        ego_wpt = self._map.get_waypoint(self._vehicle.get_location())
+        ego_transform = self._world_state.transform(self._vehicle)
+        ego_wpt = self._world_state.waypoint(self._vehicle)
 
         # Get the right offset
         if ego_wpt.lane_id < 0 and lane_offset != 0:
@@ -276,7 +311,17 @@ class BasicAgent(object):
 
         # Get the transform of the front of the ego
         ego_forward_vector = ego_transform.get_forward_vector()
-        ego_extent = self._vehicle.bounding_box.extent.x
+        ego_extent = self._world_state.bounding_box(self._vehicle).extent.x
+
+        # Only check the vehicles that can be closer than max_distance, measured from the front of the ego
+        # to the rear of the target, or to its center at junctions
+        search_radius = max_distance + ego_extent + self._world_state.max_extent()
+        if not vehicle_list:
+            vehicle_list = self._world_state.nearby(ego_transform.location, search_radius, "*vehicle*", planar=True)
+        else:
+            nearby_ids = set(a.id for a in self._world_state.nearby(ego_transform.location, search_radius, "*", True))
+            vehicle_list = [v for v in vehicle_list if v.id in nearby_ids or self._world_state.index(v) is None]
+
         ego_front_transform = ego_transform
         ego_front_transform.location += carla.Location(
             x=ego_extent * ego_forward_vector.x,
@@ -284,8 +329,8 @@ class BasicAgent(object):
         )
 
         for target_vehicle in vehicle_list:
-            target_transform = target_vehicle.get_transform()
-            target_wpt = self._map.get_waypoint(target_transform.location, lane_type=carla.LaneType.Any)
+            target_transform = self._world_state.transform(target_vehicle)
+            target_wpt = self._world_state.waypoint(target_vehicle, lane_type=carla.LaneType.Any)
 
             # Simplified version for outside junctions
             if not ego_wpt.is_junction or not target_wpt.is_junction:
@@ -298,7 +343,7 @@ class BasicAgent(object):
                         continue
 
                 target_forward_vector = target_transform.get_forward_vector()
-                target_extent = target_vehicle.bounding_box.extent.x
+                target_extent = self._world_state.bounding_box(target_vehicle).extent.x
                 target_rear_transform = target_transform
                 target_rear_transform.location -= carla.Location(
                     x=target_extent * target_forward_vector.x,
@@ -310,45 +355,48 @@ class BasicAgent(object):
 
             # Waypoints aren't reliable, check the proximity of the vehicle to the route
             else:
-                route_bb = []
+                route_left = []
+                route_right = []
                 ego_location = ego_transform.location
-                extent_y = self._vehicle.bounding_box.extent.y
+                extent_y = self._world_state.bounding_box(self._vehicle).extent.y
                 r_vec = ego_transform.get_right_vector()
-                p1 = ego_location + carla.Location(extent_y * r_vec.x, extent_y * r_vec.y)
-                p2 = ego_location + carla.Location(-extent_y * r_vec.x, -extent_y * r_vec.y)
-                route_bb.append([p1.x, p1.y, p1.z])
-                route_bb.append([p2.x, p2.y, p2.z])
+                route_left.append([ego_location.x + extent_y * r_vec.x, ego_location.y + extent_y * r_vec.y])
+                route_right.append([ego_location.x - extent_y * r_vec.x, ego_location.y - extent_y * r_vec.y])
 
                 for wp, _ in self._local_planner.get_plan():
                     if ego_location.distance(wp.transform.location) > max_distance:
                         break
 
                     r_vec = wp.transform.get_right_vector()
-                    p1 = wp.transform.location + carla.Location(extent_y * r_vec.x, extent_y * r_vec.y)
-                    p2 = wp.transform.location + carla.Location(-extent_y * r_vec.x, -extent_y * r_vec.y)
-                    route_bb.append([p1.x, p1.y, p1.z])
-                    route_bb.append([p2.x, p2.y, p2.z])
+                    wp_location = wp.transform.location
+                    route_left.append([wp_location.x + extent_y * r_vec.x, wp_location.y + extent_y * r_vec.y])
+                    route_right.append([wp_location.x - extent_y * r_vec.x, wp_location.y - extent_y * r_vec.y])
 
-                if len(route_bb) < 3:
+                if len(route_left) < 2:
                     # 2 points don't create a polygon, nothing to check
                     return (False, None, -1)
-                ego_polygon = Polygon(route_bb)
+                route_polygons = corridor_polygons(route_left, route_right)
 
-                # Compare the two polygons
+                # Compare the route with the bounding boxes of all the close vehicles at once
+                target_vehicles = []
+                target_locations = []
                 for target_vehicle in vehicle_list:
-                    target_extent = target_vehicle.bounding_box.extent.x
                     if target_vehicle.id == self._vehicle.id:
                         continue
-                    if ego_location.distance(target_vehicle.get_location()) > max_distance:
+                    target_location = self._world_state.location(target_vehicle)
+                    if ego_location.distance(target_location) > max_distance:
                         continue
+                    target_vehicles.append(target_vehicle)
+                    target_locations.append(target_location)
 
-                    target_bb = target_vehicle.bounding_box
-                    target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
-                    target_list = [[v.x, v.y, v.z] for v in target_vertices]
-                    target_polygon = Polygon(target_list)
+                if not target_vehicles:
+                    return (False, None, -1)
+                target_vertices = self._world_state.bounding_box_vertices(target_vehicles)
+                overlaps = np.any(convex_polygons_intersect(route_polygons, target_vertices), axis=0)
 
-                    if ego_polygon.intersects(target_polygon):
-                        return (True, target_vehicle, compute_distance(target_vehicle.get_location(), ego_location))
+                for target_vehicle, target_location, overlap in zip(target_vehicles, target_locations, overlaps):
+                    if overlap:
+                        return (True, target_vehicle, compute_distance(target_location, ego_location))
 
                 return (False, None, -1)
 
@@ -15,7 +15,7 @@ from agents.navigation.basic_agent import BasicAgent
 from agents.navigation.local_planner import RoadOption
 from agents.navigation.behavior_types import Cautious, Aggressive, Normal
 
-from agents.tools.misc import get_speed, positive, is_within_distance, compute_distance
+from agents.tools.misc import positive, is_within_distance, compute_distance
 
 class BehaviorAgent(BasicAgent):
     """
@@ -30,16 +30,18 @@ class BehaviorAgent(BasicAgent):
     are encoded in the agent, from cautious to a more aggressive ones.
     """
 
-    def __init__(self, vehicle, behavior='normal'):
+    def __init__(self, vehicle, behavior='normal', opt_dict=None):
         """
         Constructor method.
 
             :param vehicle: actor to apply to local planner logic onto
             :param ignore_traffic_light: boolean to ignore any traffic light
             :param behavior: type of agent to apply
+            :param opt_dict: dictionary of parameters of the BasicAgent and the LocalPlanner
         """
 
-        super(BehaviorAgent, self).__init__(vehicle)
+        opt_dict = dict(opt_dict) if opt_dict is not None else {}
+        super(BehaviorAgent, self).__init__(vehicle, opt_dict=opt_dict)
         self._look_ahead_steps = 0
 
         # Vehicle information
@@ -67,7 +69,8 @@ class BehaviorAgent(BasicAgent):
         This method updates the information regarding the ego
         vehicle based on the surrounding world.
         """
-        self._speed = get_speed(self._vehicle)
+        self._world_state.update()
+        self._speed = self._world_state.speed(self._vehicle)
         self._speed_limit = self._vehicle.get_speed_limit()
         self._local_planner.set_speed(self._speed_limit)
         self._direction = self._local_planner.target_road_option
@@ -85,9 +88,7 @@ class BehaviorAgent(BasicAgent):
         """
         This method is in charge of behaviors for red lights.
         """
-        actor_list = self._world.get_actors()
-        lights_list = actor_list.filter("*traffic_light*")
-        affected, _ = self._affected_by_traffic_light(lights_list)
+        affected, _ = self._affected_by_traffic_light()
 
         return affected
 
@@ -108,7 +109,7 @@ class BehaviorAgent(BasicAgent):
 
         behind_vehicle_state, behind_vehicle, _ = self._vehicle_obstacle_detected(vehicle_list, max(
             self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, low_angle_th=160)
-        if behind_vehicle_state and self._speed < get_speed(behind_vehicle):
+        if behind_vehicle_state and self._speed < self._world_state.speed(behind_vehicle):
             if (right_turn == carla.LaneChange.Right or right_turn ==
                     carla.LaneChange.Both) and waypoint.lane_id * right_wpt.lane_id > 0 and right_wpt.lane_type == carla.LaneType.Driving:
                 new_vehicle_state, _, _ = self._vehicle_obstacle_detected(vehicle_list, max(
@@ -141,9 +142,8 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby vehicle
         """
 
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-        def dist(v): return v.get_location().distance(waypoint.transform.location)
-        vehicle_list = [v for v in vehicle_list if dist(v) < 45 and v.id != self._vehicle.id]
+        vehicle_list = self._world_state.nearby(waypoint.transform.location, 45, "*vehicle*")
+        vehicle_list = [v for v in vehicle_list if v.id != self._vehicle.id]
 
         if self._direction == RoadOption.CHANGELANELEFT:
             vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
@@ -178,9 +178,7 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby walker
         """
 
-        walker_list = self._world.get_actors().filter("*walker.pedestrian*")
-        def dist(w): return w.get_location().distance(waypoint.transform.location)
-        walker_list = [w for w in walker_list if dist(w) < 10]
+        walker_list = self._world_state.nearby(waypoint.transform.location, 10, "*walker.pedestrian*")
 
         if self._direction == RoadOption.CHANGELANELEFT:
             walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
@@ -205,7 +203,7 @@ class BehaviorAgent(BasicAgent):
             :return control: carla.VehicleControl
         """
 
-        vehicle_speed = get_speed(vehicle)
+        vehicle_speed = self._world_state.speed(vehicle)
         delta_v = max(1, (self._speed - vehicle_speed) / 3.6)
         ttc = distance / delta_v if delta_v != 0 else distance / np.nextafter(0., 1.)
 
@@ -244,48 +242,54 @@ class BehaviorAgent(BasicAgent):
             :param debug: boolean for debugging
             :return control: carla.VehicleControl
         """
-        self._update_information()
+        profiler = self._profiler
+        with profiler.phase('actors'):
+            self._update_information()
 
         control = None
         if self._behavior.tailgate_counter > 0:
             self._behavior.tailgate_counter -= 1
 
-        ego_vehicle_loc = self._vehicle.get_location()
-        ego_vehicle_wp = self._map.get_waypoint(ego_vehicle_loc)
+        ego_vehicle_wp = self._world_state.waypoint(self._vehicle)
 
         # 1: Red lights and stops behavior
-        if self.traffic_light_manager():
+        with profiler.phase('traffic_lights'):
+            affected_by_tlight = self.traffic_light_manager()
+        if affected_by_tlight:
             return self.emergency_stop()
 
         # 2.1: Pedestrian avoidance behaviors
-        walker_state, walker, w_distance = self.pedestrian_avoid_manager(ego_vehicle_wp)
+        with profiler.phase('pedestrians'):
+            walker_state, walker, w_distance = self.pedestrian_avoid_manager(ego_vehicle_wp)
 
         if walker_state:
             # Distance is computed from the center of the two cars,
             # we use bounding boxes to calculate the actual distance
-            distance = w_distance - max(
-                walker.bounding_box.extent.y, walker.bounding_box.extent.x) - max(
-                    self._vehicle.bounding_box.extent.y, self._vehicle.bounding_box.extent.x)
+            walker_extent = self._world_state.bounding_box(walker).extent
+            ego_extent = self._world_state.bounding_box(self._vehicle).extent
+            distance = w_distance - max(walker_extent.y, walker_extent.x) - max(ego_extent.y, ego_extent.x)
 
             # Emergency brake if the car is very close.
             if distance < self._behavior.braking_distance:
                 return self.emergency_stop()
 
         # 2.2: Car following behaviors
-        vehicle_state, vehicle, distance = self.collision_and_car_avoid_manager(ego_vehicle_wp)
+        with profiler.phase('obstacles'):
+            vehicle_state, vehicle, distance = self.collision_and_car_avoid_manager(ego_vehicle_wp)
 
         if vehicle_state:
             # Distance is computed from the center of the two cars,
             # we use bounding boxes to calculate the actual distance
-            distance = distance - max(
-                vehicle.bounding_box.extent.y, vehicle.bounding_box.extent.x) - max(
-                    self._vehicle.bounding_box.extent.y, self._vehicle.bounding_box.extent.x)
+            vehicle_extent = self._world_state.bounding_box(vehicle).extent
+            ego_extent = self._world_state.bounding_box(self._vehicle).extent
+            distance = distance - max(vehicle_extent.y, vehicle_extent.x) - max(ego_extent.y, ego_extent.x)
 
             # Emergency brake if the car is very close.
             if distance < self._behavior.braking_distance:
                 return self.emergency_stop()
             else:
-                control = self.car_following_manager(vehicle, distance)
+                with profiler.phase('local_planner'):
+                    control = self.car_following_manager(vehicle, distance)
 
         # 3: Intersection behavior
         elif self._incoming_waypoint.is_junction and (self._incoming_direction in [RoadOption.LEFT, RoadOption.RIGHT]):
@@ -293,7 +297,8 @@ class BehaviorAgent(BasicAgent):
                 self._behavior.max_speed,
                 self._speed_limit - 5])
             self._local_planner.set_speed(target_speed)
-            control = self._local_planner.run_step(debug=debug)
+            with profiler.phase('local_planner'):
+                control = self._local_planner.run_step(debug=debug)
 
         # 4: Normal behavior
         else:
@@ -301,7 +306,8 @@ class BehaviorAgent(BasicAgent):
                 self._behavior.max_speed,
                 self._speed_limit - self._behavior.speed_lim_dist])
             self._local_planner.set_speed(target_speed)
-        control = self._local_planner.run_step(debug=debug)
+        with profiler.phase('local_planner'):
+            control = self._local_planner.run_step(debug=debug)
 
         return control
 
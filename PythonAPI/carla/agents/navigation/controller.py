@@ -5,23 +5,331 @@
 
 """ This module contains PID controllers to perform lateral and longitudinal control. """
 
-from collections import deque
-import math
 import numpy as np
 import carla
 from agents.tools.misc import get_speed
+from agents.tools.world_state import WorldStateCache
+
+
+class VehiclePIDControllerBank():
+    """
+    VehiclePIDControllerBank holds the lateral and longitudinal PID controllers of many vehicles
+    in numpy arrays: their gains, limits and error history. The controls of all of them are computed
+    in one vectorized step, from the actor states of a single world snapshot, and applied with one
+    batch of commands.
+
+    Each vehicle is assigned a slot of the bank. The single vehicle controllers below are views
+    over one slot of a bank.
+    """
+
+    HISTORY = 10  # Number of errors kept for the integral term
+
+    # Arrays with one row per slot
+    _STATE = ('_vehicle_ids', '_lon_gains', '_lat_gains', '_limits', '_offset', '_past_steering',
+              '_lon_errors', '_lat_errors', '_lon_count', '_lat_count')
+
+    def __init__(self, capacity=16):
+        """
+        Constructor method.
+
+            :param capacity: initial number of slots, which grows as vehicles are added
+        """
+        self._size = 0
+        self._free_slots = []
+        self._vehicle_ids = np.zeros(0, dtype=np.int64)
+        self._lon_gains = np.zeros((0, 4))  # K_P, K_I, K_D, dt
+        self._lat_gains = np.zeros((0, 4))
+        self._limits = np.zeros((0, 3))  # max_throttle, max_brake, max_steering
+        self._offset = np.zeros(0)
+        self._past_steering = np.zeros(0)
+        self._lon_errors = np.zeros((0, self.HISTORY))
+        self._lat_errors = np.zeros((0, self.HISTORY))
+        self._lon_count = np.zeros(0, dtype=np.int64)
+        self._lat_count = np.zeros(0, dtype=np.int64)
+        self._allocate(capacity)
+
+        # Steps of the single vehicle controllers waiting for 'run_deferred': (slot, target speed, waypoint, control)
+        self._deferred = None
+
+    def _allocate(self, capacity):
+        """Resizes the state arrays to the given number of slots, keeping their content"""
+        for name in self._STATE:
+            array = getattr(self, name)
+            resized = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            resized[:len(array)] = array[:capacity]
+            setattr(self, name, resized)
+
+    def __len__(self):
+        return self._size - len(self._free_slots)
+
+    def add_vehicle(self, vehicle, args_lateral, args_longitudinal, offset=0, max_throttle=0.75, max_brake=0.3,
+                    max_steering=0.8, past_steering=0.0):
+        """
+        Adds a vehicle to the bank, returning its slot.
+
+            :param vehicle: actor controlled by the slot, or None for slots only used through the views
+            :param args_lateral: dictionary with the K_P, K_I, K_D and dt arguments of the lateral PID controller
+            :param args_longitudinal: dictionary with the K_P, K_I, K_D and dt arguments of the longitudinal one
+            :param offset: distance between the target waypoints and the center of the lane
+            :param max_throttle: maximum throttle applied to the vehicle
+            :param max_brake: maximum brake applied to the vehicle
+            :param max_steering: maximum steering applied to the vehicle
+            :param past_steering: current steering of the vehicle
+        """
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            if self._size == len(self._vehicle_ids):
+                self._allocate(max(2 * self._size, 1))
+            slot = self._size
+            self._size += 1
+
+        self._vehicle_ids[slot] = vehicle.id if vehicle is not None else -1
+        self.set_longitudinal_parameters(slot, **args_longitudinal)
+        self.set_lateral_parameters(slot, **args_lateral)
+        self._limits[slot] = (max_throttle, max_brake, max_steering)
+        self._offset[slot] = offset
+        self._past_steering[slot] = past_steering
+        self.reset(slot)
+        return slot
+
+    def remove_vehicle(self, slot):
+        """Frees the slot of a vehicle"""
+        self._vehicle_ids[slot] = -1
+        self._free_slots.append(slot)
+
+    def reset(self, slot):
+        """Clears the error history of a slot"""
+        self._lon_errors[slot] = 0.0
+        self._lat_errors[slot] = 0.0
+        self._lon_count[slot] = 0
+        self._lat_count[slot] = 0
+
+    def set_longitudinal_parameters(self, slot, K_P=1.0, K_I=0.0, K_D=0.0, dt=0.03):
+        """Changes the longitudinal PID parameters of a slot"""
+        self._lon_gains[slot] = (K_P, K_I, K_D, dt)
+
+    def set_lateral_parameters(self, slot, K_P=1.0, K_I=0.0, K_D=0.0, dt=0.03):
+        """Changes the lateral PID parameters of a slot"""
+        self._lat_gains[slot] = (K_P, K_I, K_D, dt)
+
+    def set_offset(self, slot, offset):
+        """Changes the lateral offset of a slot"""
+        self._offset[slot] = offset
+
+    def vehicle_id(self, slot):
+        """Returns the id of the vehicle of a slot"""
+        return int(self._vehicle_ids[slot])
+
+    def run_step(self, slots, target_speeds, waypoints, snapshot):
+        """
+        Computes the controls of several vehicles at once, reading their state from a world snapshot,
+        so that no call to the server is made.
+
+            :param slots: slots of the vehicles, each one at most once
+            :param target_speeds: desired speed of each vehicle, in Km/h
+            :param waypoints: target carla.Waypoint of each vehicle
+            :param snapshot: carla.WorldSnapshot of the current frame
+            :return: list of carla.VehicleControl, None for the vehicles missing from the snapshot
+        """
+        slots = np.asarray(slots, dtype=np.int64).reshape(-1)
+        found = []
+        velocities = []
+        ego_transforms = []
+        for i, vehicle_id in enumerate(self._vehicle_ids[slots].tolist()):
+            actor_snapshot = snapshot.find(vehicle_id)
+            if actor_snapshot is None:
+                # The vehicle was destroyed, its controller isn't stepped
+                continue
+            velocity = actor_snapshot.get_velocity()
+            found.append(i)
+            velocities.append((velocity.x, velocity.y, velocity.z))
+            ego_transforms.append(actor_snapshot.get_transform())
+
+        controls = [None] * len(slots)
+        if not found:
+            return controls
+
+        current_speeds = 3.6 * np.linalg.norm(np.array(velocities).reshape(-1, 3), axis=1)
+        throttle, brake, steer = self.compute(
+            slots[found], np.asarray(target_speeds, dtype=np.float64)[found], current_speeds,
+            transform_arrays(ego_transforms), transform_arrays([waypoints[i].transform for i in found]))
+        for i, t, b, s in zip(found, throttle.tolist(), brake.tolist(), steer.tolist()):
+            controls[i] = carla.VehicleControl(throttle=t, steer=s, brake=b, hand_brake=False, manual_gear_shift=False)
+        return controls
+
+    def apply(self, client, slots, controls, synchronous=False):
+        """
+        Applies the controls to the vehicles of the slots with a single batch of commands
+
+            :param client: carla.Client connected to the server
+            :param slots: slots of the vehicles
+            :param controls: carla.VehicleControl of each vehicle. None controls are skipped
+            :param synchronous: if True, the batch is applied with 'apply_batch_sync'
+            :return: if synchronous, the responses of the commands of the controls that weren't skipped
+        """
+        batch = [carla.command.ApplyVehicleControl(self.vehicle_id(slot), control)
+                 for slot, control in zip(slots, controls) if control is not None]
+        if synchronous:
+            return client.apply_batch_sync(batch)
+        client.apply_batch(batch)
+        return None
+
+    def defer(self):
+        """
+        Makes the single vehicle controllers of the bank defer their steps until 'run_deferred',
+        so that the controls of the vehicles of several agents are computed in one vectorized step.
+        The controllers then return controls whose throttle, brake and steering are left unset.
+        """
+        self._deferred = []
+
+    def is_deferring(self):
+        """Returns whether the steps of the single vehicle controllers are deferred"""
+        return self._deferred is not None
+
+    def _defer_step(self, slot, target_speed, waypoint):
+        """Queues the step of a slot, returning the control that 'run_deferred' fills"""
+        control = carla.VehicleControl(throttle=np.nan, steer=np.nan, brake=np.nan,
+                                       hand_brake=False, manual_gear_shift=False)
+        self._deferred.append((slot, target_speed, waypoint, control))
+        return control
+
+    def run_deferred(self, snapshot):
+        """
+        Computes the deferred steps at once and fills their controls. The fields set by the agents
+        in the meantime, such as the brake of an emergency stop, are kept. The steps are no longer deferred.
+
+            :param snapshot: carla.WorldSnapshot of the current frame
+            :return: slots of the vehicles missing from the snapshot, whose controls are left unset
+        """
+        deferred, self._deferred = self._deferred or [], None
+        missing = []
+        while deferred:
+            # A slot stepped more than once, as the BehaviorAgent does in some of its branches, is computed
+            # once per round, in order, so that its PID state advances as when its controller is stepped directly
+            steps, later, round_slots = [], [], set()
+            for step in deferred:
+                if step[0] in round_slots:
+                    later.append(step)
+                else:
+                    round_slots.add(step[0])
+                    steps.append(step)
+            deferred = later
+
+            slots, target_speeds, waypoints, pending = zip(*steps)
+            computed_controls = self.run_step(slots, target_speeds, waypoints, snapshot)
+            for slot, control, computed in zip(slots, pending, computed_controls):
+                if computed is None:
+                    if slot not in missing:
+                        missing.append(slot)
+                    continue
+                if np.isnan(control.throttle):
+                    control.throttle = computed.throttle
+                if np.isnan(control.brake):
+                    control.brake = computed.brake
+                if np.isnan(control.steer):
+                    control.steer = computed.steer
+        return missing
+
+    def compute(self, slots, target_speeds, current_speeds, ego_transforms, target_transforms):
+        """
+        Vectorized step of the lateral and longitudinal controllers of several slots.
+
+            :param slots: (n,) array of distinct slots
+            :param target_speeds: (n,) array of target speeds, in Km/h
+            :param current_speeds: (n,) array of current speeds, in Km/h
+            :param ego_transforms: (n, 6) array with the x, y, z, pitch, yaw and roll of the vehicles
+            :param target_transforms: (n, 6) array with the transforms of the target waypoints
+            :return: (n,) arrays of throttle, brake and steering
+        """
+        slots = np.asarray(slots, dtype=np.int64).reshape(-1)
+        if len(np.unique(slots)) != len(slots):
+            raise ValueError("A slot can only be stepped once per call")
+        acceleration = self.longitudinal_step(slots, target_speeds, current_speeds)
+        current_steering = self.lateral_step(slots, ego_transforms, target_transforms)
+
+        max_throttle, max_brake, max_steering = self._limits[slots].T
+        throttle = np.where(acceleration >= 0.0, np.minimum(acceleration, max_throttle), 0.0)
+        brake = np.where(acceleration >= 0.0, 0.0, np.minimum(np.abs(acceleration), max_brake))
+
+        # Steering regulation: changes cannot happen abruptly, can't steer too much.
+        past_steering = self._past_steering[slots]
+        current_steering = np.clip(current_steering, past_steering - 0.1, past_steering + 0.1)
+        steering = np.clip(current_steering, -max_steering, max_steering)
+        self._past_steering[slots] = steering
+
+        return throttle, brake, steering
+
+    def longitudinal_step(self, slots, target_speeds, current_speeds):
+        """
+        Estimates the throttle/brake of several slots based on the PID equations
+
+            :param slots: (n,) array of slots
+            :param target_speeds: (n,) array of target speeds, in Km/h
+            :param current_speeds: (n,) array of current speeds, in Km/h
+            :return: (n,) array of throttle/brake controls
+        """
+        errors = np.asarray(target_speeds, dtype=np.float64) - np.asarray(current_speeds, dtype=np.float64)
+        return self._pid_control(slots, errors, self._lon_gains, self._lon_errors, self._lon_count)
+
+    def lateral_step(self, slots, ego_transforms, target_transforms):
+        """
+        Estimates the steering angle of several slots based on the PID equations
+
+            :param slots: (n,) array of slots
+            :param ego_transforms: (n, 6) array with the x, y, z, pitch, yaw and roll of the vehicles
+            :param target_transforms: (n, 6) array with the transforms of the target waypoints
+            :return: (n,) array of steering controls in the range [-1, 1]
+        """
+        ego_transforms = np.asarray(ego_transforms, dtype=np.float64).reshape(-1, 6)
+        target_transforms = np.asarray(target_transforms, dtype=np.float64).reshape(-1, 6)
+
+        # Forward vector of the vehicles, projected onto the ground
+        pitch, yaw = np.radians(ego_transforms[:, 3]), np.radians(ego_transforms[:, 4])
+        v_x, v_y = np.cos(pitch) * np.cos(yaw), np.cos(pitch) * np.sin(yaw)
+
+        # Target locations, displaced to the side by the offset
+        offset = self._offset[slots]
+        t_pitch, t_yaw, t_roll = np.radians(target_transforms[:, 3:6]).T
+        r_x = np.cos(t_yaw) * np.sin(t_pitch) * np.sin(t_roll) - np.sin(t_yaw) * np.cos(t_roll)
+        r_y = np.sin(t_yaw) * np.sin(t_pitch) * np.sin(t_roll) + np.cos(t_yaw) * np.cos(t_roll)
+        w_x = target_transforms[:, 0] + offset * r_x - ego_transforms[:, 0]
+        w_y = target_transforms[:, 1] + offset * r_y - ego_transforms[:, 1]
+
+        wv_linalg = np.hypot(w_x, w_y) * np.hypot(v_x, v_y)
+        cosine = (w_x * v_x + w_y * v_y) / np.where(wv_linalg == 0, 1.0, wv_linalg)
+        dot = np.where(wv_linalg == 0, 1.0, np.arccos(np.clip(cosine, -1.0, 1.0)))
+        dot = np.where(v_x * w_y - v_y * w_x < 0, -dot, dot)
+
+        return self._pid_control(slots, dot, self._lat_gains, self._lat_errors, self._lat_count)
+
+    @staticmethod
+    def _pid_control(slots, errors, gains, history, count):
+        """Adds the errors to the history of the slots and applies the PID equations"""
+        position = count[slots] % history.shape[1]
+        previous = history[slots, (position - 1) % history.shape[1]]
+        history[slots, position] = errors
+        count[slots] += 1
+
+        k_p, k_i, k_d, dt = gains[slots].T
+        enough = count[slots] >= 2
+        _de = np.where(enough, (errors - previous) / dt, 0.0)
+        _ie = np.where(enough, history[slots].sum(axis=1) * dt, 0.0)
+
+        return np.clip((k_p * errors) + (k_d * _de) + (k_i * _ie), -1.0, 1.0)
 
 
 class VehiclePIDController():
     """
     VehiclePIDController is the combination of two PID controllers
     (lateral and longitudinal) to perform the
-    low level control a vehicle from client side
+    low level control a vehicle from client side.
+    Its state is kept in a slot of a VehiclePIDControllerBank, which can be shared with other vehicles.
     """
 
 
     def __init__(self, vehicle, args_lateral, args_longitudinal, offset=0, max_throttle=0.75, max_brake=0.3,
-                 max_steering=0.8):
+                 max_steering=0.8, bank=None, world_state=None):
         """
         Constructor method.
 
@@ -39,55 +347,84 @@ class VehiclePIDController():
         :param offset: If different than zero, the vehicle will drive displaced from the center line.
         Positive values imply a right offset while negative ones mean a left one. Numbers high enough
         to cause the vehicle to drive through other lanes might break the controller.
+        :param bank: VehiclePIDControllerBank holding the state of the controller. If None, a new one is created
+        :param world_state: WorldStateCache the state of the vehicle is read from. If None, the one shared
+        by the agents of the world is used
         """
-
-        self.max_brake = max_brake
-        self.max_throt = max_throttle
-        self.max_steer = max_steering
-
         self._vehicle = vehicle
         self._world = self._vehicle.get_world()
-        self.past_steering = self._vehicle.get_control().steer
-        self._lon_controller = PIDLongitudinalController(self._vehicle, **args_longitudinal)
-        self._lat_controller = PIDLateralController(self._vehicle, offset, **args_lateral)
+        self._world_state = world_state if world_state is not None else WorldStateCache.get(self._world)
+        self.bank = bank if bank is not None else VehiclePIDControllerBank(capacity=1)
+        self.slot = self.bank.add_vehicle(
+            vehicle, args_lateral, args_longitudinal, offset, max_throttle, max_brake, max_steering,
+            past_steering=self._vehicle.get_control().steer)
+        self._lon_controller = PIDLongitudinalController(
+            self._vehicle, bank=self.bank, slot=self.slot, **args_longitudinal)
+        self._lat_controller = PIDLateralController(
+            self._vehicle, offset, bank=self.bank, slot=self.slot, **args_lateral)
+
+    @property
+    def max_throt(self):
+        """Maximum throttle applied to the vehicle"""
+        return self.bank._limits[self.slot, 0]
+
+    @max_throt.setter
+    def max_throt(self, value):
+        self.bank._limits[self.slot, 0] = value
+
+    @property
+    def max_brake(self):
+        """Maximum brake applied to the vehicle"""
+        return self.bank._limits[self.slot, 1]
+
+    @max_brake.setter
+    def max_brake(self, value):
+        self.bank._limits[self.slot, 1] = value
+
+    @property
+    def max_steer(self):
+        """Maximum steering applied to the vehicle"""
+        return self.bank._limits[self.slot, 2]
+
+    @max_steer.setter
+    def max_steer(self, value):
+        self.bank._limits[self.slot, 2] = value
+
+    @property
+    def past_steering(self):
+        """Steering applied at the previous step"""
+        return self.bank._past_steering[self.slot]
+
+    @past_steering.setter
+    def past_steering(self, value):
+        self.bank._past_steering[self.slot] = value
 
     def run_step(self, target_speed, waypoint):
         """
         Execute one step of control invoking both lateral and longitudinal
         PID controllers to reach a target waypoint
-        at a given target_speed.
+        at a given target_speed. While the bank defers the steps, the returned
+        control is only filled by its 'run_deferred'.
 
             :param target_speed: desired vehicle speed
             :param waypoint: target location encoded as a waypoint
             :return: distance (in meters) to the waypoint
         """
+        if self.bank.is_deferring():
+            return self.bank._defer_step(self.slot, target_speed, waypoint)
 
-        acceleration = self._lon_controller.run_step(target_speed)
-        current_steering = self._lat_controller.run_step(waypoint)
-        control = carla.VehicleControl()
-        if acceleration >= 0.0:
-            control.throttle = min(acceleration, self.max_throt)
-            control.brake = 0.0
-        else:
-            control.throttle = 0.0
-            control.brake = min(abs(acceleration), self.max_brake)
-
-        # Steering regulation: changes cannot happen abruptly, can't steer too much.
+        # The state of the vehicle is read from the snapshot of the frame, without calls to the server
+        self._world_state.update()
+        throttle, brake, steering = self.bank.compute(
+            [self.slot], [target_speed], [self._world_state.speed(self._vehicle)],
+            transform_arrays([self._world_state.transform(self._vehicle)]), transform_arrays([waypoint.transform]))
 
-        if current_steering > self.past_steering + 0.1:
-            current_steering = self.past_steering + 0.1
-        elif current_steering < self.past_steering - 0.1:
-            current_steering = self.past_steering - 0.1
-
-        if current_steering >= 0:
-            steering = min(self.max_steer, current_steering)
-        else:
-            steering = max(-self.max_steer, current_steering)
-
-        control.steer = steering
+        control = carla.VehicleControl()
+        control.throttle = float(throttle[0])
+        control.brake = float(brake[0])
+        control.steer = float(steering[0])
         control.hand_brake = False
         control.manual_gear_shift = False
-        self.past_steering = steering
 
         return control
 
@@ -97,8 +434,8 @@ class VehiclePIDController():
         self._lon_controller.change_parameters(**args_longitudinal)
 
     def change_lateral_PID(self, args_lateral):
-        """Changes the parameters of the PIDLongitudinalController"""
-        self._lon_controller.change_parameters(**args_lateral)
+        """Changes the parameters of the PIDLateralController"""
+        self._lat_controller.change_parameters(**args_lateral)
 
 
 class PIDLongitudinalController():
@@ -106,7 +443,7 @@ class PIDLongitudinalController():
     PIDLongitudinalController implements longitudinal control using a PID.
     """
 
-    def __init__(self, vehicle, K_P=1.0, K_I=0.0, K_D=0.0, dt=0.03):
+    def __init__(self, vehicle, K_P=1.0, K_I=0.0, K_D=0.0, dt=0.03, bank=None, slot=None):
         """
         Constructor method.
 
@@ -115,13 +452,16 @@ class PIDLongitudinalController():
             :param K_D: Differential term
             :param K_I: Integral term
             :param dt: time differential in seconds
+            :param bank: VehiclePIDControllerBank holding the state of the controller. If None, a new one is created
+            :param slot: slot of the vehicle in the bank
         """
         self._vehicle = vehicle
-        self._k_p = K_P
-        self._k_i = K_I
-        self._k_d = K_D
-        self._dt = dt
-        self._error_buffer = deque(maxlen=10)
+        if bank is None:
+            bank = VehiclePIDControllerBank(capacity=1)
+            slot = bank.add_vehicle(vehicle, {}, {})
+        self._bank = bank
+        self._slot = slot
+        self.change_parameters(K_P, K_I, K_D, dt)
 
     def run_step(self, target_speed, debug=False):
         """
@@ -146,25 +486,11 @@ class PIDLongitudinalController():
             :param current_speed: current speed of the vehicle in Km/h
             :return: throttle/brake control
         """
-
-        error = target_speed - current_speed
-        self._error_buffer.append(error)
-
-        if len(self._error_buffer) >= 2:
-            _de = (self._error_buffer[-1] - self._error_buffer[-2]) / self._dt
-            _ie = sum(self._error_buffer) * self._dt
-        else:
-            _de = 0.0
-            _ie = 0.0
-
-        return np.clip((self._k_p * error) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
+        return self._bank.longitudinal_step([self._slot], [target_speed], [current_speed])[0]
 
     def change_parameters(self, K_P, K_I, K_D, dt):
         """Changes the PID parameters"""
-        self._k_p = K_P
-        self._k_i = K_I
-        self._k_d = K_D
-        self._dt = dt
+        self._bank.set_longitudinal_parameters(self._slot, K_P, K_I, K_D, dt)
 
 
 class PIDLateralController():
@@ -172,7 +498,7 @@ class PIDLateralController():
     PIDLateralController implements lateral control using a PID.
     """
 
-    def __init__(self, vehicle, offset=0, K_P=1.0, K_I=0.0, K_D=0.0, dt=0.03):
+    def __init__(self, vehicle, offset=0, K_P=1.0, K_I=0.0, K_D=0.0, dt=0.03, bank=None, slot=None):
         """
         Constructor method.
 
@@ -183,14 +509,17 @@ class PIDLateralController():
             :param K_D: Differential term
             :param K_I: Integral term
             :param dt: time differential in seconds
+            :param bank: VehiclePIDControllerBank holding the state of the controller. If None, a new one is created
+            :param slot: slot of the vehicle in the bank
         """
         self._vehicle = vehicle
-        self._k_p = K_P
-        self._k_i = K_I
-        self._k_d = K_D
-        self._dt = dt
-        self._offset = offset
-        self._e_buffer = deque(maxlen=10)
+        if bank is None:
+            bank = VehiclePIDControllerBank(capacity=1)
+            slot = bank.add_vehicle(vehicle, {}, {})
+        self._bank = bank
+        self._slot = slot
+        self._bank.set_offset(slot, offset)
+        self.change_parameters(K_P, K_I, K_D, dt)
 
     def run_step(self, waypoint):
         """
@@ -212,47 +541,20 @@ class PIDLateralController():
             :param vehicle_transform: current transform of the vehicle
             :return: steering control in the range [-1, 1]
         """
-        # Get the ego's location and forward vector
-        ego_loc = vehicle_transform.location
-        v_vec = vehicle_transform.get_forward_vector()
-        v_vec = np.array([v_vec.x, v_vec.y, 0.0])
-
-        # Get the vector vehicle-target_wp
-        if self._offset != 0:
-            # Displace the wp to the side
-            w_tran = waypoint.transform
-            r_vec = w_tran.get_right_vector()
-            w_loc = w_tran.location + carla.Location(x=self._offset*r_vec.x,
-                                                         y=self._offset*r_vec.y)
-        else:
-            w_loc = waypoint.transform.location
+        return self._bank.lateral_step(
+            [self._slot], transform_arrays([vehicle_transform]), transform_arrays([waypoint.transform]))[0]
 
-        w_vec = np.array([w_loc.x - ego_loc.x,
-                          w_loc.y - ego_loc.y,
-                          0.0])
+    def change_parameters(self, K_P, K_I, K_D, dt):
+        """Changes the PID parameters"""
+        self._bank.set_lateral_parameters(self._slot, K_P, K_I, K_D, dt)
 
-        wv_linalg = np.linalg.norm(w_vec) * np.linalg.norm(v_vec)
-        if wv_linalg == 0:
-            _dot = 1
-        else:
-            _dot = math.acos(np.clip(np.dot(w_vec, v_vec) / (wv_linalg), -1.0, 1.0))
-        _cross = np.cross(v_vec, w_vec)
-        if _cross[2] < 0:
-            _dot *= -1.0
-
-        self._e_buffer.append(_dot)
-        if len(self._e_buffer) >= 2:
-            _de = (self._e_buffer[-1] - self._e_buffer[-2]) / self._dt
-            _ie = sum(self._e_buffer) * self._dt
-        else:
-            _de = 0.0
-            _ie = 0.0
 
-        return np.clip((self._k_p * _dot) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
+def transform_arrays(transforms):
+    """
+    Converts a list of carla.Transform into a (n, 6) array with their x, y, z, pitch, yaw and roll
 
-    def change_parameters(self, K_P, K_I, K_D, dt):
-        """Changes the PID parameters"""
-        self._k_p = K_P
-        self._k_i = K_I
-        self._k_d = K_D
-        self._dt = dt
\ No newline at end of file
+        :param transforms: list of carla.Transform
+    """
+    return np.array([
+        (t.location.x, t.location.y, t.location.z, t.rotation.pitch, t.rotation.yaw, t.rotation.roll)
+        for t in transforms], dtype=np.float64).reshape(-1, 6)
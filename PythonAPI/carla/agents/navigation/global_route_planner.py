@@ -8,78 +8,408 @@
 This module provides GlobalRoutePlanner implementation.
 """
 
+from collections import OrderedDict
 import math
+import multiprocessing
+import os
+import threading
 import numpy as np
 import networkx as nx
 
 import carla
-from agents.navigation.local_planner import RoadOption
+from agents.navigation.incremental_planner import DStarLite
+from agents.navigation.local_planner import ROUTE_DTYPE, RoadOption, RouteArray
+from agents.navigation.route_graph import RouteGraph
+from agents.navigation.topology_cache import TopologyCache, WaypointTable
 from agents.tools.misc import vector
+from agents.tools.spatial_index import PolylineIndex
 
 class GlobalRoutePlanner(object):
     """
     This class provides a very high level route plan.
     """
 
-    def __init__(self, wmap, sampling_resolution):
+    def __init__(self, wmap, sampling_resolution, cache_dir=None, graph_backend='csr', landmarks=0,
+                 lazy_paths=False, path_cache_size=None, route_cache_size=128):
+        """
+        :param wmap: carla.Map used to build the graph
+        :param sampling_resolution: distance between the waypoints of the graph edges
+        :param cache_dir: if given, folder where the graph is stored between executions.
+            Planners for a map whose OpenDRIVE content hasn't changed load it instead of building it
+        :param graph_backend: graph used to search the routes. Either 'csr', an array based copy
+            of the graph, or 'networkx'. Both return the same routes
+        :param landmarks: number of landmarks used to speed up the route searches (ALT).
+            Zero disables them. The landmarks give exact shortest routes, which might differ from the ones
+            of the euclidean heuristic. Only available with the 'csr' backend, and stored in the cache if enabled
+        :param lazy_paths: if True, the edges only store their entry and exit waypoints at first, with their
+            length estimated from the OpenDRIVE geometry, and their waypoints are sampled the first time a route
+            goes through them. Can't be combined with cache_dir. Locations are localized with the server
+        :param path_cache_size: maximum number of sampled edges whose carla.Waypoint objects are kept in memory
+            when lazy_paths is enabled, evicting the least recently used ones. None keeps all of them
+        :param route_cache_size: maximum number of routes between pairs of edges remembered by the planner,
+            evicting the least recently used ones. Zero disables the cache
+        """
+        if graph_backend not in ('csr', 'networkx'):
+            raise ValueError("Unknown graph backend '{}'".format(graph_backend))
+        if landmarks > 0 and graph_backend != 'csr':
+            raise ValueError("Landmarks are only available with the 'csr' graph backend")
+        if lazy_paths and cache_dir is not None:
+            raise ValueError("Lazy paths can't be combined with the topology cache")
         self._sampling_resolution = sampling_resolution
         self._wmap = wmap
         self._topology = None
         self._graph = None
         self._id_map = None
         self._road_id_to_edge = None
+        self._waypoint_table = WaypointTable(wmap)
+        self._graph_backend = graph_backend
+        self._route_graph = None
+        self._waypoint_index = None
+        self._waypoint_index_ids = None
+        self._lazy_paths = lazy_paths
+        self._path_cache_size = path_cache_size
+        self._path_cache = OrderedDict()
+        self._route_cache_size = route_cache_size
+        self._route_cache = OrderedDict()
+        self._route_cache_hits = 0
+        self._route_cache_misses = 0
+        self._edge_costs = dict()
+        self._blocked_edges = set()
+        self._incremental_planner = None
+        self._lock = threading.Lock()
+
+        self._cache = None
+        if cache_dir is not None:
+            self._cache = TopologyCache(wmap, sampling_resolution, cache_dir)
+
+        cached_graph = self._cache.load() if self._cache else None
+        if cached_graph is not None:
+            self._graph, self._id_map, self._road_id_to_edge, self._waypoint_table = cached_graph
+        else:
+            # Build the graph
+            self._build_topology()
+            self._build_graph()
+            self._find_loose_ends()
+            self._lane_change_link()
+
+            if self._cache:
+                self._cache.save(self._graph, self._id_map, self._road_id_to_edge, self._waypoint_table)
 
-        self._intersection_end_node = -1
-        self._previous_decision = RoadOption.VOID
+        if not self._lazy_paths:
+            self._build_waypoint_index()
+        self._precompute_turn_decisions()
 
-        # Build the graph
-        self._build_topology()
-        self._build_graph()
-        self._find_loose_ends()
-        self._lane_change_link()
+        if self._graph_backend == 'csr':
+            self._route_graph = RouteGraph(self._graph, weight='length')
+
+            if landmarks > 0:
+                landmark_data = self._cache.load_landmarks(landmarks) if self._cache else None
+                if landmark_data is None:
+                    landmark_data = self._route_graph.compute_landmarks(landmarks)
+                    if self._cache:
+                        self._cache.save_landmarks(landmarks, landmark_data)
+                self._route_graph.set_landmarks(*landmark_data)
 
     def trace_route(self, origin, destination):
         """
         This method returns list of (carla.Waypoint, RoadOption)
-        from origin to destination
+        from origin to destination. It can be called concurrently from several threads
+        """
+        return self._trace_route(origin, destination, self._route_search).materialize()
+
+    def replan_route(self, origin, destination):
+        """
+        This method returns list of (carla.Waypoint, RoadOption) from origin to destination, like 'trace_route',
+        but using an incremental search. Consecutive calls towards the same destination reuse the previous
+        search, only repairing the part affected by the new origin and the edge costs changed in between.
+        The route is the shortest one, which might differ from the one of 'trace_route' if it has no landmarks
+        """
+        return self._trace_route(origin, destination, self._incremental_search).materialize()
+
+    def trace_route_array(self, origin, destination, incremental=False):
+        """
+        This method returns the route from origin to destination as a RouteArray, a numpy array
+        that only retrieves the carla.Waypoint objects of the route when they are needed.
+        To split long routes, its 'chunks' generator yields consecutive parts of the route on demand.
+
+            :param origin (carla.Location): starting location of the route
+            :param destination (carla.Location): final location of the route
+            :param incremental (bool): whether to use the incremental search of 'replan_route'
+        """
+        search = self._incremental_search if incremental else self._route_search
+        return self._trace_route(origin, destination, search).to_array()
+
+    def get_edge(self, location):
+        """
+        This method returns the (n1, n2) edge of the graph of the lane closest to a location,
+        as used to change its cost
+
+            :param location (carla.Location): location to be localized
+        """
+        return self._localize(location)
+
+    def set_edge_cost(self, n1, n2, cost):
+        """
+        Changes the cost of an edge, in sampled waypoints like its 'length', for the next route searches.
+
+            :param n1, n2: nodes of the edge
+            :param cost (float): new cost of the edge. None restores its original length
+        """
+        previous_cost = self._edge_cost(n1, n2)
+        if cost is None:
+            self._edge_costs.pop((n1, n2), None)
+        else:
+            self._edge_costs[(n1, n2)] = float(cost)
+        self._update_edge_cost(n1, n2, previous_cost)
+
+    def block_edge(self, n1, n2):
+        """
+        Prevents the next route searches from going through an edge
+
+            :param n1, n2: nodes of the edge
         """
-        route_trace = []
-        route = self._path_search(origin, destination)
-        current_waypoint = self._wmap.get_waypoint(origin)
-        destination_waypoint = self._wmap.get_waypoint(destination)
+        previous_cost = self._edge_cost(n1, n2)
+        self._blocked_edges.add((n1, n2))
+        self._update_edge_cost(n1, n2, previous_cost)
+
+    def unblock_edge(self, n1, n2):
+        """
+        Allows the next route searches to go through an edge previously blocked
+
+            :param n1, n2: nodes of the edge
+        """
+        previous_cost = self._edge_cost(n1, n2)
+        self._blocked_edges.discard((n1, n2))
+        self._update_edge_cost(n1, n2, previous_cost)
+
+    def _edge_cost(self, n1, n2):
+        """Returns the current cost of an edge, infinite if it is blocked"""
+        if (n1, n2) in self._blocked_edges:
+            return float('inf')
+        return self._edge_costs.get((n1, n2), self._graph.edges[n1, n2]['length'])
+
+    def _networkx_weight(self, n1, n2, edge):
+        """Weight function of the networkx search. Returning None hides the blocked edges"""
+        if (n1, n2) in self._blocked_edges:
+            return None
+        return self._edge_costs.get((n1, n2), edge['length'])
+
+    def _update_edge_cost(self, n1, n2, previous_cost):
+        """Propagates a change of cost of an edge to the route graph, the route cache and the incremental search"""
+        cost = self._edge_cost(n1, n2)
+        if self._route_graph is not None:
+            self._route_graph.set_weight(n1, n2, cost)
+
+        if cost > previous_cost:
+            self.clear_route_cache([(n1, n2)])
+        elif cost < previous_cost:
+            # Any route could be shortened now
+            with self._lock:
+                self._route_cache.clear()
+
+        if self._incremental_planner is not None:
+            if self._incremental_planner.uses_landmarks and self._route_graph.landmarks is None:
+                # The landmarks were removed by a decrease of the weights, so the search has to restart
+                self._incremental_planner = None
+            else:
+                self._incremental_planner.update_edge(n1, n2)
+
+    def _incremental_search(self, start, end):
+        """
+        This function finds the shortest path connecting two edges of the graph with the incremental search,
+        reusing the previous one if its destination is the same
+        """
+        if self._route_graph is None:
+            # The incremental search needs the route graph, even with the 'networkx' backend
+            self._route_graph = RouteGraph(self._graph, weight='length')
+            for n1, n2 in set(self._edge_costs) | self._blocked_edges:
+                self._route_graph.set_weight(n1, n2, self._edge_cost(n1, n2))
+
+        planner = self._incremental_planner
+        if planner is None or planner.target != end[0]:
+            planner = DStarLite(self._route_graph, start[0], end[0])
+            self._incremental_planner = planner
+        else:
+            planner.set_source(start[0])
+        route = planner.search()
+        route.append(end[1])
+        return route
+
+    def _trace_route(self, origin, destination, search):
+        """
+        Computes a CompactRoute between two locations, searching the route between their edges with the given function
+        """
+        origin_waypoint = self._wmap.get_waypoint(origin)
+        destination_xyz = (destination.x, destination.y, destination.z)
+        end, destination_waypoint = self._localize_locations([destination_xyz])[0]
+        route = search(self._localize_waypoint(origin_waypoint), end)
+
+        waypoint_ids, road_options = self._compute_route_trace(
+            route, self._endpoint(origin_waypoint), destination_waypoint, destination_xyz)
+        return CompactRoute(waypoint_ids, road_options, self._waypoint_table, origin_waypoint)
+
+    def trace_routes(self, pairs, workers=None):
+        """
+        This method computes the routes between several pairs of locations at once.
+        All the locations are localized beforehand with the waypoint index, and the route
+        searches are split between a pool of processes, which share the graph of this planner.
+        No call to the server is made until the routes are materialized.
+
+            :param pairs (list): list of (origin, destination) pairs of carla.Location
+            :param workers (int): number of processes. If None, the number of CPUs is used.
+                Platforms that can't fork the current process compute the routes sequentially
+            :return: list of CompactRoute, in the same order as the given pairs.
+                Routes that couldn't be found are None
+        """
+        # Localize each distinct endpoint once, in one pass
+        locations = [(loc.x, loc.y, loc.z) for pair in pairs for loc in pair]
+        unique_index = {}
+        unique_locations = []
+        for location in locations:
+            if location not in unique_index:
+                unique_index[location] = len(unique_locations)
+                unique_locations.append(location)
+        unique_localized = self._localize_locations(unique_locations)
+        localized = [unique_localized[unique_index[location]] for location in locations]
+
+        tasks = []
+        origins = []
+        for i in range(len(pairs)):
+            start, origin = localized[2*i]
+            end, destination_waypoint = localized[2*i + 1]
+            origins.append(origin)
+            tasks.append((start, end, origin, destination_waypoint, locations[2*i + 1]))
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if self._lazy_paths:
+            # Sampling the paths needs the server, which can't be used from the forked processes
+            workers = 1
+        workers = min(workers, len(tasks))
+
+        if workers > 1 and _can_fork():
+            # The planner is given to the forked processes when they start, without pickling it
+            pool = _fork_context().Pool(workers, initializer=_init_batch_worker, initargs=(self,))
+            try:
+                chunksize = max(1, len(tasks) // (4 * workers))
+                results = pool.map(_trace_route_task, tasks, chunksize)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self._trace_route_task(task) for task in tasks]
+
+        routes = []
+        for result, origin in zip(results, origins):
+            if result is None:
+                routes.append(None)
+            else:
+                routes.append(CompactRoute(result[0], result[1], self._waypoint_table, origin_location=origin[0]))
+        return routes
+
+    def route_cache_info(self):
+        """
+        Returns the statistics of the route cache as a dictionary with
+        the number of hits and misses, and its current and maximum size
+        """
+        return {
+            'hits': self._route_cache_hits,
+            'misses': self._route_cache_misses,
+            'size': len(self._route_cache),
+            'maxsize': self._route_cache_size,
+        }
+
+    def clear_route_cache(self, edges=None):
+        """
+        Removes routes from the route cache. Has to be called if the cost of the edges changes.
+
+            :param edges (list): (n1, n2) edges of the graph. Only the routes going through them are removed.
+                If None, the whole cache is cleared, along with its statistics
+        """
+        with self._lock:
+            if edges is None:
+                self._route_cache.clear()
+                self._route_cache_hits = 0
+                self._route_cache_misses = 0
+                return
+
+            edges = set(edges)
+            for key, route in list(self._route_cache.items()):
+                if any((route[i], route[i+1]) in edges for i in range(len(route) - 1)):
+                    del self._route_cache[key]
+
+    def _trace_route_task(self, task):
+        """
+        Computes a route of 'trace_routes'. Only the graph and the waypoint table are used,
+        without any call to the server. Returns None if there is no route.
+        """
+        start, end, origin, destination_waypoint, destination = task
+        if start is None or end is None or origin is None:
+            return None
+        try:
+            route = self._route_search(start, end)
+        except nx.NetworkXNoPath:
+            return None
+        return self._compute_route_trace(route, origin, destination_waypoint, destination)
+
+    def _compute_route_trace(self, route, origin, destination_waypoint, destination):
+        """
+        Converts a list of graph nodes into the waypoints of the route, trimming
+        the first and last edges at the origin and destination.
+
+            :param route (list): graph nodes of the route
+            :param origin (tuple): ((x,y,z), (road_id, section_id, lane_id)) of the origin waypoint
+            :param destination_waypoint (tuple): ((x,y,z), (road_id, section_id, lane_id)) of the destination waypoint
+            :param destination (tuple): (x,y,z) of the destination location
+            :return: list of waypoint table indices, where -1 stands for the origin waypoint,
+                and list of their RoadOption
+        """
+        waypoint_ids = []
+        road_options = []
+        edge_options = self._route_road_options(route)
+
+        current_id = -1
+        current_location = origin[0]
+        destination_location, destination_lane = destination_waypoint
+        min_distance = 2*self._sampling_resolution
 
         for i in range(len(route) - 1):
-            road_option = self._turn_decision(i, route)
+            road_option = edge_options[i]
             edge = self._graph.edges[route[i], route[i+1]]
-            path = []
 
             if edge['type'] != RoadOption.LANEFOLLOW and edge['type'] != RoadOption.VOID:
-                route_trace.append((current_waypoint, road_option))
-                exit_wp = edge['exit_waypoint']
-                n1, n2 = self._road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id]
+                waypoint_ids.append(current_id)
+                road_options.append(road_option)
+                exit_road_id, exit_section_id, exit_lane_id = self._waypoint_table.lane(edge['exit_id'])
+                n1, n2 = self._road_id_to_edge[exit_road_id][exit_section_id][exit_lane_id]
                 next_edge = self._graph.edges[n1, n2]
-                if next_edge['path']:
-                    closest_index = self._find_closest_in_list(current_waypoint, next_edge['path'])
-                    closest_index = min(len(next_edge['path'])-1, closest_index+5)
-                    current_waypoint = next_edge['path'][closest_index]
+                next_path = self._edge_path_ids(n1, n2)
+                if next_path:
+                    closest_index = self._find_closest_in_list(current_location, next_path)
+                    closest_index = min(len(next_path)-1, closest_index+5)
+                    current_id = next_path[closest_index]
                 else:
-                    current_waypoint = next_edge['exit_waypoint']
-                route_trace.append((current_waypoint, road_option))
+                    current_id = next_edge['exit_id']
+                current_location = self._waypoint_table.location(current_id)
+                waypoint_ids.append(current_id)
+                road_options.append(road_option)
 
             else:
-                path = path + [edge['entry_waypoint']] + edge['path'] + [edge['exit_waypoint']]
-                closest_index = self._find_closest_in_list(current_waypoint, path)
-                for waypoint in path[closest_index:]:
-                    current_waypoint = waypoint
-                    route_trace.append((current_waypoint, road_option))
-                    if len(route)-i <= 2 and waypoint.transform.location.distance(destination) < 2*self._sampling_resolution:
+                path = [edge['entry_id']] + self._edge_path_ids(route[i], route[i+1]) + [edge['exit_id']]
+                closest_index = self._find_closest_in_list(current_location, path)
+                for waypoint_id in path[closest_index:]:
+                    current_id = waypoint_id
+                    current_location = self._waypoint_table.location(current_id)
+                    waypoint_ids.append(current_id)
+                    road_options.append(road_option)
+                    if len(route)-i <= 2 and _distance(current_location, destination) < min_distance:
                         break
-                    elif len(route)-i <= 2 and current_waypoint.road_id == destination_waypoint.road_id and current_waypoint.section_id == destination_waypoint.section_id and current_waypoint.lane_id == destination_waypoint.lane_id:
-                        destination_index = self._find_closest_in_list(destination_waypoint, path)
+                    elif len(route)-i <= 2 and self._waypoint_table.lane(current_id) == destination_lane:
+                        destination_index = self._find_closest_in_list(destination_location, path)
                         if closest_index > destination_index:
                             break
 
-        return route_trace
+        return waypoint_ids, road_options
 
     def _build_topology(self):
         """
@@ -92,6 +422,11 @@ class GlobalRoutePlanner(object):
         - exit (carla.Waypoint): waypoint of exit point of road segment
         - exitxyz (tuple): (x,y,z) of exit point of road segment
         - path (list of carla.Waypoint):  list of waypoints between entry to exit, separated by the resolution
+        - entry_id, exit_id, path_ids: indices of the previous waypoints in the waypoint table
+        - length (int): number of steps of the path, estimated if the paths are lazy
+
+        With lazy paths, 'path' only contains the first waypoint of non junction segments,
+        used to look for lane changes, and 'path_ids' is None.
         """
         self._topology = []
         # Retrieving waypoints to construct a detailed topology
@@ -104,17 +439,75 @@ class GlobalRoutePlanner(object):
             seg_dict = dict()
             seg_dict['entry'], seg_dict['exit'] = wp1, wp2
             seg_dict['entryxyz'], seg_dict['exitxyz'] = (x1, y1, z1), (x2, y2, z2)
-            seg_dict['path'] = []
-            endloc = wp2.transform.location
-            if wp1.transform.location.distance(endloc) > self._sampling_resolution:
-                w = wp1.next(self._sampling_resolution)[0]
-                while w.transform.location.distance(endloc) > self._sampling_resolution:
-                    seg_dict['path'].append(w)
-                    w = w.next(self._sampling_resolution)[0]
+            seg_dict['entry_id'] = self._waypoint_table.add(wp1)
+            seg_dict['exit_id'] = self._waypoint_table.add(wp2)
+            if self._lazy_paths:
+                seg_dict['path'] = [] if wp1.is_junction else wp1.next(self._sampling_resolution)[:1]
+                seg_dict['path_ids'] = None
+                seg_dict['length'] = self._estimate_length(wp1, wp2)
             else:
-                seg_dict['path'].append(wp1.next(self._sampling_resolution)[0])
+                seg_dict['path'] = self._sample_path(wp1, wp2.transform.location)
+                seg_dict['path_ids'] = [self._waypoint_table.add(wp) for wp in seg_dict['path']]
+                seg_dict['length'] = len(seg_dict['path']) + 1
             self._topology.append(seg_dict)
 
+    def _sample_path(self, entry_waypoint, exit_location):
+        """
+        Returns the waypoints between the entry waypoint of a segment and its exit location,
+        separated by the sampling resolution
+        """
+        path = []
+        if entry_waypoint.transform.location.distance(exit_location) > self._sampling_resolution:
+            w = entry_waypoint.next(self._sampling_resolution)[0]
+            while w.transform.location.distance(exit_location) > self._sampling_resolution:
+                path.append(w)
+                w = w.next(self._sampling_resolution)[0]
+        else:
+            path.append(entry_waypoint.next(self._sampling_resolution)[0])
+        return path
+
+    def _estimate_length(self, entry_waypoint, exit_waypoint):
+        """
+        Estimates the length of the edge of a segment, as the number of steps
+        that '_sample_path' would take, from the OpenDRIVE s coordinate of its waypoints
+        """
+        if entry_waypoint.road_id == exit_waypoint.road_id:
+            distance = abs(exit_waypoint.s - entry_waypoint.s)
+        else:
+            distance = entry_waypoint.transform.location.distance(exit_waypoint.transform.location)
+        steps = distance / self._sampling_resolution
+        if steps <= 1:
+            return 2
+        return max(1, int(math.ceil(steps)) - 1)
+
+    def _edge_path_ids(self, n1, n2):
+        """
+        Returns the waypoint table indices of the path of an edge. With lazy paths, the path
+        is sampled the first time it is needed, and its waypoints are kept in a LRU cache
+        """
+        edge = self._graph.edges[n1, n2]
+        if not self._lazy_paths or edge['type'] != RoadOption.LANEFOLLOW:
+            return edge['path_ids']
+
+        with self._lock:
+            return self._sample_edge_path(n1, n2, edge)
+
+    def _sample_edge_path(self, n1, n2, edge):
+        """Samples the path of an edge if needed, updating the LRU cache of the lazy paths"""
+        if edge['path_ids'] is None:
+            exit_location = carla.Location(*self._waypoint_table.location(edge['exit_id']))
+            path = self._sample_path(self._waypoint_table.get(edge['entry_id']), exit_location)
+            edge['path_ids'] = [self._waypoint_table.add(wp) for wp in path]
+
+        if self._path_cache_size is not None:
+            self._path_cache.pop((n1, n2), None)
+            self._path_cache[(n1, n2)] = edge['path_ids']
+            while len(self._path_cache) > self._path_cache_size:
+                # The indices stay valid, the waypoints are retrieved from the map again if needed
+                _, evicted_ids = self._path_cache.popitem(last=False)
+                self._waypoint_table.release(evicted_ids)
+        return edge['path_ids']
+
     def _build_graph(self):
         """
         This function builds a networkx graph representation of topology, creating several class attributes:
@@ -122,6 +515,8 @@ class GlobalRoutePlanner(object):
             Node properties:
                 vertex: (x,y,z) position in world map
             Edge properties:
+                entry_id, exit_id: waypoint table indices of the entry and exit waypoints
+                path_ids: waypoint table indices of the waypoints in between
                 entry_vector: unit vector along tangent at entry point
                 exit_vector: unit vector along tangent at exit point
                 net_vector: unit vector of the chord from entry to exit
@@ -136,7 +531,6 @@ class GlobalRoutePlanner(object):
 
         for segment in self._topology:
             entry_xyz, exit_xyz = segment['entryxyz'], segment['exitxyz']
-            path = segment['path']
             entry_wp, exit_wp = segment['entry'], segment['exit']
             intersection = entry_wp.is_junction
             road_id, section_id, lane_id = entry_wp.road_id, entry_wp.section_id, entry_wp.lane_id
@@ -161,8 +555,8 @@ class GlobalRoutePlanner(object):
             # Adding edge with attributes
             self._graph.add_edge(
                 n1, n2,
-                length=len(path) + 1, path=path,
-                entry_waypoint=entry_wp, exit_waypoint=exit_wp,
+                length=segment['length'], path_ids=segment['path_ids'],
+                entry_id=segment['entry_id'], exit_id=segment['exit_id'],
                 entry_vector=np.array(
                     [entry_carla_vector.x, entry_carla_vector.y, entry_carla_vector.z]),
                 exit_vector=np.array(
@@ -206,11 +600,12 @@ class GlobalRoutePlanner(object):
                     n2_xyz = (path[-1].transform.location.x,
                               path[-1].transform.location.y,
                               path[-1].transform.location.z)
+                    path_ids = [self._waypoint_table.add(wp) for wp in path]
                     self._graph.add_node(n2, vertex=n2_xyz)
                     self._graph.add_edge(
                         n1, n2,
-                        length=len(path) + 1, path=path,
-                        entry_waypoint=end_wp, exit_waypoint=path[-1],
+                        length=len(path) + 1, path_ids=path_ids,
+                        entry_id=segment['exit_id'], exit_id=path_ids[-1],
                         entry_vector=None, exit_vector=None, net_vector=None,
                         intersection=end_wp.is_junction, type=RoadOption.LANEFOLLOW)
 
@@ -223,7 +618,10 @@ class GlobalRoutePlanner(object):
         for segment in self._topology:
             left_found, right_found = False, False
 
-            for waypoint in segment['path']:
+            path_ids = segment['path_ids']
+            if path_ids is None:
+                path_ids = [self._waypoint_table.add(wp) for wp in segment['path']]
+            for waypoint, waypoint_id in zip(segment['path'], path_ids):
                 if not segment['entry'].is_junction:
                     next_waypoint, next_road_option, next_segment = None, None, None
 
@@ -233,12 +631,13 @@ class GlobalRoutePlanner(object):
                                 and next_waypoint.lane_type == carla.LaneType.Driving \
                                 and waypoint.road_id == next_waypoint.road_id:
                             next_road_option = RoadOption.CHANGELANERIGHT
-                            next_segment = self._localize(next_waypoint.transform.location)
+                            next_segment = self._localize_waypoint(next_waypoint)
                             if next_segment is not None:
+                                next_waypoint_id = self._waypoint_table.add(next_waypoint)
                                 self._graph.add_edge(
-                                    self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
-                                    exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
-                                    path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
+                                    self._id_map[segment['entryxyz']], next_segment[0], entry_id=waypoint_id,
+                                    exit_id=next_waypoint_id, intersection=False, exit_vector=None,
+                                    path_ids=[], length=0, type=next_road_option, change_id=next_waypoint_id)
                                 right_found = True
                     if waypoint.left_lane_marking and waypoint.left_lane_marking.lane_change & carla.LaneChange.Left and not left_found:
                         next_waypoint = waypoint.get_left_lane()
@@ -246,25 +645,78 @@ class GlobalRoutePlanner(object):
                                 and next_waypoint.lane_type == carla.LaneType.Driving \
                                 and waypoint.road_id == next_waypoint.road_id:
                             next_road_option = RoadOption.CHANGELANELEFT
-                            next_segment = self._localize(next_waypoint.transform.location)
+                            next_segment = self._localize_waypoint(next_waypoint)
                             if next_segment is not None:
+                                next_waypoint_id = self._waypoint_table.add(next_waypoint)
                                 self._graph.add_edge(
-                                    self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
-                                    exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
-                                    path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
+                                    self._id_map[segment['entryxyz']], next_segment[0], entry_id=waypoint_id,
+                                    exit_id=next_waypoint_id, intersection=False, exit_vector=None,
+                                    path_ids=[], length=0, type=next_road_option, change_id=next_waypoint_id)
                                 left_found = True
                 if left_found and right_found:
                     break
 
+    def _build_waypoint_index(self):
+        """
+        This method builds the spatial index used to localize locations without calling the server.
+        It indexes the polylines of the lane follow edges, from their entry to their exit waypoint.
+        """
+        waypoint_ids = []
+        connected = []
+        for _, _, edge in self._graph.edges(data=True):
+            if edge['type'] == RoadOption.LANEFOLLOW:
+                polyline = [edge['entry_id']] + edge['path_ids'] + [edge['exit_id']]
+                waypoint_ids.extend(polyline)
+                connected.extend([True] * (len(polyline) - 1) + [False])
+
+        self._waypoint_index_ids = waypoint_ids
+        self._waypoint_index = PolylineIndex(
+            self._waypoint_table.locations(waypoint_ids), connected, max(10.0, 5 * self._sampling_resolution))
+
     def _localize(self, location):
         """
         This function finds the road segment that a given location
         is part of, returning the edge it belongs to
         """
-        waypoint = self._wmap.get_waypoint(location)
+        return self._localize_locations([(location.x, location.y, location.z)])[0][0]
+
+    def _localize_locations(self, locations):
+        """
+        This function localizes several locations at once by projecting them onto the closest
+        lane of the waypoint index, without calling the server.
+
+            :param locations (list): list of (x,y,z) locations
+            :return: list with the edge and the endpoint (as returned by '_endpoint') of each location.
+                Both are None if the location couldn't be localized
+        """
+        if self._waypoint_index is None:
+            # Without index, as happens with lazy paths, the server is used instead
+            waypoints = [self._wmap.get_waypoint(carla.Location(*location)) for location in locations]
+            return [(self._localize_waypoint(waypoint), self._endpoint(waypoint)) for waypoint in waypoints]
+
+        starts, projections, _ = self._waypoint_index.project(np.array(locations, dtype=np.float64))
+        localized = []
+        for start, projection in zip(starts.tolist(), projections.tolist()):
+            if start < 0:
+                localized.append((None, None))
+                continue
+            lane = self._waypoint_table.lane(self._waypoint_index_ids[start])
+            localized.append((self._localize_lane(*lane), (tuple(projection), lane)))
+        return localized
+
+    def _localize_waypoint(self, waypoint):
+        """
+        This function returns the edge a given waypoint belongs to
+        """
+        return self._localize_lane(waypoint.road_id, waypoint.section_id, waypoint.lane_id)
+
+    def _localize_lane(self, road_id, section_id, lane_id):
+        """
+        This function returns the edge of a lane, or None if it isn't part of the graph
+        """
         edge = None
         try:
-            edge = self._road_id_to_edge[waypoint.road_id][waypoint.section_id][waypoint.lane_id]
+            edge = self._road_id_to_edge[road_id][section_id][lane_id]
         except KeyError:
             pass
         return edge
@@ -287,106 +739,317 @@ class GlobalRoutePlanner(object):
         return      :   path as list of node ids (as int) of the graph self._graph
         connecting origin and destination
         """
-        start, end = self._localize(origin), self._localize(destination)
+        return self._route_search(self._localize(origin), self._localize(destination))
+
+    def _route_search(self, start, end):
+        """
+        This function finds the shortest path connecting two edges of the graph
+        start       :   (n1, n2) edge of the start position
+        end         :   (n1, n2) edge of the end position
+        return      :   path as list of node ids (as int) of the graph self._graph
+        """
+        if self._route_cache_size > 0:
+            with self._lock:
+                cached_route = self._route_cache.pop((start, end), None)
+                if cached_route is not None:
+                    self._route_cache_hits += 1
+                    self._route_cache[(start, end)] = cached_route
+                    return list(cached_route)
+                self._route_cache_misses += 1
 
-        route = nx.astar_path(
-            self._graph, source=start[0], target=end[0],
-            heuristic=self._distance_heuristic, weight='length')
+        if self._graph_backend == 'csr' and self._route_graph.landmarks is not None:
+            route = self._route_graph.alt(start[0], end[0])
+        elif self._graph_backend == 'csr':
+            route = self._route_graph.astar(start[0], end[0])
+        else:
+            weight = self._networkx_weight if self._edge_costs or self._blocked_edges else 'length'
+            route = nx.astar_path(
+                self._graph, source=start[0], target=end[0],
+                heuristic=self._distance_heuristic, weight=weight)
         route.append(end[1])
+
+        if self._route_cache_size > 0:
+            with self._lock:
+                self._route_cache[(start, end)] = tuple(route)
+                while len(self._route_cache) > self._route_cache_size:
+                    self._route_cache.popitem(last=False)
         return route
 
-    def _successive_last_intersection_edge(self, index, route):
+    def _intersection_chain_end(self, index, route):
         """
-        This method returns the last successive intersection edge
-        from a starting index on the route.
-        This helps moving past tiny intersection edges to calculate
-        proper turn decisions.
+        This method returns the index of the route node where the successive intersection
+        edges starting at a given index end. This helps moving past tiny intersection edges
+        to calculate proper turn decisions.
         """
-
-        last_intersection_edge = None
-        last_node = None
-        for node1, node2 in [(route[i], route[i+1]) for i in range(index, len(route)-1)]:
-            candidate_edge = self._graph.edges[node1, node2]
-            if node1 == route[index]:
-                last_intersection_edge = candidate_edge
+        end = index + 1
+        for i in range(index + 1, len(route) - 1):
+            candidate_edge = self._graph.edges[route[i], route[i+1]]
             if candidate_edge['type'] == RoadOption.LANEFOLLOW and candidate_edge['intersection']:
-                last_intersection_edge = candidate_edge
-                last_node = node2
+                end = i + 1
             else:
                 break
+        return end
 
-        return last_node, last_intersection_edge
-
-    def _turn_decision(self, index, route, threshold=math.radians(35)):
+    def _precompute_turn_decisions(self):
         """
-        This method returns the turn decision (RoadOption) for pair of edges
-        around current index of route list
+        This method classifies the turns of the graph, storing them in the 'turn_decisions' attribute
+        of the edges that enter an intersection. It maps each (next node, tail start, tail end) to the turn
+        that follows the edge and enters the intersection through the next node, where the tail is the
+        last edge of the successive intersection edges of the route.
         """
+        for current_node in self._graph.nodes:
+            entries = [n for n in self._graph.successors(current_node) if self._is_intersection_edge(current_node, n)]
+            if not entries:
+                continue
+
+            # Every intersection edge reachable from the entry can be the tail of a route
+            chains = []
+            for next_node in entries:
+                stack = [(current_node, next_node, {current_node, next_node})]
+                while stack:
+                    tail_start, tail_end, visited = stack.pop()
+                    chains.append((next_node, tail_start, tail_end))
+                    for neighbor in self._graph.successors(tail_end):
+                        if neighbor not in visited and self._is_intersection_edge(tail_end, neighbor):
+                            stack.append((tail_end, neighbor, visited | {neighbor}))
 
+            for previous_node in self._graph.predecessors(current_node):
+                current_edge = self._graph.edges[previous_node, current_node]
+                if current_edge['type'] != RoadOption.LANEFOLLOW or current_edge['intersection']:
+                    continue
+                current_edge['turn_decisions'] = {
+                    chain: self._classify_turn(current_edge, current_node, chain[0], self._graph.edges[chain[1:]])
+                    for chain in chains}
+
+    def _is_intersection_edge(self, n1, n2):
+        edge = self._graph.edges[n1, n2]
+        return edge['type'] == RoadOption.LANEFOLLOW and edge['intersection']
+
+    def _classify_turn(self, current_edge, current_node, next_node, tail_edge, threshold=math.radians(35)):
+        """
+        This method returns the turn decision (RoadOption) of entering an intersection through next_node,
+        coming from current_edge, and leaving it through tail_edge. Returns None if the edges have no
+        tangent vectors, in which case the turn can't be classified.
+        """
         decision = None
-        previous_node = route[index-1]
-        current_node = route[index]
-        next_node = route[index+1]
-        next_edge = self._graph.edges[current_node, next_node]
-        if index > 0:
-            if self._previous_decision != RoadOption.VOID \
-                    and self._intersection_end_node > 0 \
-                    and self._intersection_end_node != previous_node \
+        cv, nv = current_edge['exit_vector'], tail_edge['exit_vector']
+        if cv is None or nv is None:
+            return None
+        cross_list = []
+        for neighbor in self._graph.successors(current_node):
+            select_edge = self._graph.edges[current_node, neighbor]
+            if select_edge['type'] == RoadOption.LANEFOLLOW:
+                if neighbor != next_node:
+                    sv = select_edge['net_vector']
+                    cross_list.append(np.cross(cv, sv)[2])
+        next_cross = np.cross(cv, nv)[2]
+        deviation = math.acos(np.clip(
+            np.dot(cv, nv)/(np.linalg.norm(cv)*np.linalg.norm(nv)), -1.0, 1.0))
+        if not cross_list:
+            cross_list.append(0)
+        if deviation < threshold:
+            decision = RoadOption.STRAIGHT
+        elif cross_list and next_cross < min(cross_list):
+            decision = RoadOption.LEFT
+        elif cross_list and next_cross > max(cross_list):
+            decision = RoadOption.RIGHT
+        elif next_cross < 0:
+            decision = RoadOption.LEFT
+        elif next_cross > 0:
+            decision = RoadOption.RIGHT
+        return decision
+
+    def _route_road_options(self, route):
+        """
+        This method returns the turn decision (RoadOption) of each edge of a route. Turns entering
+        an intersection are read from the graph, and kept for the rest of the intersection edges.
+        It only reads the graph, so it can be used concurrently.
+        """
+        road_options = []
+        previous_decision = RoadOption.VOID
+        intersection_end_node = -1
+        for index in range(len(route) - 1):
+            current_node = route[index]
+            next_node = route[index+1]
+            next_edge = self._graph.edges[current_node, next_node]
+            if index == 0:
+                decision = next_edge['type']
+            elif previous_decision != RoadOption.VOID \
+                    and intersection_end_node > 0 \
+                    and intersection_end_node != route[index-1] \
                     and next_edge['type'] == RoadOption.LANEFOLLOW \
                     and next_edge['intersection']:
-                decision = self._previous_decision
+                decision = previous_decision
             else:
-                self._intersection_end_node = -1
-                current_edge = self._graph.edges[previous_node, current_node]
+                intersection_end_node = -1
+                current_edge = self._graph.edges[route[index-1], current_node]
                 calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge[
                     'intersection'] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']
                 if calculate_turn:
-                    last_node, tail_edge = self._successive_last_intersection_edge(index, route)
-                    self._intersection_end_node = last_node
-                    if tail_edge is not None:
-                        next_edge = tail_edge
-                    cv, nv = current_edge['exit_vector'], next_edge['exit_vector']
-                    if cv is None or nv is None:
-                        return next_edge['type']
-                    cross_list = []
-                    for neighbor in self._graph.successors(current_node):
-                        select_edge = self._graph.edges[current_node, neighbor]
-                        if select_edge['type'] == RoadOption.LANEFOLLOW:
-                            if neighbor != route[index+1]:
-                                sv = select_edge['net_vector']
-                                cross_list.append(np.cross(cv, sv)[2])
-                    next_cross = np.cross(cv, nv)[2]
-                    deviation = math.acos(np.clip(
-                        np.dot(cv, nv)/(np.linalg.norm(cv)*np.linalg.norm(nv)), -1.0, 1.0))
-                    if not cross_list:
-                        cross_list.append(0)
-                    if deviation < threshold:
-                        decision = RoadOption.STRAIGHT
-                    elif cross_list and next_cross < min(cross_list):
-                        decision = RoadOption.LEFT
-                    elif cross_list and next_cross > max(cross_list):
-                        decision = RoadOption.RIGHT
-                    elif next_cross < 0:
-                        decision = RoadOption.LEFT
-                    elif next_cross > 0:
-                        decision = RoadOption.RIGHT
+                    end = self._intersection_chain_end(index, route)
+                    intersection_end_node = route[end]
+                    chain = (next_node, route[end-1], route[end])
+                    turn_decisions = current_edge.get('turn_decisions', {})
+                    if chain in turn_decisions:
+                        decision = turn_decisions[chain]
+                    else:
+                        decision = self._classify_turn(
+                            current_edge, current_node, next_node, self._graph.edges[chain[1:]])
+                    if decision is None and (current_edge['exit_vector'] is None
+                                             or self._graph.edges[chain[1:]]['exit_vector'] is None):
+                        # Unclassified turns keep the previous decision for the next edges
+                        road_options.append(RoadOption.LANEFOLLOW)
+                        continue
                 else:
                     decision = next_edge['type']
 
-        else:
-            decision = next_edge['type']
+            previous_decision = decision
+            road_options.append(decision)
+        return road_options
+
+    def _endpoint(self, waypoint):
+        """
+        Returns the location and lane of a waypoint, as used by '_compute_route_trace'
+        """
+        location = waypoint.transform.location
+        return (location.x, location.y, location.z), (waypoint.road_id, waypoint.section_id, waypoint.lane_id)
+
+    def _find_closest_in_list(self, location, waypoint_ids):
+        """
+        Returns the index of the waypoint closest to a location
+
+            :param location (tuple): (x,y,z) location
+            :param waypoint_ids (list): waypoint table indices of the candidate waypoints
+        """
+        offsets = self._waypoint_table.locations(waypoint_ids) - np.asarray(location)
+        return int(np.argmin(np.einsum('ij,ij->i', offsets, offsets)))
+
+
+class CompactRoute(object):
+    """
+    Route stored as waypoint table indices and RoadOption values. It is converted into the list
+    of (carla.Waypoint, RoadOption) returned by 'trace_route' when needed.
+    """
+
+    def __init__(self, waypoint_ids, road_options, waypoint_table, origin_waypoint=None, origin_location=None):
+        """
+        :param waypoint_ids: waypoint table indices of the route, where -1 stands for the origin waypoint
+        :param road_options: RoadOption values of the route
+        :param waypoint_table: WaypointTable of the planner
+        :param origin_waypoint: carla.Waypoint where the route starts
+        :param origin_location: (x,y,z) location of the origin waypoint, used if origin_waypoint is not given.
+            The waypoint is then retrieved from the map when the route is materialized
+        """
+        self.waypoint_ids = waypoint_ids
+        self.road_options = road_options
+        self._waypoint_table = waypoint_table
+        self._origin_waypoint = origin_waypoint
+        self._origin_location = origin_location
+        if origin_waypoint is not None:
+            location = origin_waypoint.transform.location
+            self._origin_location = (location.x, location.y, location.z)
+
+    def __len__(self):
+        return len(self.waypoint_ids)
+
+    def locations(self):
+        """Returns the (x,y,z) locations of the route as a numpy array"""
+        return np.array([
+            self._origin_location if i < 0 else self._waypoint_table.location(i)
+            for i in self.waypoint_ids], dtype=np.float64).reshape(-1, 3)
+
+    def materialize(self):
+        """Returns the route as a list of (carla.Waypoint, RoadOption)"""
+        self._retrieve_origin()
+        return [
+            (self._origin_waypoint if i < 0 else self._waypoint_table.get(i), road_option)
+            for i, road_option in zip(self.waypoint_ids, self.road_options)]
+
+    def to_array(self, start=0, stop=None):
+        """
+        Returns the route, or part of it, as a RouteArray. Only the carla.Waypoint objects already
+        retrieved by the planner are passed on, the rest are retrieved by the RouteArray if needed.
+
+            :param start (int): first position of the route
+            :param stop (int): position after the last one. If None, the route is converted until its end
+        """
+        waypoint_ids = self.waypoint_ids[start:stop]
+        data = np.zeros(len(waypoint_ids), dtype=ROUTE_DTYPE)
+        data['option'] = [road_option.value for road_option in self.road_options[start:stop]]
+        waypoints = {}
+
+        ids = np.array(waypoint_ids, dtype=np.int64)
+        table_rows = np.nonzero(ids >= 0)[0]
+        if len(table_rows) > 0:
+            columns = self._waypoint_table.columns(ids[table_rows])
+            for name in ('x', 'y', 'z', 'yaw', 'road_id', 'section_id', 'lane_id', 's'):
+                data[name][table_rows] = columns[name]
+            for row in table_rows.tolist():
+                waypoint = self._waypoint_table.cached(waypoint_ids[row])
+                if waypoint is not None:
+                    waypoints[row] = waypoint
+
+        origin_rows = np.nonzero(ids < 0)[0].tolist()
+        if origin_rows:
+            self._retrieve_origin()
+            transform = self._origin_waypoint.transform
+            origin = self._origin_waypoint
+            for row in origin_rows:
+                data[row] = (transform.location.x, transform.location.y, transform.location.z,
+                             transform.rotation.yaw, origin.road_id, origin.section_id, origin.lane_id,
+                             origin.s, data['option'][row])
+                waypoints[row] = origin
+
+        return RouteArray(data, self._waypoint_table.map, waypoints)
+
+    def chunks(self, chunk_size):
+        """
+        Generator of consecutive RouteArray chunks of the route. Each chunk is only built when requested,
+        so long routes can be handed to the LocalPlanner progressively.
+
+            :param chunk_size (int): number of waypoints of each chunk
+        """
+        for start in range(0, len(self.waypoint_ids), chunk_size):
+            yield self.to_array(start, start + chunk_size)
+
+    def _retrieve_origin(self):
+        if self._origin_waypoint is None and -1 in self.waypoint_ids:
+            self._origin_waypoint = self._waypoint_table.waypoint_at(self._origin_location)
+
+
+def _can_fork():
+    """Whether the worker processes of 'trace_routes' can be forked, so that they inherit the planner"""
+    if hasattr(multiprocessing, 'get_all_start_methods'):
+        return 'fork' in multiprocessing.get_all_start_methods()
+    # Python 2 forks the processes on every platform but Windows
+    return os.name != 'nt'
+
+
+def _fork_context():
+    """Multiprocessing context that forks the processes"""
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+# Planner of the current worker process of 'trace_routes', set by the pool initializer
+_WORKER_PLANNER = None
+
+
+def _init_batch_worker(planner):
+    """Initializer of the worker processes of 'trace_routes'"""
+    global _WORKER_PLANNER
+    _WORKER_PLANNER = planner
+
+
+def _trace_route_task(task):
+    """Computes a route of 'trace_routes' inside a worker process"""
+    return _WORKER_PLANNER._trace_route_task(task)
 
-        self._previous_decision = decision
-        return decision
 
-    def _find_closest_in_list(self, current_waypoint, waypoint_list):
-        min_distance = float('inf')
-        closest_index = -1
-        for i, waypoint in enumerate(waypoint_list):
-            distance = waypoint.transform.location.distance(
-                current_waypoint.transform.location)
-            if distance < min_distance:
-                min_distance = distance
-                closest_index = i
-
-        return closest_index
+def _distance(location_1, location_2):
+    """Euclidean distance between two (x,y,z) locations"""
+    x = location_1[0] - location_2[0]
+    y = location_1[1] - location_2[1]
+    z = location_1[2] - location_2[2]
+    return math.sqrt(x*x + y*y + z*z)
@@ -0,0 +1,202 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides an incremental route search (D* Lite) over the RouteGraph,
+which repairs the previous search when the origin moves or the edge weights change.
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+
+import networkx as nx
+import numpy as np
+
+INFINITY = float('inf')
+
+# Weight given to the zero cost edges (lane changes). The repairs of the search need positive weights,
+# as a cycle of zero cost edges would keep supporting its own outdated distances
+MIN_WEIGHT = 1e-6
+
+# Relative tolerance when matching the distances of the search, which carry rounding errors.
+# It stays well below MIN_WEIGHT for the lengths of the routes of a map
+DISTANCE_TOLERANCE = 1e-12
+
+# Margin subtracted from the landmark heuristic, relative to the total weight of the graph. The rounding
+# errors of the landmark distances can make a tight bound exceed the weight of the edge it spans, and
+# the keys of the nodes of the route would then fall behind equal ones, stopping the search too early
+HEURISTIC_MARGIN = 1e-9
+
+
+class DStarLite(object):
+    """
+    DStarLite searches the shortest route towards a fixed target node. The search is done backwards,
+    from the target, so that the distances it computes remain valid when the origin moves, and only
+    the nodes affected by a change of the edge weights are updated afterwards.
+
+    The heuristic is the landmark lower bound if the RouteGraph has landmarks, and zero otherwise.
+    Zero cost edges are given a tiny positive weight, so among equally short routes, the ones with
+    fewer lane changes are preferred.
+    """
+
+    def __init__(self, route_graph, source, target):
+        """
+        :param route_graph: RouteGraph to search on. Its weights can change between searches,
+            as long as 'update_edge' is called for every changed edge
+        :param source: starting node of the graph
+        :param target: ending node of the graph
+        """
+        self._graph = route_graph
+        self.uses_landmarks = route_graph.landmarks is not None
+        self.target = target
+        self._target_i = route_graph.index(target)
+        self._source_i = route_graph.index(source)
+        self._last_source_i = self._source_i
+        self._key_modifier = 0.0
+        self._heuristic_margin = 0.0
+        if self.uses_landmarks:
+            weights = route_graph.weights
+            self._heuristic_margin = HEURISTIC_MARGIN * float(weights[np.isfinite(weights)].sum())
+
+        # Distance of each node to the target, and its one step lookahead. Missing nodes are at infinity
+        self._g = {}
+        self._rhs = {self._target_i: 0.0}
+
+        # Priority queue, with lazy deletion. Only the entries whose key matches the one in '_keys' are valid
+        self._queue = []
+        self._keys = {}
+        self._counter = count()
+        self._push(self._target_i)
+
+        # Number of nodes expanded by the last search
+        self.expanded_nodes = 0
+
+    def set_source(self, source):
+        """
+        Moves the starting node of the route.
+
+            :param source: new starting node of the graph
+        """
+        source_i = self._graph.index(source)
+        if source_i == self._source_i:
+            return
+        self._source_i = source_i
+        if self.uses_landmarks:
+            self._key_modifier += self._graph.lower_bound(self._last_source_i, source_i)
+        self._last_source_i = source_i
+
+    def update_edge(self, source, target):  # pylint: disable=unused-argument
+        """
+        Notifies the change of the weight of an edge.
+
+            :param source: starting node of the edge
+            :param target: ending node of the edge
+        """
+        self._update_vertex(self._graph.index(source))
+
+    def search(self):
+        """
+        Returns the shortest path from the starting node to the target as a list of nodes,
+        updating the previous search as needed
+        """
+        self._compute_shortest_path()
+
+        source_i = self._source_i
+        if self._g.get(source_i, INFINITY) == INFINITY:
+            raise nx.NetworkXNoPath("Node {} not reachable from {}".format(
+                self.target, self._graph.node_ids[source_i]))
+
+        # Breadth first search over the edges that are part of a shortest path
+        parents = {source_i: -1}
+        frontier = [source_i]
+        while self._target_i not in parents and frontier:
+            next_frontier = []
+            for current in frontier:
+                distance = self._g[current]
+                threshold = distance + DISTANCE_TOLERANCE * max(1.0, distance)
+                for neighbor, weight in self._graph.neighbors(current):
+                    if neighbor in parents:
+                        continue
+                    if max(weight, MIN_WEIGHT) + self._g.get(neighbor, INFINITY) <= threshold:
+                        parents[neighbor] = current
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        if self._target_i not in parents:
+            raise nx.NetworkXNoPath("Node {} not reachable from {}".format(
+                self.target, self._graph.node_ids[source_i]))
+
+        path = []
+        current = self._target_i
+        while current != -1:
+            path.append(int(self._graph.node_ids[current]))
+            current = parents[current]
+        path.reverse()
+        return path
+
+    def _heuristic(self, i):
+        if self.uses_landmarks:
+            return max(0.0, self._graph.lower_bound(self._source_i, i) - self._heuristic_margin)
+        return 0.0
+
+    def _key(self, i):
+        best = min(self._g.get(i, INFINITY), self._rhs.get(i, INFINITY))
+        return (best + self._heuristic(i) + self._key_modifier, best)
+
+    def _push(self, i):
+        key = self._key(i)
+        self._keys[i] = key
+        heappush(self._queue, (key, next(self._counter), i))
+
+    def _top(self):
+        """Removes the outdated entries at the top of the queue, returning the key of the first valid one"""
+        while self._queue:
+            key, _, i = self._queue[0]
+            if self._keys.get(i) == key:
+                return key
+            heappop(self._queue)
+        return (INFINITY, INFINITY)
+
+    def _update_vertex(self, i):
+        if i != self._target_i:
+            best = INFINITY
+            for neighbor, weight in self._graph.neighbors(i):
+                cost = max(weight, MIN_WEIGHT) + self._g.get(neighbor, INFINITY)
+                if cost < best:
+                    best = cost
+            self._rhs[i] = best
+        self._keys.pop(i, None)
+        if self._g.get(i, INFINITY) != self._rhs.get(i, INFINITY):
+            self._push(i)
+
+    def _compute_shortest_path(self):
+        expanded_nodes = 0
+        source_i = self._source_i
+        while True:
+            top_key = self._top()
+            if top_key == (INFINITY, INFINITY):
+                break
+            if top_key >= self._key(source_i) \
+                    and self._rhs.get(source_i, INFINITY) == self._g.get(source_i, INFINITY):
+                break
+
+            _, _, current = heappop(self._queue)
+            new_key = self._key(current)
+            if top_key < new_key:
+                self._push(current)
+                continue
+
+            expanded_nodes += 1
+            del self._keys[current]
+            if self._g.get(current, INFINITY) > self._rhs.get(current, INFINITY):
+                self._g[current] = self._rhs[current]
+                for predecessor, _ in self._graph.neighbors(current, reverse=True):
+                    self._update_vertex(predecessor)
+            else:
+                self._g[current] = INFINITY
+                for predecessor, _ in self._graph.neighbors(current, reverse=True):
+                    self._update_vertex(predecessor)
+                self._update_vertex(current)
+
+        self.expanded_nodes = expanded_nodes
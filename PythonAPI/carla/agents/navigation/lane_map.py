@@ -0,0 +1,505 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a client side copy of the lane geometry of a map, answering batches of
+projection and lane following queries with numpy instead of calls to the server.
+"""
+
+import math
+
+import numpy as np
+
+import carla
+from agents.navigation.topology_cache import TopologyCache
+
+# Result of projecting a location onto the lanes of the map
+PROJECTION_DTYPE = np.dtype([
+    ('lane', np.int32),  # row of the lane in the LaneMap
+    ('road_id', np.int32),
+    ('section_id', np.int32),
+    ('lane_id', np.int32),
+    ('s', np.float64),  # OpenDRIVE s of the projection
+    ('offset', np.float64),  # lateral distance to the centerline, positive to the right of the driving direction
+    ('distance', np.float64),  # distance to the projection
+])
+
+
+def location_array(locations):
+    """
+    Converts locations to an (n, 3) array
+
+        :param locations: list of carla.Location, or array-like of (x, y, z)
+    """
+    if len(locations) > 0 and hasattr(locations[0], 'x'):
+        return np.array([[location.x, location.y, location.z] for location in locations], dtype=np.float64)
+    return np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+
+
+class LaneMap(object):
+    """
+    LaneMap holds the centerlines of the lanes of a map as dense arrays, sampled from 'generate_waypoints'
+    plus the lane ends of 'get_topology', along with the lane connectivity: successors, and left and
+    right neighbours. Lanes are identified by their row in the map, and positions along them by
+    their OpenDRIVE s, so the results can always be turned into a carla.Waypoint with 'get_waypoint_xodr'.
+
+    Locations are projected with a uniform grid of the centerline segments, in which each segment is
+    registered in all the cells closer than 'search_radius' to it. The nearest segment of any location
+    closer than that to a lane is then among the segments of its own cell.
+
+    The arrays can be saved to disk and loaded by other processes, as a TopologyCache entry.
+    """
+
+    def __init__(self, arrays, wmap=None, cell_size=10.0, search_radius=5.0):
+        """
+        :param arrays: dictionary with the arrays of the map, as returned by 'to_arrays'
+        :param wmap: carla.Map used to retrieve waypoints. It isn't needed by the queries
+        :param cell_size: side of the cells of the projection grid, in meters
+        :param search_radius: distance up to which projections are answered by the grid, in meters.
+            Farther locations are projected by a search over all the lanes
+        """
+        self._map = wmap
+
+        # Centerline points, sorted by lane and s
+        self._xyz = arrays['xyz']
+        self._s = arrays['s']
+        self._width = arrays['width']
+        self._point_lane = arrays['point_lane']
+
+        # Lanes, with their points in [start, stop)
+        self._road_id = arrays['road_id']
+        self._section_id = arrays['section_id']
+        self._lane_id = arrays['lane_id']
+        self._lane_type = arrays['lane_type']
+        self._is_junction = arrays['is_junction']
+        self._direction = arrays['direction']
+        self._start = arrays['start']
+        self._stop = arrays['stop']
+
+        # Connectivity. The successors of a lane are in [successor_start[lane], successor_start[lane + 1])
+        self._left = arrays['left']
+        self._right = arrays['right']
+        self._successor_start = arrays['successor_start']
+        self._successors = arrays['successors']
+
+        # Key sorting the points by lane and s, used to locate an s within its lane
+        self._key_span = float(np.ceil(self._s.max())) + 1.0 if len(self._s) > 0 else 1.0
+        self._point_keys = self._point_lane * self._key_span + self._s
+        self._s_min = self._s[self._start]
+        self._s_max = self._s[self._stop - 1]
+
+        # Segments between consecutive points of the same lane
+        segments = np.flatnonzero(self._point_lane[:-1] == self._point_lane[1:])
+        self._segment_points = segments
+        self._segment_lane = self._point_lane[segments]
+
+        # Bounding box of each lane
+        self._lane_low = np.minimum.reduceat(self._xyz, self._start) if len(self._start) > 0 else np.zeros((0, 3))
+        self._lane_high = np.maximum.reduceat(self._xyz, self._start) if len(self._start) > 0 else np.zeros((0, 3))
+
+        self._cell_size = cell_size
+        self._search_radius = search_radius
+        self._build_grid()
+
+    @classmethod
+    def from_map(cls, wmap, resolution=1.0, cache_dir=None, **kwargs):
+        """
+        Builds the lane map of a carla.Map, or loads it from the cache folder if it was already built
+
+            :param wmap (carla.Map): map whose lanes are stored
+            :param resolution (float): distance between the sampled centerline points, in meters
+            :param cache_dir (str): folder of the TopologyCache. If None, the lane map isn't cached
+        """
+        cache = TopologyCache(wmap, resolution, cache_dir) if cache_dir is not None else None
+        arrays = cache.load_lane_map() if cache is not None else None
+        if arrays is None:
+            arrays = cls._sample(wmap, resolution)
+            if cache is not None:
+                cache.save_lane_map(arrays)
+        return cls(arrays, wmap, **kwargs)
+
+    @classmethod
+    def load(cls, path, wmap=None, **kwargs):
+        """
+        Loads a lane map written by 'save'
+
+            :param path (str): path of the .npz file
+            :param wmap (carla.Map): map used to retrieve waypoints, optional
+        """
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {key: data[key] for key in data.files}
+        return cls(arrays, wmap, **kwargs)
+
+    def save(self, path):
+        """
+        Writes the arrays of the lane map to a compressed numpy file
+
+            :param path (str): path of the .npz file
+        """
+        np.savez_compressed(path, **self.to_arrays())
+
+    def to_arrays(self):
+        """Returns the arrays defining the lane map"""
+        return {
+            'xyz': self._xyz,
+            's': self._s,
+            'width': self._width,
+            'point_lane': self._point_lane,
+            'road_id': self._road_id,
+            'section_id': self._section_id,
+            'lane_id': self._lane_id,
+            'lane_type': self._lane_type,
+            'is_junction': self._is_junction,
+            'direction': self._direction,
+            'start': self._start,
+            'stop': self._stop,
+            'left': self._left,
+            'right': self._right,
+            'successor_start': self._successor_start,
+            'successors': self._successors}
+
+    @staticmethod
+    def _sample(wmap, resolution):
+        """Samples the centerlines and the connectivity of the lanes of a map"""
+        waypoints = list(wmap.generate_waypoints(resolution))
+        for entry_waypoint, exit_waypoint in wmap.get_topology():
+            waypoints.append(entry_waypoint)
+            waypoints.append(exit_waypoint)
+
+        lanes = {}  # (road_id, section_id, lane_id) -> list of rows
+        rows = np.zeros((len(waypoints), 7))  # x, y, z, s, width, forward x, forward y
+        lane_info = {}
+        for i, waypoint in enumerate(waypoints):
+            key = (waypoint.road_id, waypoint.section_id, waypoint.lane_id)
+            location = waypoint.transform.location
+            yaw = math.radians(waypoint.transform.rotation.yaw)
+            rows[i] = (location.x, location.y, location.z, waypoint.s, waypoint.lane_width,
+                       math.cos(yaw), math.sin(yaw))
+            lanes.setdefault(key, []).append(i)
+            if key not in lane_info:
+                lane_info[key] = (int(waypoint.lane_type), waypoint.is_junction)
+
+        keys = sorted(lanes)
+        index = {key: i for i, key in enumerate(keys)}
+        xyz, s, width, point_lane, direction = [], [], [], [], []
+        for lane, key in enumerate(keys):
+            lane_rows = rows[lanes[key]]
+            lane_rows = lane_rows[np.argsort(lane_rows[:, 3], kind='stable')]
+            # The topology ends are usually also sampled, keep one point per s
+            keep = np.concatenate([[True], np.diff(lane_rows[:, 3]) > 1e-3])
+            lane_rows = lane_rows[keep]
+            xyz.append(lane_rows[:, :3])
+            s.append(lane_rows[:, 3])
+            width.append(lane_rows[:, 4])
+            point_lane.append(np.full(len(lane_rows), lane, dtype=np.int32))
+
+            # Lanes are driven towards increasing or decreasing s, found from their geometry
+            if len(lane_rows) > 1:
+                chord = lane_rows[-1, :2] - lane_rows[0, :2]
+                direction.append(1 if np.dot(chord, lane_rows[:, 5:7].mean(axis=0)) >= 0 else -1)
+            else:
+                direction.append(1 if key[2] < 0 else -1)
+
+        lengths = np.array([len(points) for points in s], dtype=np.int64)
+        stop = np.cumsum(lengths)
+        start = stop - lengths
+        xyz = np.concatenate(xyz)
+        direction = np.array(direction, dtype=np.int8)
+
+        # Neighbour lanes share road and section, and skip the lane 0 of the reference line
+        def neighbour(key, step):
+            lane_id = key[2] + step
+            if lane_id == 0:
+                lane_id += step
+            return index.get((key[0], key[1], lane_id), -1)
+        left = np.array([neighbour(key, 1 if key[2] < 0 else -1) for key in keys], dtype=np.int32)
+        right = np.array([neighbour(key, -1 if key[2] < 0 else 1) for key in keys], dtype=np.int32)
+
+        # A lane continues into the lanes starting where it ends
+        first = np.where(direction > 0, start, stop - 1)
+        last = np.where(direction > 0, stop - 1, start)
+        entries, exits = xyz[first], xyz[last]
+        successors = [[] for _ in keys]
+        for chunk in range(0, len(keys), 256):
+            distances = np.linalg.norm(exits[chunk:chunk + 256, np.newaxis] - entries[np.newaxis], axis=2)
+            for lane, successor in zip(*np.nonzero(distances < 0.5)):
+                if chunk + lane != successor:
+                    successors[chunk + lane].append(successor)
+        successor_start = np.concatenate([[0], np.cumsum([len(lane) for lane in successors])]).astype(np.int64)
+
+        return {
+            'xyz': xyz,
+            's': np.concatenate(s),
+            'width': np.concatenate(width),
+            'point_lane': np.concatenate(point_lane),
+            'road_id': np.array([key[0] for key in keys], dtype=np.int32),
+            'section_id': np.array([key[1] for key in keys], dtype=np.int32),
+            'lane_id': np.array([key[2] for key in keys], dtype=np.int32),
+            'lane_type': np.array([lane_info[key][0] for key in keys], dtype=np.int64),
+            'is_junction': np.array([lane_info[key][1] for key in keys], dtype=bool),
+            'direction': direction,
+            'start': start,
+            'stop': stop,
+            'left': left,
+            'right': right,
+            'successor_start': successor_start,
+            'successors': np.array([lane for lanes in successors for lane in lanes], dtype=np.int32)}
+
+    def _cell_keys(self, cells):
+        """Encodes integer (x, y) cells as single int64 keys"""
+        cells = cells.astype(np.int64)
+        return (cells[..., 0] << 32) + (cells[..., 1] + (1 << 31))
+
+    def _build_grid(self):
+        """Registers each segment in the cells closer than the search radius to its bounding box"""
+        a = self._xyz[self._segment_points, :2]
+        b = self._xyz[self._segment_points + 1, :2]
+        low = np.floor((np.minimum(a, b) - self._search_radius) / self._cell_size).astype(np.int64)
+        high = np.floor((np.maximum(a, b) + self._search_radius) / self._cell_size).astype(np.int64)
+        spans = high - low + 1
+
+        counts = spans[:, 0] * spans[:, 1]
+        segments = np.repeat(np.arange(len(a)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = low[segments] + np.stack([offsets // spans[segments, 1], offsets % spans[segments, 1]], axis=1)
+
+        keys = self._cell_keys(cells)
+        order = np.argsort(keys, kind='stable')
+        keys, self._grid_segments = keys[order], segments[order]
+        self._grid_keys, self._grid_start = np.unique(keys, return_index=True)
+        self._grid_stop = np.append(self._grid_start[1:], len(keys))
+
+    def __len__(self):
+        return len(self._road_id)
+
+    @property
+    def map(self):
+        """carla.Map of the lanes, if given"""
+        return self._map
+
+    def lane_keys(self, lanes):
+        """
+        Returns the (road_id, section_id, lane_id) of lanes
+
+            :param lanes: (n,) array of lane rows
+            :return: (n, 3) array
+        """
+        lanes = np.asarray(lanes, dtype=np.int64)
+        return np.stack([self._road_id[lanes], self._section_id[lanes], self._lane_id[lanes]], axis=-1)
+
+    def project(self, locations, lane_type=carla.LaneType.Driving):
+        """
+        Projects locations onto the centerline of their closest lane, like 'carla.Map.get_waypoint'
+
+            :param locations: list of carla.Location, or (n, 3) array
+            :param lane_type (carla.LaneType): types of lanes considered
+            :return: (n,) array of PROJECTION_DTYPE
+        """
+        points = location_array(locations)
+        lane_mask = (self._lane_type & int(lane_type)) != 0
+        result = np.zeros(len(points), dtype=PROJECTION_DTYPE)
+        if len(points) == 0:
+            return result
+
+        # Candidate segments of the cell of each point
+        keys = self._cell_keys(np.floor(points[:, :2] / self._cell_size))
+        cells = np.clip(np.searchsorted(self._grid_keys, keys), 0, len(self._grid_keys) - 1)
+        found = self._grid_keys[cells] == keys
+        counts = np.where(found, self._grid_stop[cells] - self._grid_start[cells], 0)
+        queries = np.repeat(np.arange(len(points)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates = self._grid_segments[np.repeat(self._grid_start[cells], counts) + offsets]
+        best_segment, best_t, best_distance = self._closest(points, queries, candidates, lane_mask)
+
+        # Points without any lane within the search radius only look at the lanes whose bounding box
+        # is closer than the first point of the nearest lane
+        missing = np.flatnonzero(best_distance > self._search_radius)
+        if len(missing) > 0:
+            queries, candidates = self._far_candidates(points[missing], lane_mask)
+            segment, t, distance = self._closest(points[missing], queries, candidates, lane_mask)
+            improved = distance < best_distance[missing]
+            missing = missing[improved]
+            best_segment[missing], best_t[missing], best_distance[missing] = \
+                segment[improved], t[improved], distance[improved]
+
+        valid = best_segment >= 0
+        segment = np.where(valid, best_segment, 0)
+        first = self._segment_points[segment]
+        a, b = self._xyz[first], self._xyz[first + 1]
+        lanes = self._segment_lane[segment]
+        projection = a + best_t[:, np.newaxis] * (b - a)
+
+        # Lateral offset, positive towards the right vector of the driving direction
+        forward = (b - a)[:, :2] * self._direction[lanes, np.newaxis]
+        forward /= np.maximum(np.linalg.norm(forward, axis=1), 1e-9)[:, np.newaxis]
+        lateral = points[:, :2] - projection[:, :2]
+
+        result['lane'] = np.where(valid, lanes, -1)
+        result['road_id'] = self._road_id[lanes]
+        result['section_id'] = self._section_id[lanes]
+        result['lane_id'] = self._lane_id[lanes]
+        result['s'] = self._s[first] + best_t * (self._s[first + 1] - self._s[first])
+        result['offset'] = lateral[:, 1] * forward[:, 0] - lateral[:, 0] * forward[:, 1]
+        result['distance'] = np.where(valid, best_distance, np.inf)
+        return result
+
+    def _far_candidates(self, points, lane_mask):
+        """Candidate (query, segment) pairs of points far from the lanes, pruned with the lane bounding boxes"""
+        lanes = np.flatnonzero(lane_mask & (self._stop - self._start > 1))
+        if len(lanes) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        low, high = self._lane_low[lanes], self._lane_high[lanes]
+        lower_bound = np.linalg.norm(np.maximum(np.maximum(low - points[:, np.newaxis], 0.0),
+                                                points[:, np.newaxis] - high), axis=2)
+        upper_bound = np.linalg.norm(self._xyz[self._start[lanes]] - points[:, np.newaxis], axis=2).min(axis=1)
+        queries, candidate_lanes = np.nonzero(lower_bound <= upper_bound[:, np.newaxis])
+        candidate_lanes = lanes[candidate_lanes]
+
+        # Segments of the candidate lanes, which are the points of the lane but the last one
+        counts = self._stop[candidate_lanes] - self._start[candidate_lanes] - 1
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        points_of_segments = np.repeat(self._start[candidate_lanes], counts) + offsets
+        return np.repeat(queries, counts), np.searchsorted(self._segment_points, points_of_segments)
+
+    def _closest(self, points, queries, candidates, lane_mask):
+        """Closest of the candidate segments of each point, as (segment, t, distance) arrays"""
+        n = len(points)
+        best_segment = np.full(n, -1, dtype=np.int64)
+        best_t = np.zeros(n)
+        best_distance = np.full(n, np.inf)
+
+        keep = lane_mask[self._segment_lane[candidates]]
+        queries, candidates = queries[keep], candidates[keep]
+        if len(candidates) == 0:
+            return best_segment, best_t, best_distance
+
+        a = self._xyz[self._segment_points[candidates]]
+        ab = self._xyz[self._segment_points[candidates] + 1] - a
+        ap = points[queries] - a
+        t = np.clip(np.einsum('ij,ij->i', ap, ab) / np.maximum(np.einsum('ij,ij->i', ab, ab), 1e-12), 0.0, 1.0)
+        distances = np.linalg.norm(ap - t[:, np.newaxis] * ab, axis=1)
+
+        # Minimum per query. The pairs are grouped by query, so it is a segmented reduction
+        group_start = np.flatnonzero(np.concatenate([[True], queries[1:] != queries[:-1]]))
+        minimum = np.repeat(np.minimum.reduceat(distances, group_start), np.diff(np.append(group_start, len(queries))))
+        is_minimum = np.flatnonzero(distances == minimum)
+        _, first = np.unique(queries[is_minimum], return_index=True)
+        first = is_minimum[first]
+        best_segment[queries[first]] = candidates[first]
+        best_t[queries[first]] = t[first]
+        best_distance[queries[first]] = distances[first]
+        return best_segment, best_t, best_distance
+
+    def locate(self, lanes, s):
+        """
+        Returns the location and driving direction at positions along lanes
+
+            :param lanes: (n,) array of lane rows
+            :param s: (n,) array of OpenDRIVE s
+            :return: (n, 3) array of locations and (n,) array of yaws, in degrees
+        """
+        lanes = np.asarray(lanes, dtype=np.int64).reshape(-1)
+        s = np.clip(np.asarray(s, dtype=np.float64).reshape(-1), self._s_min[lanes], self._s_max[lanes])
+
+        # Segment of each position, keeping it inside its lane
+        index = np.searchsorted(self._point_keys, lanes * self._key_span + s, side='right') - 1
+        index = np.clip(index, self._start[lanes], np.maximum(self._stop[lanes] - 2, self._start[lanes]))
+        following = np.minimum(index + 1, self._stop[lanes] - 1)
+
+        ds = self._s[following] - self._s[index]
+        t = np.where(ds > 0, (s - self._s[index]) / np.where(ds > 0, ds, 1.0), 0.0)
+        a, b = self._xyz[index], self._xyz[following]
+        locations = a + t[:, np.newaxis] * (b - a)
+        forward = (b - a) * self._direction[lanes, np.newaxis]
+        yaws = np.degrees(np.arctan2(forward[:, 1], forward[:, 0]))
+        return locations, yaws
+
+    def advance(self, lanes, s, distances, choices=None):
+        """
+        Moves positions along their lanes in the driving direction, continuing into the successor
+        lanes, like 'carla.Waypoint.next'
+
+            :param lanes: (n,) array of lane rows
+            :param s: (n,) array of OpenDRIVE s
+            :param distances: (n,) array, or scalar, of distances to move, in meters
+            :param choices: (n,) array of the successor taken at each fork, as an index modulo the
+                number of successors. If None, the first one is always taken
+            :return: (lanes, s, ended) arrays, where ended is True for the positions that reached
+                a lane without successors before covering their distance
+        """
+        lanes = np.array(lanes, dtype=np.int64).reshape(-1)
+        s = np.array(s, dtype=np.float64).reshape(-1)
+        remaining = np.broadcast_to(np.asarray(distances, dtype=np.float64), s.shape).copy()
+        choices = np.zeros(len(s), dtype=np.int64) if choices is None else np.asarray(choices, dtype=np.int64)
+        ended = np.zeros(len(s), dtype=bool)
+
+        active = np.arange(len(s))
+        while len(active) > 0:
+            lane = lanes[active]
+            direction = self._direction[lane]
+            available = np.where(direction > 0, self._s_max[lane] - s[active], s[active] - self._s_min[lane])
+            available = np.maximum(available, 0.0)
+
+            done = remaining[active] <= available
+            finished = active[done]
+            s[finished] += direction[done] * remaining[finished]
+
+            active, lane, available = active[~done], lane[~done], available[~done]
+            remaining[active] -= available
+            counts = self._successor_start[lane + 1] - self._successor_start[lane]
+
+            dead_end = counts == 0
+            ended[active[dead_end]] = True
+            s[active[dead_end]] = np.where(self._direction[lane[dead_end]] > 0,
+                                           self._s_max[lane[dead_end]], self._s_min[lane[dead_end]])
+
+            active, lane, counts = active[~dead_end], lane[~dead_end], counts[~dead_end]
+            successor = self._successors[self._successor_start[lane] + choices[active] % counts]
+            lanes[active] = successor
+            s[active] = np.where(self._direction[successor] > 0, self._s_min[successor], self._s_max[successor])
+
+        return lanes, s, ended
+
+    def successors(self, lane):
+        """Returns the rows of the lanes following a lane"""
+        return self._successors[self._successor_start[lane]:self._successor_start[lane + 1]]
+
+    def left(self, lanes):
+        """
+        Returns the lanes to the left of lanes, in their driving direction, or -1 if there isn't one.
+        Like 'carla.Waypoint.get_left_lane', the lane of the opposite direction is returned past the center
+
+            :param lanes: (n,) array of lane rows
+        """
+        return self._left[np.asarray(lanes, dtype=np.int64)]
+
+    def right(self, lanes):
+        """
+        Returns the lanes to the right of lanes, in their driving direction, or -1 if there isn't one
+
+            :param lanes: (n,) array of lane rows
+        """
+        return self._right[np.asarray(lanes, dtype=np.int64)]
+
+    def lane_width(self, lanes, s):
+        """Returns the width of lanes at positions along them"""
+        lanes = np.asarray(lanes, dtype=np.int64).reshape(-1)
+        index = np.searchsorted(self._point_keys, lanes * self._key_span + np.asarray(s, dtype=np.float64))
+        return self._width[np.clip(index, self._start[lanes], self._stop[lanes] - 1)]
+
+    def is_junction(self, lanes):
+        """Returns whether lanes are part of a junction"""
+        return self._is_junction[np.asarray(lanes, dtype=np.int64)]
+
+    def waypoint(self, lane, s):
+        """
+        Returns the carla.Waypoint at a position along a lane, retrieved from the map
+
+            :param lane (int): lane row
+            :param s (float): OpenDRIVE s
+        """
+        if self._map is None:
+            raise ValueError("The LaneMap was created without a carla.Map")
+        return self._map.get_waypoint_xodr(int(self._road_id[lane]), int(self._lane_id[lane]), float(s))
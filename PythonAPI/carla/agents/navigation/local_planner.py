@@ -6,12 +6,15 @@
 """ This module contains a local planner to perform low-level waypoint following based on PID controllers. """
 
 from enum import Enum
-from collections import deque
 import random
 
+import numpy as np
+
 import carla
 from agents.navigation.controller import VehiclePIDController
-from agents.tools.misc import draw_waypoints, get_speed
+from agents.tools.misc import draw_waypoints
+from agents.tools.profiler import AgentProfiler
+from agents.tools.world_state import WorldStateCache
 
 
 class RoadOption(Enum):
@@ -28,6 +31,480 @@ class RoadOption(Enum):
     CHANGELANERIGHT = 6
 
 
+ROUTE_DTYPE = np.dtype([
+    ('x', np.float64), ('y', np.float64), ('z', np.float64), ('yaw', np.float64),
+    ('road_id', np.int32), ('section_id', np.int32), ('lane_id', np.int32), ('s', np.float64),
+    ('option', np.int8)])
+
+
+class RouteArray(object):
+    """
+    RouteArray stores a route as a structured numpy array, with one row per waypoint and the fields
+    x, y, z, yaw, road_id, section_id, lane_id, s and option (the value of its RoadOption).
+    The carla.Waypoint of a row is only retrieved from the map the first time it is asked for.
+
+    Indexing it with an integer returns a (carla.Waypoint, RoadOption) pair, like the routes
+    returned by 'trace_route', and slicing it returns a new RouteArray.
+    """
+
+    def __init__(self, data, wmap, waypoints=None):
+        """
+        :param data: numpy array with ROUTE_DTYPE
+        :param wmap: carla.Map used to retrieve the waypoints
+        :param waypoints: dictionary with the already known carla.Waypoint of some rows, by row index
+        """
+        self.data = data
+        self._wmap = wmap
+        self._waypoints = dict(waypoints) if waypoints else dict()
+
+    @classmethod
+    def from_route(cls, route, wmap):
+        """
+        Creates a RouteArray from a list of (carla.Waypoint, RoadOption)
+
+            :param route (list): route to be converted
+            :param wmap (carla.Map): map used to retrieve the waypoints
+        """
+        data = np.zeros(len(route), dtype=ROUTE_DTYPE)
+        for i, (waypoint, road_option) in enumerate(route):
+            transform = waypoint.transform
+            data[i] = (transform.location.x, transform.location.y, transform.location.z, transform.rotation.yaw,
+                       waypoint.road_id, waypoint.section_id, waypoint.lane_id, waypoint.s, road_option.value)
+        return cls(data, wmap, {i: waypoint for i, (waypoint, _) in enumerate(route)})
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self.data))
+            rows = range(start, stop, step)
+            waypoints = {i: self._waypoints[row] for i, row in enumerate(rows) if row in self._waypoints}
+            return RouteArray(self.data[index], self._wmap, waypoints)
+        return self.waypoint(index), self.road_option(index)
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield self.waypoint(i), self.road_option(i)
+
+    def location(self, index):
+        """Returns the (x,y,z) location of a row"""
+        row = self.data[index]
+        return float(row['x']), float(row['y']), float(row['z'])
+
+    def locations(self):
+        """Returns the (x,y,z) locations of the route as a (n, 3) numpy array"""
+        return np.stack([self.data['x'], self.data['y'], self.data['z']], axis=1)
+
+    def road_option(self, index):
+        """Returns the RoadOption of a row"""
+        return RoadOption(int(self.data['option'][index]))
+
+    def waypoint(self, index):
+        """Returns the carla.Waypoint of a row, retrieving it from the map if needed"""
+        if index < 0:
+            index += len(self.data)
+        waypoint = self._waypoints.get(index)
+        if waypoint is None:
+            row = self.data[index]
+            waypoint = self._wmap.get_waypoint_xodr(int(row['road_id']), int(row['lane_id']), float(row['s']))
+            if waypoint is None:
+                # Floating point imprecision at the end of the lane, project the location instead
+                waypoint = self._wmap.get_waypoint(carla.Location(*self.location(index)))
+            self._waypoints[index] = waypoint
+        return waypoint
+
+    def chunks(self, chunk_size):
+        """
+        Generator of consecutive RouteArray chunks of the route
+
+            :param chunk_size (int): number of rows of each chunk
+        """
+        for start in range(0, len(self.data), chunk_size):
+            yield self[start:start + chunk_size]
+
+    def materialize(self):
+        """Returns the route as a list of (carla.Waypoint, RoadOption)"""
+        return list(self)
+
+
+class WaypointQueue(object):
+    """
+    Double ended queue of (carla.Waypoint, RoadOption) pairs used by the LocalPlanner, stored in a numpy
+    ring buffer along with the location of each entry and the cumulative arc length of the queue.
+    Entries coming from a RouteArray only retrieve their waypoint when accessed.
+
+    Like a deque with a maximum length, the oldest entries are discarded when it is full.
+    Indexing is O(1), and purging the entries close to the vehicle only checks the ones removed.
+
+    Each entry also has a speed limit and a target speed, written by a SpeedProfile. The queue counts
+    the entries appended since the profile was last updated, so that only those are computed.
+    """
+
+    def __init__(self, maxlen):
+        """
+        :param maxlen: maximum number of entries
+        """
+        self.maxlen = maxlen
+        self._head = 0
+        self._size = 0
+        self.unprofiled = 0  # Number of entries at the end of the queue without target speed
+        self._allocate(0)
+
+    def _buffers(self):
+        return self._xyz, self._arc, self._options, self._waypoints, self._routes, self._rows, self._limits, \
+            self._speeds
+
+    def _allocate(self, capacity):
+        """Creates empty buffers with room for 'capacity' entries"""
+        self._capacity = capacity
+        self._xyz = np.zeros((capacity, 3), dtype=np.float64)
+        self._arc = np.zeros(capacity, dtype=np.float64)
+        self._options = np.empty(capacity, dtype=object)
+        self._waypoints = np.empty(capacity, dtype=object)
+        self._routes = np.empty(capacity, dtype=object)
+        self._rows = np.zeros(capacity, dtype=np.int64)
+        self._limits = np.zeros(capacity, dtype=np.float64)
+        self._speeds = np.zeros(capacity, dtype=np.float64)
+
+    def _positions(self, start, stop):
+        """Buffer positions of the entries in [start, stop)"""
+        return (self._head + np.arange(start, stop)) % max(self._capacity, 1)
+
+    def _position(self, index):
+        if index < 0:
+            index += self._size
+        if index < 0 or index >= self._size:
+            raise IndexError('WaypointQueue index out of range')
+        return (self._head + index) % self._capacity
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        position = self._position(index)
+        waypoint = self._waypoints[position]
+        if waypoint is None:
+            waypoint = self._routes[position].waypoint(int(self._rows[position]))
+            self._waypoints[position] = waypoint
+        return waypoint, self._options[position]
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self[i]
+
+    def location(self, index):
+        """Returns the (x,y,z) location of an entry, without retrieving its waypoint"""
+        return tuple(self._xyz[self._position(index)].tolist())
+
+    def locations(self, start=0, stop=None):
+        """Returns the (x,y,z) locations of the entries in [start, stop) as a numpy array"""
+        stop = self._size if stop is None else min(stop, self._size)
+        return self._xyz[self._positions(start, stop)]
+
+    def distance(self, index):
+        """Returns the arc length between the first entry of the queue and the given one"""
+        return float(self._arc[self._position(index)] - self._arc[self._head])
+
+    def arc_lengths(self, start=0, stop=None):
+        """Returns the cumulative arc length of the entries in [start, stop), from an arbitrary origin"""
+        stop = self._size if stop is None else min(stop, self._size)
+        return self._arc[self._positions(start, stop)]
+
+    def road_ids(self, start=0, stop=None):
+        """Returns the road ids of the entries in [start, stop), without retrieving their waypoints"""
+        stop = self._size if stop is None else min(stop, self._size)
+        road_ids = np.zeros(max(stop - start, 0), dtype=np.int64)
+        for i, position in enumerate(self._positions(start, stop).tolist()):
+            waypoint = self._waypoints[position]
+            if waypoint is not None:
+                road_ids[i] = waypoint.road_id
+            else:
+                road_ids[i] = self._routes[position].data['road_id'][self._rows[position]]
+        return road_ids
+
+    def speed_limits(self, start=0, stop=None):
+        """Returns the speed limits of the entries in [start, stop), in Km/h"""
+        stop = self._size if stop is None else min(stop, self._size)
+        return self._limits[self._positions(start, stop)]
+
+    def speeds(self, start=0, stop=None):
+        """Returns the target speeds of the entries in [start, stop), in Km/h"""
+        stop = self._size if stop is None else min(stop, self._size)
+        return self._speeds[self._positions(start, stop)]
+
+    def set_profile(self, start, limits, speeds):
+        """
+        Writes the speed limits and target speeds of the entries from 'start' to the end of the queue,
+        which become profiled
+
+            :param start (int): index of the first entry written
+            :param limits: speed limits of the entries, in Km/h
+            :param speeds: target speeds of the entries, in Km/h
+        """
+        positions = self._positions(start, self._size)
+        self._limits[positions] = limits
+        self._speeds[positions] = speeds
+        self.unprofiled = 0
+
+    def invalidate_profile(self):
+        """Marks all the entries as needing a new target speed"""
+        self.unprofiled = self._size
+
+    def index_at_distance(self, distance):
+        """
+        Returns the index of the first entry whose arc length from the start of the queue
+        is at least the given distance, or the last index if the queue is shorter
+
+            :param distance (float): arc length, in meters
+        """
+        if self._size == 0:
+            raise IndexError('WaypointQueue is empty')
+        arc = self._arc[self._positions(0, self._size)]
+        index = int(np.searchsorted(arc, arc[0] + distance))
+        return min(index, self._size - 1)
+
+    def append(self, item):
+        """
+        Adds a (carla.Waypoint, RoadOption) pair to the end of the queue
+
+            :param item (tuple): pair to be added
+        """
+        self.extend([item])
+
+    def extend(self, items):
+        """
+        Adds a list of (carla.Waypoint, RoadOption) pairs to the end of the queue
+
+            :param items (list): pairs to be added
+        """
+        items = list(items)[-self.maxlen:] if self.maxlen > 0 else []
+        if not items:
+            return
+        xyz = np.empty((len(items), 3), dtype=np.float64)
+        for i, (waypoint, _) in enumerate(items):
+            location = waypoint.transform.location
+            xyz[i] = (location.x, location.y, location.z)
+        positions = self._reserve(len(items))
+        self._write(positions, xyz)
+        self._options[positions] = [road_option for _, road_option in items]
+        self._waypoints[positions] = [waypoint for waypoint, _ in items]
+        self._routes[positions] = None
+
+    def extend_route(self, route):
+        """
+        Adds all the rows of a RouteArray to the end of the queue, without retrieving their waypoints
+
+            :param route (RouteArray): route to be added
+        """
+        start = max(0, len(route) - self.maxlen)
+        if start >= len(route):
+            return
+        options = [RoadOption(option) for option in route.data['option'][start:].tolist()]
+        positions = self._reserve(len(options))
+        self._write(positions, route.locations()[start:])
+        self._options[positions] = options
+        self._waypoints[positions] = None
+        # Filled instead of assigned, as numpy would otherwise store the rows of the route
+        routes = np.empty(len(positions), dtype=object)
+        routes.fill(route)
+        self._routes[positions] = routes
+        self._rows[positions] = np.arange(start, len(route))
+
+    def popleft(self):
+        """Removes the first entry of the queue"""
+        if self._size == 0:
+            raise IndexError('pop from an empty WaypointQueue')
+        self.discard(1)
+
+    def discard(self, count):
+        """
+        Removes the first entries of the queue
+
+            :param count (int): number of entries to remove
+        """
+        count = min(count, self._size)
+        if count <= 0:
+            return
+        positions = self._positions(0, count)
+        self._options[positions] = None
+        self._waypoints[positions] = None
+        self._routes[positions] = None
+        self._head = (self._head + count) % self._capacity
+        self._size -= count
+        self.unprofiled = min(self.unprofiled, self._size)
+
+    def purge(self, location, min_distance, last_min_distance=1.0):
+        """
+        Removes the consecutive entries at the start of the queue closer than a distance to a location,
+        returning how many were removed. The distances are computed in vectorized windows, which grow
+        until an entry that isn't close enough is found.
+
+            :param location (carla.Location): location of the vehicle
+            :param min_distance (float): entries closer than this are removed
+            :param last_min_distance (float): distance used instead for the last entry of the queue
+        """
+        center = np.array([location.x, location.y, location.z])
+        count = self._size
+        start = 0
+        window = 16
+        while start < self._size:
+            stop = min(self._size, start + window)
+            distances = np.linalg.norm(self.locations(start, stop) - center, axis=1)
+            thresholds = np.full(len(distances), min_distance)
+            if stop == self._size:
+                thresholds[-1] = last_min_distance
+            far = np.nonzero(distances >= thresholds)[0]
+            if len(far) > 0:
+                count = start + int(far[0])
+                break
+            start = stop
+            window *= 2
+        self.discard(count)
+        return count
+
+    def clear(self):
+        """Removes all the entries of the queue"""
+        self.discard(self._size)
+        self._head = 0
+
+    def resize(self, maxlen):
+        """Changes the maximum number of entries of the queue"""
+        self.maxlen = maxlen
+        self.discard(self._size - maxlen)
+
+    def _reserve(self, count):
+        """Makes room for 'count' new entries, discarding the oldest ones if needed, and returns their positions"""
+        self.discard(self._size + count - self.maxlen)
+        if self._size + count > self._capacity:
+            capacity = min(self.maxlen, max(2 * self._capacity, self._size + count, 64))
+            order = self._positions(0, self._size)
+            previous = self._buffers()
+            self._allocate(capacity)
+            for buffer, old_buffer in zip(self._buffers(), previous):
+                buffer[:self._size] = old_buffer[order]
+            self._head = 0
+        return self._positions(self._size, self._size + count)
+
+    def _write(self, positions, xyz):
+        """Stores the locations of new entries, extending the cumulative arc length of the queue"""
+        if self._size > 0:
+            last = (self._head + self._size - 1) % self._capacity
+            previous_xyz = self._xyz[last:last + 1]
+            previous_arc = self._arc[last]
+        else:
+            previous_xyz = xyz[:1]
+            previous_arc = 0.0
+        steps = np.linalg.norm(np.diff(np.concatenate([previous_xyz, xyz]), axis=0), axis=1)
+        self._xyz[positions] = xyz
+        self._arc[positions] = previous_arc + np.cumsum(steps)
+        self._size += len(positions)
+        self.unprofiled += len(positions)
+
+
+class SpeedProfile(object):
+    """
+    SpeedProfile computes the target speed of each entry of a WaypointQueue, so that the vehicle slows
+    down before curves and speed limit changes instead of when it reaches them. Each entry is capped by
+    its speed limit and by the speed at which the curvature of the plan produces the maximum lateral
+    acceleration. A backward pass then limits the deceleration needed to reach the later caps, and a
+    forward pass limits the acceleration after them.
+
+    Both passes are cumulative minimums over the arc length, in squared speeds, so they are vectorized.
+    Entries appended to the queue only change the speeds of the entries within braking distance of them,
+    so only those are computed again.
+    """
+
+    def __init__(self, max_lateral_acceleration=3.0, max_acceleration=2.0, max_deceleration=3.5, min_speed=10.0,
+                 max_speed=120.0):
+        """
+        :param max_lateral_acceleration: maximum lateral acceleration in curves, in m/s^2
+        :param max_acceleration: maximum acceleration along the plan, in m/s^2
+        :param max_deceleration: maximum deceleration along the plan, in m/s^2
+        :param min_speed: minimum target speed in curves, in Km/h
+        :param max_speed: maximum target speed, in Km/h. It bounds the entries recomputed by an update
+        """
+        self.max_lateral_acceleration = max_lateral_acceleration
+        self.max_acceleration = max_acceleration
+        self.max_deceleration = max_deceleration
+        self.min_speed = min_speed
+        self.max_speed = max_speed
+
+    def curve_speeds(self, xyz):
+        """
+        Returns the maximum speed at each point of a polyline, given by its curvature
+
+            :param xyz: (n, 3) array of points
+            :return: (n,) array of speeds, in Km/h
+        """
+        speeds = np.full(len(xyz), np.inf)
+        if len(xyz) < 3:
+            return speeds
+        previous, current, following = xyz[:-2, :2], xyz[1:-1, :2], xyz[2:, :2]
+        a = np.linalg.norm(current - previous, axis=1)
+        b = np.linalg.norm(following - current, axis=1)
+        c = np.linalg.norm(following - previous, axis=1)
+        cross = (current - previous)[:, 0] * (following - current)[:, 1] - \
+            (current - previous)[:, 1] * (following - current)[:, 0]
+
+        # Curvature of the circle through three consecutive points
+        curvature = 2.0 * np.abs(cross) / np.maximum(a * b * c, 1e-9)
+        with np.errstate(divide='ignore'):
+            curve_speeds = 3.6 * np.sqrt(self.max_lateral_acceleration / curvature)
+        speeds[1:-1] = np.maximum(curve_speeds, self.min_speed)
+        return speeds
+
+    def passes(self, arc, caps):
+        """
+        Applies the backward (deceleration) and forward (acceleration) passes to speed caps
+
+            :param arc: (n,) array of cumulative arc lengths, in meters
+            :param caps: (n,) array of maximum speeds, in Km/h
+            :return: (n,) array of speeds, in Km/h
+        """
+        if len(caps) == 0:
+            return caps
+        squared = np.square(np.minimum(caps, self.max_speed) / 3.6)
+
+        # v_i^2 = min over j >= i of v_j^2 + 2 * deceleration * (s_j - s_i)
+        braking = 2.0 * self.max_deceleration * arc
+        squared = np.minimum.accumulate((squared + braking)[::-1])[::-1] - braking
+
+        # v_i^2 = min over j <= i of v_j^2 + 2 * acceleration * (s_i - s_j)
+        accelerating = 2.0 * self.max_acceleration * arc
+        squared = np.minimum.accumulate(squared - accelerating) + accelerating
+
+        return 3.6 * np.sqrt(np.maximum(squared, 0.0))
+
+    def update(self, queue, limits):
+        """
+        Computes the target speeds of the entries appended to a queue since the last update
+
+            :param queue (WaypointQueue): queue whose profile is updated
+            :param limits: speed limits of the unprofiled entries of the queue, in Km/h
+        """
+        size = len(queue)
+        first_new = size - queue.unprofiled
+        if queue.unprofiled == 0:
+            return
+        arc = queue.arc_lengths()
+        limits = np.concatenate([queue.speed_limits(0, first_new), limits])
+
+        # The curvature of the last old entry depends on the next one, so its cap changes too. Earlier
+        # entries are only affected if they are within braking distance of it
+        start = max(first_new - 1, 0)
+        braking_distance = (self.max_speed / 3.6) ** 2 / (2.0 * self.max_deceleration)
+        start = int(np.searchsorted(arc, arc[start] - braking_distance))
+
+        # The previous speeds of the old entries of the window bound them, as they carry the acceleration
+        # limit from the entries before the window, including the ones already removed from the queue
+        previous = max(start - 1, 0)
+        caps = np.minimum(limits[start:], self.curve_speeds(queue.locations(previous, size))[start - previous:])
+        caps[:first_new - start] = np.minimum(caps[:first_new - start], queue.speeds(start, first_new))
+        speeds = self.passes(arc[start:], caps)
+        queue.set_profile(start, limits[start:], speeds)
+
+
 class LocalPlanner(object):
     """
     LocalPlanner implements the basic behavior of following a
@@ -53,16 +530,22 @@ class LocalPlanner(object):
             max_brake: maximum brake applied to the vehicle
             max_steering: maximum steering applied to the vehicle
             offset: distance between the route waypoints and the center of the lane
+            controller_bank: VehiclePIDControllerBank shared with the controllers of other vehicles
+            profiler: AgentProfiler recording the duration of the planning and control phases
+            speed_profile: if True, the target speed is lowered ahead of curves and speed limit changes,
+                following a SpeedProfile of the plan
+            speed_profile_dict: parameters of the SpeedProfile
         """
         self._vehicle = vehicle
         self._world = self._vehicle.get_world()
         self._map = self._world.get_map()
+        self._world_state = WorldStateCache.get(self._world, self._map)
 
         self._vehicle_controller = None
         self.target_waypoint = None
         self.target_road_option = None
 
-        self._waypoints_queue = deque(maxlen=10000)
+        self._waypoints_queue = WaypointQueue(maxlen=10000)
         self._min_waypoint_queue_length = 100
         self._stop_waypoint_creation = False
 
@@ -78,6 +561,10 @@ class LocalPlanner(object):
         self._offset = 0
         self._base_min_distance = 3.0
         self._follow_speed_limits = False
+        self._controller_bank = None
+        self._profiler = AgentProfiler()
+        self._speed_profile = None
+        self._args_speed_profile_dict = {}
 
         # Overload parameters
         if opt_dict:
@@ -103,6 +590,14 @@ class LocalPlanner(object):
                 self._base_min_distance = opt_dict['base_min_distance']
             if 'follow_speed_limits' in opt_dict:
                 self._follow_speed_limits = opt_dict['follow_speed_limits']
+            if 'controller_bank' in opt_dict:
+                self._controller_bank = opt_dict['controller_bank']
+            if 'profiler' in opt_dict:
+                self._profiler = opt_dict['profiler']
+            if 'speed_profile_dict' in opt_dict:
+                self._args_speed_profile_dict = opt_dict['speed_profile_dict']
+            if opt_dict.get('speed_profile', False):
+                self._speed_profile = SpeedProfile(**self._args_speed_profile_dict)
 
         # initializing controller
         self._init_controller()
@@ -119,7 +614,9 @@ class LocalPlanner(object):
                                                         offset=self._offset,
                                                         max_throttle=self._max_throt,
                                                         max_brake=self._max_brake,
-                                                        max_steering=self._max_steer)
+                                                        max_steering=self._max_steer,
+                                                        bank=self._controller_bank,
+                                                        world_state=self._world_state)
 
         # Compute the current vehicle waypoint
         current_waypoint = self._map.get_waypoint(self._vehicle.get_location())
@@ -145,6 +642,8 @@ class LocalPlanner(object):
         :param value: bool
         :return:
         """
+        if value != self._follow_speed_limits:
+            self._waypoints_queue.invalidate_profile()
         self._follow_speed_limits = value
 
     def _compute_next_waypoints(self, k=1):
@@ -158,8 +657,10 @@ class LocalPlanner(object):
         available_entries = self._waypoints_queue.maxlen - len(self._waypoints_queue)
         k = min(available_entries, k)
 
+        # The new waypoints are appended to the queue at once
+        last_waypoint = self._waypoints_queue[-1][0]
+        new_waypoints = []
         for _ in range(k):
-            last_waypoint = self._waypoints_queue[-1][0]
             next_waypoints = list(last_waypoint.next(self._sampling_radius))
 
             if len(next_waypoints) == 0:
@@ -176,15 +677,19 @@ class LocalPlanner(object):
                 next_waypoint = next_waypoints[road_options_list.index(
                     road_option)]
 
-            self._waypoints_queue.append((next_waypoint, road_option))
+            new_waypoints.append((next_waypoint, road_option))
+            last_waypoint = next_waypoint
+
+        self._waypoints_queue.extend(new_waypoints)
 
     def set_global_plan(self, current_plan, stop_waypoint_creation=True, clean_queue=True):
         """
         Adds a new plan to the local planner. A plan must be a list of [carla.Waypoint, RoadOption] pairs
+        or a RouteArray, whose waypoints are only retrieved from the map once they become targets.
         The 'clean_queue` parameter erases the previous plan if True, otherwise, it adds it to the old one
         The 'stop_waypoint_creation' flag stops the automatic creation of random waypoints
 
-        :param current_plan: list of (carla.Waypoint, RoadOption)
+        :param current_plan: list of (carla.Waypoint, RoadOption), or RouteArray
         :param stop_waypoint_creation: bool
         :param clean_queue: bool
         :return:
@@ -195,13 +700,12 @@ class LocalPlanner(object):
         # Remake the waypoints queue if the new plan has a higher length than the queue
         new_plan_length = len(current_plan) + len(self._waypoints_queue)
         if new_plan_length > self._waypoints_queue.maxlen:
-            new_waypoint_queue = deque(maxlen=new_plan_length)
-            for wp in self._waypoints_queue:
-                new_waypoint_queue.append(wp)
-            self._waypoints_queue = new_waypoint_queue
+            self._waypoints_queue.resize(new_plan_length)
 
-        for elem in current_plan:
-            self._waypoints_queue.append(elem)
+        if isinstance(current_plan, RouteArray):
+            self._waypoints_queue.extend_route(current_plan)
+        else:
+            self._waypoints_queue.extend(current_plan)
 
         self._stop_waypoint_creation = stop_waypoint_creation
 
@@ -213,34 +717,27 @@ class LocalPlanner(object):
         :param debug: boolean flag to activate waypoints debugging
         :return: control to be applied
         """
-        if self._follow_speed_limits:
+        if self._follow_speed_limits and self._speed_profile is None:
             self._target_speed = self._vehicle.get_speed_limit()
 
         # Add more waypoints too few in the horizon
-        if not self._stop_waypoint_creation and len(self._waypoints_queue) < self._min_waypoint_queue_length:
-            self._compute_next_waypoints(k=self._min_waypoint_queue_length)
+        with self._profiler.phase('waypoints'):
+            if not self._stop_waypoint_creation and len(self._waypoints_queue) < self._min_waypoint_queue_length:
+                self._compute_next_waypoints(k=self._min_waypoint_queue_length)
+
+        # Compute the target speeds of the new waypoints
+        if self._speed_profile is not None and self._waypoints_queue.unprofiled > 0:
+            with self._profiler.phase('speed_profile'):
+                self._speed_profile.update(self._waypoints_queue, self._plan_speed_limits())
 
         # Purge the queue of obsolete waypoints
-        veh_location = self._vehicle.get_location()
-        vehicle_speed = get_speed(self._vehicle) / 3.6
+        self._world_state.update()
+        veh_location = self._world_state.location(self._vehicle)
+        vehicle_speed = self._world_state.speed(self._vehicle) / 3.6
         self._min_distance = self._base_min_distance + 0.5 *vehicle_speed
 
-        num_waypoint_removed = 0
-        for waypoint, _ in self._waypoints_queue:
-
-            if len(self._waypoints_queue) - num_waypoint_removed == 1:
-                min_distance = 1  # Don't remove the last waypoint until very close by
-            else:
-                min_distance = self._min_distance
-
-            if veh_location.distance(waypoint.transform.location) < min_distance:
-                num_waypoint_removed += 1
-            else:
-                break
-
-        if num_waypoint_removed > 0:
-            for _ in range(num_waypoint_removed):
-                self._waypoints_queue.popleft()
+        # Don't remove the last waypoint until very close by
+        self._waypoints_queue.purge(veh_location, self._min_distance, last_min_distance=1)
 
         # Get the target waypoint and move using the PID controllers. Stop if no target waypoint
         if len(self._waypoints_queue) == 0:
@@ -252,13 +749,49 @@ class LocalPlanner(object):
             control.manual_gear_shift = False
         else:
             self.target_waypoint, self.target_road_option = self._waypoints_queue[0]
-            control = self._vehicle_controller.run_step(self._target_speed, self.target_waypoint)
+            target_speed = self._target_speed
+            if self._speed_profile is not None:
+                profile_speed = float(self._waypoints_queue.speeds(0, 1)[0])
+                if self._follow_speed_limits:
+                    self._target_speed = target_speed = profile_speed
+                else:
+                    target_speed = min(target_speed, profile_speed)
+            with self._profiler.phase('pid'):
+                control = self._vehicle_controller.run_step(target_speed, self.target_waypoint)
 
         if debug:
             draw_waypoints(self._vehicle.get_world(), [self.target_waypoint], 1.0)
 
         return control
 
+    def _plan_speed_limits(self):
+        """
+        Returns the speed limits of the waypoints appended to the queue since the last profile update.
+        They are read from the speed limit signals along them, with a single query, starting from
+        the limit of the previous waypoint or, for a new plan, the current limit of the vehicle.
+        """
+        queue = self._waypoints_queue
+        first_new = len(queue) - queue.unprofiled
+        if not self._follow_speed_limits:
+            return np.full(queue.unprofiled, np.inf)
+
+        if first_new > 0:
+            limits = np.full(queue.unprofiled, queue.speed_limits(first_new - 1, first_new)[0])
+        else:
+            limits = np.full(queue.unprofiled, self._vehicle.get_speed_limit())
+
+        arc = queue.arc_lengths(first_new)
+        road_ids = set(queue.road_ids(first_new).tolist())
+        landmarks = queue[first_new][0].get_landmarks_of_type(
+            float(arc[-1] - arc[0]) + 1.0, carla.LandmarkType.MaximumSpeed, False)
+        for landmark in sorted(landmarks, key=lambda landmark: landmark.distance):
+            # Signals of the other branches of the junctions aren't part of the plan
+            if landmark.road_id not in road_ids:
+                continue
+            limit = landmark.value * 1.609344 if landmark.unit == 'mph' else landmark.value
+            limits[np.searchsorted(arc, arc[0] + landmark.distance):] = limit
+        return limits
+
     def get_incoming_waypoint_and_direction(self, steps=3):
         """
         Returns direction and waypoint at a distance ahead defined by the user.
@@ -275,6 +808,16 @@ class LocalPlanner(object):
             except IndexError as i:
                 return None, RoadOption.VOID
 
+    def get_incoming_waypoint_at_distance(self, distance):
+        """
+        Returns the waypoint and direction of the plan at a distance ahead, measured along the plan.
+
+            :param distance: arc length from the current target, in meters
+        """
+        if len(self._waypoints_queue) == 0:
+            return None, RoadOption.VOID
+        return self._waypoints_queue[self._waypoints_queue.index_at_distance(distance)]
+
     def get_plan(self):
         """Returns the current plan of the local planner"""
         return self._waypoints_queue
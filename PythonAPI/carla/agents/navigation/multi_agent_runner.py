@@ -0,0 +1,190 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module implements a runner that steps many agents of the same client at once,
+sharing a single world snapshot and applying all their controls with one batch of commands.
+"""
+
+from collections import deque
+from multiprocessing.pool import ThreadPool
+import time
+
+import numpy as np
+
+from agents.navigation.controller import VehiclePIDControllerBank
+from agents.tools.world_state import WorldStateCache
+
+
+class MultiAgentRunner(object):
+    """
+    MultiAgentRunner ticks all its registered agents once per frame. The world state cache shared by
+    the agents is updated from a single snapshot before any of them runs. The steps of their controllers
+    are deferred while the agents run, and computed at once by the controller bank of the runner.
+    Their controls are then sent to the server as one synchronous batch, instead of one 'apply_control' per agent.
+
+    The agents can be stepped by a pool of threads. They are then grouped by the cell of the map they
+    are in, and each thread steps the agents of neighbouring cells, which share most of their cached
+    waypoints and nearby actors. The calls to the server release the GIL, so threads overlap their RPCs.
+
+    The agents must be created with the 'controller_bank' of the runner in their options, so that
+    their controllers keep their state in the same arrays.
+    """
+
+    PHASES = ('snapshot', 'agents', 'apply')
+
+    def __init__(self, client, world=None, workers=0, cell_size=100.0, history=1000):
+        """
+        :param client: carla.Client used to send the batch of controls
+        :param world: carla.World of the agents. If None, it is retrieved from the client
+        :param workers: number of threads stepping the agents. If 0, they are stepped sequentially
+        :param cell_size: side of the cells used to partition the agents between the threads, in meters
+        :param history: number of frames whose timing is kept
+        """
+        self._client = client
+        self._world = world if world is not None else client.get_world()
+        self._world_state = WorldStateCache.get(self._world)
+        self._workers = workers
+        self._pool = ThreadPool(workers) if workers > 0 else None
+        self._cell_size = cell_size
+        self._history = history
+
+        self.controller_bank = VehiclePIDControllerBank()
+        self._agents = {}  # vehicle id -> agent
+        self._slots = {}  # vehicle id -> slot of the controller bank
+
+        self.frame = None
+        self._phase_times = {phase: deque(maxlen=history) for phase in self.PHASES}
+        self._agent_times = {}  # vehicle id -> latest step times
+
+    def __len__(self):
+        return len(self._agents)
+
+    @property
+    def agents(self):
+        """List of the registered agents"""
+        return list(self._agents.values())
+
+    def add_agent(self, agent):
+        """
+        Registers an agent, which is stepped from the next frame on
+
+            :param agent: BasicAgent, or any agent with a '_vehicle', a 'run_step' and a 'get_local_planner'
+                method, whose controller uses the 'controller_bank' of the runner
+        """
+        controller = agent.get_local_planner()._vehicle_controller
+        if controller.bank is not self.controller_bank:
+            raise ValueError("The controller of the agent doesn't use the 'controller_bank' of the runner")
+        self._agents[agent._vehicle.id] = agent
+        self._slots[agent._vehicle.id] = controller.slot
+        self._agent_times[agent._vehicle.id] = deque(maxlen=self._history)
+
+    def remove_agent(self, agent):
+        """
+        Unregisters an agent. Its vehicle isn't destroyed
+
+            :param agent: agent previously registered
+        """
+        vehicle_id = agent._vehicle.id
+        self._agents.pop(vehicle_id, None)
+        self._agent_times.pop(vehicle_id, None)
+        slot = self._slots.pop(vehicle_id, None)
+        if slot is not None:
+            self.controller_bank.remove_vehicle(slot)
+
+    def close(self):
+        """Stops the threads of the runner"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def run_step(self, snapshot=None):
+        """
+        Steps all the agents and applies their controls
+
+            :param snapshot (carla.WorldSnapshot): snapshot of the frame to step,
+                such as the one returned by 'world.tick'. If None, the latest one of the world is used
+            :return: dictionary of vehicle id -> carla.VehicleControl applied
+        """
+        begin = time.time()
+        if snapshot is None:
+            snapshot = self._world.get_snapshot()
+        self._world_state.update(snapshot)
+        self.frame = snapshot.frame
+        snapshot_time = time.time()
+
+        self.controller_bank.defer()
+        try:
+            if self._pool is None or len(self._agents) <= 1:
+                controls = self._run_partition(list(self._agents))
+            else:
+                controls = {}
+                for partition_controls in self._pool.map(self._run_partition, self._partition()):
+                    controls.update(partition_controls)
+        finally:
+            missing = self.controller_bank.run_deferred(snapshot)
+        for slot in missing:
+            controls.pop(self.controller_bank.vehicle_id(slot), None)
+        agents_time = time.time()
+
+        vehicle_ids = [vehicle_id for vehicle_id, control in controls.items() if control is not None]
+        responses = self.controller_bank.apply(
+            self._client, [self._slots[vehicle_id] for vehicle_id in vehicle_ids],
+            [controls[vehicle_id] for vehicle_id in vehicle_ids], synchronous=True)
+        for vehicle_id, response in zip(vehicle_ids, responses):
+            if response.has_error():
+                print("WARNING: The control of vehicle {} couldn't be applied: {}".format(vehicle_id, response.error))
+        end = time.time()
+
+        self._phase_times['snapshot'].append(snapshot_time - begin)
+        self._phase_times['agents'].append(agents_time - snapshot_time)
+        self._phase_times['apply'].append(end - agents_time)
+        return controls
+
+    def _run_partition(self, vehicle_ids):
+        """Steps the agents of the given vehicles, returning their controls"""
+        controls = {}
+        for vehicle_id in vehicle_ids:
+            agent = self._agents[vehicle_id]
+            begin = time.time()
+            controls[vehicle_id] = agent.run_step()
+            self._agent_times[vehicle_id].append(time.time() - begin)
+        return controls
+
+    def _partition(self):
+        """Splits the agents in one group per thread, keeping the agents of the same cell together"""
+        vehicle_ids = np.array(list(self._agents), dtype=np.int64)
+        cells = np.zeros((len(vehicle_ids), 2))
+        for i, vehicle_id in enumerate(vehicle_ids.tolist()):
+            location = self._world_state.location(self._agents[vehicle_id]._vehicle)
+            cells[i] = (location.x, location.y)
+        cells = np.floor(cells / self._cell_size)
+
+        # Sorting by cell makes each chunk a set of neighbouring cells
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        return [chunk.tolist() for chunk in np.array_split(vehicle_ids[order], self._workers) if len(chunk) > 0]
+
+    def get_phase_timing(self):
+        """
+        Returns the timing of the phases of the latest frames
+
+            :return: dictionary of phase -> (mean, p95) duration, in milliseconds
+        """
+        timing = {}
+        for phase, times in self._phase_times.items():
+            if times:
+                times = np.array(times) * 1000.0
+                timing[phase] = (float(np.mean(times)), float(np.percentile(times, 95)))
+        return timing
+
+    def get_agent_timing(self):
+        """
+        Returns the mean step duration of each agent over the latest frames
+
+            :return: dictionary of vehicle id -> mean duration, in milliseconds
+        """
+        return {vehicle_id: 1000.0 * float(np.mean(times))
+                for vehicle_id, times in self._agent_times.items() if times}
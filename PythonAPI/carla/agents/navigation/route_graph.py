@@ -0,0 +1,338 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides an array based representation of the GlobalRoutePlanner graph,
+used to search for the shortest routes without the overhead of networkx.
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+import math
+import threading
+
+import numpy as np
+import networkx as nx
+
+INFINITY = float('inf')
+
+
+class RouteGraph(object):
+    """
+    RouteGraph stores a directed graph as a compressed sparse row (CSR) adjacency, with the node
+    coordinates in a contiguous float64 array and precomputed edge weights. Its searches give the
+    same results as the networkx ones, including the tie breaking between equally short paths.
+
+    Optionally, the graph can be preprocessed with landmarks (ALT: A*, landmarks and triangle
+    inequality), whose precomputed distances give a tighter heuristic than the euclidean one.
+    """
+
+    def __init__(self, graph, weight='length'):
+        """
+        :param graph: networkx.DiGraph whose nodes have a 'vertex' (x,y,z) attribute
+        :param weight: name of the edge attribute used as weight
+        """
+        node_ids = list(graph.nodes)
+        self._index = {node: i for i, node in enumerate(node_ids)}
+
+        indptr = [0]
+        indices = []
+        weights = []
+        for node in node_ids:
+            for neighbor, edge in graph.adj[node].items():
+                indices.append(self._index[neighbor])
+                weights.append(edge[weight])
+            indptr.append(len(indices))
+
+        self.node_ids = np.array(node_ids, dtype=np.int64)
+        self.coordinates = np.array([graph.nodes[n]['vertex'] for n in node_ids], dtype=np.float64).reshape(-1, 3)
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.weights = np.array(weights, dtype=np.float64)
+
+        # Plain python copies, indexing numpy arrays element-wise is slower inside the search loops
+        self._node_ids = node_ids
+        self._indptr = indptr
+        self._indices = indices
+        self._weights = self.weights.tolist()
+        self._coordinates = self.coordinates.tolist()
+
+        # Reversed adjacency, to compute the distances towards a node
+        reverse_edges = sorted(zip(indices, range(len(indices))))
+        self._reverse_indptr = [0] * (len(node_ids) + 1)
+        for target, _ in reverse_edges:
+            self._reverse_indptr[target + 1] += 1
+        for i in range(len(node_ids)):
+            self._reverse_indptr[i + 1] += self._reverse_indptr[i]
+        self._reverse_edges = [k for _, k in reverse_edges]
+        self._sources = [0] * len(indices)
+        for i in range(len(node_ids)):
+            for k in range(indptr[i], indptr[i + 1]):
+                self._sources[k] = i
+
+        # Landmark distances of each node, as a tuple with one value per landmark, and the
+        # weights they were computed with. Their bounds stay valid as long as no weight decreases
+        self.landmarks = None
+        self._landmark_forward = None
+        self._landmark_backward = None
+        self._landmark_weights = None
+
+        # Number of nodes expanded by the last search
+        self.expanded_nodes = 0
+
+        # Search state, reused between the searches of each thread
+        self._search_state = threading.local()
+
+    def __len__(self):
+        return len(self._node_ids)
+
+    def index(self, node):
+        """Returns the array index of a graph node"""
+        return self._index[node]
+
+    def distance(self, i, j):
+        """Euclidean distance between two nodes, given by their array index"""
+        xi, yi, zi = self._coordinates[i]
+        xj, yj, zj = self._coordinates[j]
+        return math.sqrt((xi - xj) * (xi - xj) + (yi - yj) * (yi - yj) + (zi - zj) * (zi - zj))
+
+    def astar(self, source, target):
+        """
+        Returns the shortest path between two graph nodes as a list of nodes,
+        using A* search with the euclidean distance as heuristic.
+
+            :param source: starting node of the graph
+            :param target: ending node of the graph
+        """
+        return self._search(source, target, self.distance)
+
+    def alt(self, source, target):
+        """
+        Returns the shortest path between two graph nodes as a list of nodes, using A* search with the
+        landmark lower bounds as heuristic. Requires the landmarks to be set with 'set_landmarks'.
+
+            :param source: starting node of the graph
+            :param target: ending node of the graph
+        """
+        if self.landmarks is None:
+            raise ValueError("The graph has no landmarks")
+        return self._search(source, target, self._landmark_distance)
+
+    def dijkstra(self, source, target):
+        """
+        Returns the shortest path between two graph nodes as a list of nodes, using Dijkstra's algorithm.
+
+            :param source: starting node of the graph
+            :param target: ending node of the graph
+        """
+        return self._search(source, target, None)
+
+    def lower_bound(self, i, j):
+        """
+        Lower bound of the distance between two nodes, given by their array index.
+        Uses the landmarks if they are set, and zero otherwise
+        """
+        if self.landmarks is None:
+            return 0.0
+        return self._landmark_distance(i, j)
+
+    def set_weight(self, source, target, weight):
+        """
+        Changes the weight of an edge. An infinite weight blocks the edge.
+        If the weight decreases below the one used to compute the landmarks, these are removed.
+
+            :param source: starting node of the edge
+            :param target: ending node of the edge
+            :param weight (float): new weight of the edge
+        """
+        source_i = self._index[source]
+        target_i = self._index[target]
+        for k in range(self._indptr[source_i], self._indptr[source_i + 1]):
+            if self._indices[k] == target_i:
+                break
+        else:
+            raise KeyError("The edge {}-{} is not in the graph".format(source, target))
+
+        self.weights[k] = weight
+        self._weights[k] = float(weight)
+        if self._landmark_weights is not None and weight < self._landmark_weights[k]:
+            self.landmarks = None
+            self._landmark_forward = None
+            self._landmark_backward = None
+            self._landmark_weights = None
+
+    def compute_landmarks(self, num_landmarks):
+        """
+        Selects landmarks with the farthest selection method, and computes the distances
+        from and towards each of them.
+
+            :param num_landmarks (int): number of landmarks
+            :return: tuple of numpy arrays with the landmark node indices (k), and the distances from
+                (k x n) and towards (k x n) each landmark. Unreachable nodes are at an infinite distance
+        """
+        num_nodes = len(self._node_ids)
+        num_landmarks = min(num_landmarks, num_nodes)
+        landmarks = []
+        forward = []
+        backward = []
+        if num_landmarks == 0:
+            return (np.array(landmarks, dtype=np.int64), np.zeros((0, num_nodes)), np.zeros((0, num_nodes)))
+
+        # The first landmark is the farthest node from an arbitrary one
+        distances = self.distances(0)
+        candidate = int(np.argmax(np.where(np.isinf(distances), -1.0, distances)))
+        closest = np.full(num_nodes, np.inf)
+        while len(landmarks) < num_landmarks:
+            landmarks.append(candidate)
+            forward.append(self.distances(candidate))
+            backward.append(self.distances(candidate, reverse=True))
+
+            # Next one is the node farthest from all the selected landmarks
+            closest = np.minimum(closest, np.minimum(forward[-1], backward[-1]))
+            closest[landmarks] = -1.0
+            candidate = int(np.argmax(closest))
+
+        return np.array(landmarks, dtype=np.int64), np.array(forward), np.array(backward)
+
+    def set_landmarks(self, landmarks, forward, backward):
+        """
+        Sets the landmarks used by 'alt'.
+
+            :param landmarks: numpy array of landmark node indices (k)
+            :param forward: numpy array of distances from each landmark to each node (k x n)
+            :param backward: numpy array of distances from each node to each landmark (k x n)
+        """
+        # Unreachable nodes are placed farther than any path of the graph, which keeps valid bounds
+        unreachable = float(self.weights[np.isfinite(self.weights)].sum()) + 1.0
+        self.landmarks = np.asarray(landmarks, dtype=np.int64)
+        self._landmark_weights = self.weights.copy()
+        self._landmark_forward = [tuple(d) for d in np.where(np.isinf(forward), unreachable, forward).T.tolist()]
+        self._landmark_backward = [tuple(d) for d in np.where(np.isinf(backward), unreachable, backward).T.tolist()]
+
+    def distances(self, source_i, reverse=False):
+        """
+        Returns the distance from a node to all the others (or from all the others
+        to that node if reverse is True) as a numpy array, using Dijkstra's algorithm.
+
+            :param source_i (int): array index of the node
+            :param reverse (bool): whether or not to compute the distances towards the node
+        """
+        distances = [float('inf')] * len(self._node_ids)
+        distances[source_i] = 0.0
+        queue = [(0.0, source_i)]
+        while queue:
+            dist, current = heappop(queue)
+            if dist > distances[current]:
+                continue
+            for neighbor, weight in self.neighbors(current, reverse):
+                new_cost = dist + weight
+                if new_cost < distances[neighbor]:
+                    distances[neighbor] = new_cost
+                    heappush(queue, (new_cost, neighbor))
+        return np.array(distances, dtype=np.float64)
+
+    def neighbors(self, i, reverse=False):
+        """Returns the (neighbor index, weight) pairs of the successors (or predecessors) of a node"""
+        if reverse:
+            return [(self._sources[k], self._weights[k])
+                    for k in self._reverse_edges[self._reverse_indptr[i]:self._reverse_indptr[i + 1]]]
+        return [(self._indices[k], self._weights[k]) for k in range(self._indptr[i], self._indptr[i + 1])]
+
+    def _landmark_distance(self, i, j):
+        """Lower bound of the distance between two nodes given by the triangle inequality with the landmarks"""
+        forward_i = self._landmark_forward[i]
+        forward_j = self._landmark_forward[j]
+        backward_i = self._landmark_backward[i]
+        backward_j = self._landmark_backward[j]
+        bound = 0.0
+        for k in range(len(forward_i)):
+            # d(i, j) >= d(L, j) - d(L, i)
+            candidate = forward_j[k] - forward_i[k]
+            if candidate > bound:
+                bound = candidate
+            # d(i, j) >= d(i, L) - d(j, L)
+            candidate = backward_i[k] - backward_j[k]
+            if candidate > bound:
+                bound = candidate
+        return bound
+
+    def _search(self, source, target, heuristic):
+        """
+        A* search over the CSR arrays. Follows the networkx implementation step by step
+        so that both return the same path.
+        """
+        if source not in self._index:
+            raise nx.NodeNotFound("Source {} is not in G".format(source))
+        if target not in self._index:
+            raise nx.NodeNotFound("Target {} is not in G".format(target))
+        source_i = self._index[source]
+        target_i = self._index[target]
+
+        state = self._search_state
+        if not hasattr(state, 'stamp'):
+            # An entry is only valid if its stamp matches the one of the current search
+            num_nodes = len(self._node_ids)
+            state.stamp = 0
+            state.enqueued_stamp = [0] * num_nodes
+            state.explored_stamp = [0] * num_nodes
+            state.cost = [0.0] * num_nodes
+            state.heuristic = [0.0] * num_nodes
+            state.parent = [-1] * num_nodes
+        state.stamp += 1
+        stamp = state.stamp
+        enqueued_stamp = state.enqueued_stamp
+        explored_stamp = state.explored_stamp
+        cost = state.cost
+        heuristic_cost = state.heuristic
+        parent = state.parent
+        indptr = self._indptr
+        indices = self._indices
+        weights = self._weights
+
+        expanded_nodes = 0
+        counter = count()
+        queue = [(0, next(counter), source_i, 0, -1)]
+        while queue:
+            _, _, current, dist, current_parent = heappop(queue)
+            if current == target_i:
+                self.expanded_nodes = expanded_nodes
+                path = [self._node_ids[current]]
+                node = current_parent
+                while node != -1:
+                    path.append(self._node_ids[node])
+                    node = parent[node]
+                path.reverse()
+                return path
+
+            if explored_stamp[current] == stamp:
+                # Do not override the parent of the starting node
+                if parent[current] == -1:
+                    continue
+                # Skip bad paths that were enqueued before finding a better one
+                if cost[current] < dist:
+                    continue
+            explored_stamp[current] = stamp
+            parent[current] = current_parent
+            expanded_nodes += 1
+
+            for k in range(indptr[current], indptr[current + 1]):
+                if weights[k] == INFINITY:
+                    # Blocked edge
+                    continue
+                neighbor = indices[k]
+                new_cost = dist + weights[k]
+                if enqueued_stamp[neighbor] == stamp:
+                    if cost[neighbor] <= new_cost:
+                        continue
+                    h = heuristic_cost[neighbor]
+                else:
+                    enqueued_stamp[neighbor] = stamp
+                    h = heuristic(neighbor, target_i) if heuristic is not None else 0
+                    heuristic_cost[neighbor] = h
+                cost[neighbor] = new_cost
+                heappush(queue, (new_cost + h, next(counter), neighbor, new_cost, current))
+
+        self.expanded_nodes = expanded_nodes
+        raise nx.NetworkXNoPath("Node {} not reachable from {}".format(target, source))
@@ -0,0 +1,397 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a persistent on-disk cache for the topology and graph built by the
+GlobalRoutePlanner, along with the compact waypoint storage used by both of them.
+"""
+
+import glob
+import hashlib
+import os
+
+import numpy as np
+import networkx as nx
+
+import carla
+from agents.navigation.local_planner import RoadOption
+
+
+def _replace_file(src, dst):
+    """Renames src to dst, overwriting dst if it exists. os.replace is not available in python 2"""
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows doesn't overwrite the destination on rename
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+class WaypointTable(object):
+    """
+    Columnar storage of the waypoints sampled by the GlobalRoutePlanner. Each waypoint is referenced
+    by its index in the table, and its carla.Waypoint object is only retrieved from the map
+    the first time it is asked for.
+    """
+
+    def __init__(self, wmap):
+        """
+        :param wmap: carla.Map used to retrieve the waypoints
+        """
+        self._wmap = wmap
+        self._xyz = []
+        self._yaw = []
+        self._road_id = []
+        self._section_id = []
+        self._lane_id = []
+        self._s = []
+        self._is_junction = []
+        self._waypoints = []
+        self._xyz_array = None
+        self._column_arrays = None
+
+    @property
+    def map(self):
+        """carla.Map used to retrieve the waypoints"""
+        return self._wmap
+
+    def __len__(self):
+        return len(self._waypoints)
+
+    def add(self, waypoint):
+        """
+        Adds a waypoint to the table, returning its index
+
+            :param waypoint (carla.Waypoint): waypoint to be added
+        """
+        transform = waypoint.transform
+        self._xyz.append((transform.location.x, transform.location.y, transform.location.z))
+        self._yaw.append(transform.rotation.yaw)
+        self._road_id.append(waypoint.road_id)
+        self._section_id.append(waypoint.section_id)
+        self._lane_id.append(waypoint.lane_id)
+        self._s.append(waypoint.s)
+        self._is_junction.append(waypoint.is_junction)
+        self._waypoints.append(waypoint)
+        return len(self._waypoints) - 1
+
+    def get(self, index):
+        """
+        Returns the carla.Waypoint at the given index, retrieving it from the map if needed
+
+            :param index (int): index of the waypoint in the table
+        """
+        waypoint = self._waypoints[index]
+        if waypoint is None:
+            waypoint = self._wmap.get_waypoint_xodr(self._road_id[index], self._lane_id[index], self._s[index])
+            if waypoint is None:
+                # Floating point imprecision at the end of the lane, project the location instead
+                waypoint = self._wmap.get_waypoint(carla.Location(*self._xyz[index]))
+            self._waypoints[index] = waypoint
+        return waypoint
+
+    def cached(self, index):
+        """Returns the carla.Waypoint at the given index if it has already been retrieved, and None otherwise"""
+        return self._waypoints[index]
+
+    def location(self, index):
+        """Returns the (x,y,z) location of the waypoint at the given index"""
+        return self._xyz[index]
+
+    def columns(self, indices):
+        """
+        Returns the x, y, z, yaw, road_id, section_id, lane_id and s values of the waypoints
+        at the given indices, as a dictionary of numpy arrays
+
+            :param indices (numpy.ndarray): indices of the waypoints in the table
+        """
+        if self._column_arrays is None or len(self._column_arrays['s']) != len(self._s):
+            xyz = self.locations()
+            self._column_arrays = {
+                'x': xyz[:, 0], 'y': xyz[:, 1], 'z': xyz[:, 2],
+                'yaw': np.array(self._yaw, dtype=np.float64),
+                'road_id': np.array(self._road_id, dtype=np.int32),
+                'section_id': np.array(self._section_id, dtype=np.int32),
+                'lane_id': np.array(self._lane_id, dtype=np.int32),
+                's': np.array(self._s, dtype=np.float64),
+            }
+        return {name: column[indices] for name, column in self._column_arrays.items()}
+
+    def release(self, indices):
+        """
+        Frees the carla.Waypoint objects at the given indices. They are retrieved from the map again if needed
+
+            :param indices (list): indices of the waypoints in the table
+        """
+        for index in indices:
+            self._waypoints[index] = None
+
+    def locations(self, indices=None):
+        """
+        Returns the (x,y,z) locations of the waypoints at the given indices as a numpy array
+
+            :param indices (list): indices of the waypoints in the table. If None, all of them are returned
+        """
+        if self._xyz_array is None or len(self._xyz_array) != len(self._xyz):
+            self._xyz_array = np.array(self._xyz, dtype=np.float64).reshape(-1, 3)
+        return self._xyz_array if indices is None else self._xyz_array[indices]
+
+    def waypoint_at(self, location):
+        """Returns the carla.Waypoint of the map closest to an (x,y,z) location"""
+        return self._wmap.get_waypoint(carla.Location(*location))
+
+    def lane(self, index):
+        """Returns the (road_id, section_id, lane_id) of the waypoint at the given index"""
+        return self._road_id[index], self._section_id[index], self._lane_id[index]
+
+    def to_arrays(self):
+        """Returns the contents of the table as a dictionary of numpy arrays"""
+        return {
+            'wp_xyz': np.array(self._xyz, dtype=np.float64).reshape(-1, 3),
+            'wp_yaw': np.array(self._yaw, dtype=np.float64),
+            'wp_road_id': np.array(self._road_id, dtype=np.int32),
+            'wp_section_id': np.array(self._section_id, dtype=np.int32),
+            'wp_lane_id': np.array(self._lane_id, dtype=np.int32),
+            'wp_s': np.array(self._s, dtype=np.float64),
+            'wp_is_junction': np.array(self._is_junction, dtype=np.bool_),
+        }
+
+    @classmethod
+    def from_arrays(cls, wmap, arrays):
+        """
+        Creates a table from the arrays returned by 'to_arrays'. No waypoint is retrieved from the map.
+
+            :param wmap (carla.Map): map used to retrieve the waypoints
+            :param arrays (dict): numpy arrays of the table
+        """
+        table = cls(wmap)
+        table._xyz = [tuple(row) for row in arrays['wp_xyz'].tolist()]
+        table._yaw = arrays['wp_yaw'].tolist()
+        table._road_id = arrays['wp_road_id'].tolist()
+        table._section_id = arrays['wp_section_id'].tolist()
+        table._lane_id = arrays['wp_lane_id'].tolist()
+        table._s = arrays['wp_s'].tolist()
+        table._is_junction = arrays['wp_is_junction'].tolist()
+        table._waypoints = [None] * len(table._s)
+        return table
+
+
+class TopologyCache(object):
+    """
+    TopologyCache stores the graph of the GlobalRoutePlanner in a compressed numpy file, so that
+    planners created for the same map skip its construction. Files are identified by a hash of the
+    OpenDRIVE content of the map and the sampling resolution, so a modified map invalidates the cache.
+    """
+
+    VERSION = 1
+
+    def __init__(self, wmap, sampling_resolution, cache_dir):
+        """
+        :param wmap: carla.Map of the planner
+        :param sampling_resolution: sampling resolution of the planner
+        :param cache_dir: folder where the cached files are stored
+        """
+        self._wmap = wmap
+
+        # Get hash based on content
+        hash_func = hashlib.sha1()
+        hash_func.update(wmap.to_opendrive().encode("UTF-8"))
+        self._hash = str(hash_func.hexdigest())
+
+        self._dirname = cache_dir
+        self._prefix = wmap.name.split('/')[-1] + "_"
+        self._resolution = "_" + str(float(sampling_resolution))
+        self.path = self._filename(".npz")
+
+    def load(self):
+        """
+        Reads the cached graph, returning None if there isn't a valid one.
+        Otherwise returns a tuple of (graph, id_map, road_id_to_edge, waypoint_table).
+        """
+        arrays = self._read(".npz")
+        if arrays is None:
+            return None
+        try:
+            return self._unpack(arrays)
+        except (ValueError, KeyError):
+            return None
+
+    def save(self, graph, id_map, road_id_to_edge, waypoint_table):
+        """
+        Writes the graph to disk, removing the files of previous versions of the same map.
+        """
+        self._write(".npz", self._pack(graph, id_map, road_id_to_edge, waypoint_table))
+
+    def load_landmarks(self, num_landmarks):
+        """
+        Reads the cached landmarks of the graph, returning None if there aren't any.
+        Otherwise returns the (landmarks, forward, backward) arrays of RouteGraph.compute_landmarks.
+        """
+        arrays = self._read("_alt{}.npz".format(num_landmarks))
+        if arrays is None:
+            return None
+        try:
+            return arrays['landmarks'], arrays['forward'], arrays['backward']
+        except KeyError:
+            return None
+
+    def save_landmarks(self, num_landmarks, landmarks):
+        """
+        Writes the landmarks of the graph to disk, next to the graph itself.
+
+            :param num_landmarks (int): number of requested landmarks
+            :param landmarks (tuple): (landmarks, forward, backward) arrays of RouteGraph.compute_landmarks
+        """
+        landmarks, forward, backward = landmarks
+        self._write("_alt{}.npz".format(num_landmarks),
+                    {'landmarks': landmarks, 'forward': forward, 'backward': backward})
+
+    def load_lane_map(self):
+        """
+        Reads the cached arrays of the LaneMap of the map, returning None if there aren't any
+        """
+        arrays = self._read("_lanes.npz")
+        if arrays is None:
+            return None
+        arrays.pop('version')
+        return arrays
+
+    def save_lane_map(self, arrays):
+        """
+        Writes the arrays of the LaneMap of the map to disk, next to the graph.
+
+            :param arrays (dict): arrays of LaneMap.to_arrays
+        """
+        self._write("_lanes.npz", arrays)
+
+    def _filename(self, suffix):
+        return os.path.join(self._dirname, self._prefix + self._hash + self._resolution + suffix)
+
+    def _read(self, suffix):
+        """Reads the arrays of a cached file, or None if it doesn't exist or is outdated"""
+        path = self._filename(suffix)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {key: data[key] for key in data.files}
+        except (IOError, OSError, ValueError):
+            return None
+        if 'version' not in arrays or int(arrays['version']) != self.VERSION:
+            return None
+        return arrays
+
+    def _write(self, suffix, arrays):
+        """Writes arrays to a cached file, removing the ones of previous versions of the same map"""
+        path = self._filename(suffix)
+        if not os.path.exists(self._dirname):
+            os.makedirs(self._dirname)
+
+        # Remove files if the map had a previous version saved. Only the ones whose name differs
+        # in the hash are removed, other maps may have names starting like this one
+        pattern = os.path.join(self._dirname, self._prefix + "*" + self._resolution + suffix)
+        for filename in glob.glob(pattern):
+            file_hash = os.path.basename(filename)[len(self._prefix):-len(self._resolution + suffix)]
+            if filename != path and len(file_hash) == len(self._hash) and '_' not in file_hash:
+                os.remove(filename)
+
+        arrays = dict(arrays, version=np.array(self.VERSION))
+
+        # Write to a temporary file first, other processes might be reading the cache
+        tmp_path = path + ".{}.tmp".format(os.getpid())
+        with open(tmp_path, 'wb') as tmp_file:
+            np.savez_compressed(tmp_file, **arrays)
+        _replace_file(tmp_path, path)
+
+    def _pack(self, graph, id_map, road_id_to_edge, waypoint_table):
+        """Converts the graph into a dictionary of numpy arrays"""
+        id_map_nodes = set(id_map.values())
+        nodes = list(graph.nodes(data='vertex'))
+
+        edges = list(graph.edges(data=True))
+        path_offsets = [0]
+        path_ids = []
+        for _, _, edge in edges:
+            path_ids.extend(edge['path_ids'])
+            path_offsets.append(len(path_ids))
+
+        def vectors(key):
+            rows = []
+            for _, _, edge in edges:
+                value = edge.get(key)
+                rows.append([np.nan] * 3 if value is None else list(value))
+            return np.array(rows, dtype=np.float64).reshape(-1, 3)
+
+        road_edges = []
+        for road_id, sections in road_id_to_edge.items():
+            for section_id, lanes in sections.items():
+                for lane_id, (n1, n2) in lanes.items():
+                    road_edges.append((road_id, section_id, lane_id, n1, n2))
+
+        arrays = {
+            'node_id': np.array([n for n, _ in nodes], dtype=np.int64),
+            'node_vertex': np.array([v for _, v in nodes], dtype=np.float64).reshape(-1, 3),
+            'node_in_id_map': np.array([n in id_map_nodes for n, _ in nodes], dtype=np.bool_),
+            'edge_src': np.array([u for u, _, _ in edges], dtype=np.int64),
+            'edge_dst': np.array([v for _, v, _ in edges], dtype=np.int64),
+            'edge_type': np.array([e['type'].value for _, _, e in edges], dtype=np.int8),
+            'edge_intersection': np.array([bool(e['intersection']) for _, _, e in edges], dtype=np.bool_),
+            'edge_length': np.array([e['length'] for _, _, e in edges], dtype=np.int64),
+            'edge_entry_id': np.array([e['entry_id'] for _, _, e in edges], dtype=np.int64),
+            'edge_exit_id': np.array([e['exit_id'] for _, _, e in edges], dtype=np.int64),
+            'edge_change_id': np.array([e.get('change_id', -1) for _, _, e in edges], dtype=np.int64),
+            'edge_path_offsets': np.array(path_offsets, dtype=np.int64),
+            'edge_path_ids': np.array(path_ids, dtype=np.int64),
+            'edge_entry_vector': vectors('entry_vector'),
+            'edge_exit_vector': vectors('exit_vector'),
+            'edge_net_vector': vectors('net_vector'),
+            'road_edges': np.array(road_edges, dtype=np.int64).reshape(-1, 5),
+        }
+        arrays.update(waypoint_table.to_arrays())
+        return arrays
+
+    def _unpack(self, arrays):
+        """Rebuilds the graph from a dictionary of numpy arrays"""
+        waypoint_table = WaypointTable.from_arrays(self._wmap, arrays)
+
+        graph = nx.DiGraph()
+        id_map = dict()
+        for node, vertex, in_id_map in zip(arrays['node_id'].tolist(), arrays['node_vertex'].tolist(),
+                                           arrays['node_in_id_map'].tolist()):
+            vertex = tuple(vertex)
+            if in_id_map:
+                id_map[vertex] = node
+            graph.add_node(node, vertex=vertex)
+
+        def vector(row, as_array):
+            if np.isnan(row).any():
+                return None
+            return np.array(row) if as_array else row.tolist()
+
+        offsets = arrays['edge_path_offsets'].tolist()
+        path_ids = arrays['edge_path_ids'].tolist()
+        for i, (n1, n2) in enumerate(zip(arrays['edge_src'].tolist(), arrays['edge_dst'].tolist())):
+            edge = dict(
+                length=int(arrays['edge_length'][i]),
+                path_ids=path_ids[offsets[i]:offsets[i + 1]],
+                entry_id=int(arrays['edge_entry_id'][i]),
+                exit_id=int(arrays['edge_exit_id'][i]),
+                entry_vector=vector(arrays['edge_entry_vector'][i], True),
+                exit_vector=vector(arrays['edge_exit_vector'][i], True),
+                net_vector=vector(arrays['edge_net_vector'][i], False),
+                intersection=bool(arrays['edge_intersection'][i]),
+                type=RoadOption(int(arrays['edge_type'][i])))
+            change_id = int(arrays['edge_change_id'][i])
+            if change_id >= 0:
+                edge['change_id'] = change_id
+            graph.add_edge(n1, n2, **edge)
+
+        road_id_to_edge = dict()
+        for road_id, section_id, lane_id, n1, n2 in arrays['road_edges'].tolist():
+            road_id_to_edge.setdefault(road_id, dict()).setdefault(section_id, dict())[lane_id] = (n1, n2)
+
+        return graph, id_map, road_id_to_edge, waypoint_table
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" Module with vectorized geometric tests between oriented boxes and polygons in the ground plane. """
+
+import numpy as np
+
+# Signs of the vertices of a bounding box, in the order of 'carla.BoundingBox.get_world_vertices'
+_BOX_SIGNS = np.array([
+    [-1, -1, -1], [-1, -1, 1], [-1, 1, -1], [-1, 1, 1],
+    [1, -1, -1], [1, -1, 1], [1, 1, -1], [1, 1, 1]], dtype=np.float64)
+
+
+def transform_points(points, transforms):
+    """
+    Applies a transform to each set of points, like 'carla.Transform.transform'
+
+        :param points: (n, k, 3) array of points
+        :param transforms: (n, 6) array with the x, y, z, pitch, yaw and roll of each transform, in degrees
+        :return: (n, k, 3) array of transformed points
+    """
+    points = np.asarray(points, dtype=np.float64)
+    transforms = np.asarray(transforms, dtype=np.float64).reshape(-1, 6)
+    pitch, yaw, roll = np.radians(transforms[:, 3:6]).T
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    cr, sr = np.cos(roll), np.sin(roll)
+
+    # Rotation matrices of the Unreal Engine convention, one per transform
+    rotations = np.stack([
+        np.stack([cp * cy, cy * sp * sr - sy * cr, -cy * sp * cr - sy * sr], axis=1),
+        np.stack([cp * sy, sy * sp * sr + cy * cr, -sy * sp * cr + cy * sr], axis=1),
+        np.stack([sp, -cp * sr, cp * cr], axis=1)], axis=1)
+
+    return np.einsum('nij,nkj->nki', rotations, points) + transforms[:, np.newaxis, :3]
+
+
+def box_vertices(transforms, box_locations, box_extents, box_rotations=None):
+    """
+    Returns the world vertices of bounding boxes, in the order of 'carla.BoundingBox.get_world_vertices'
+
+        :param transforms: (n, 6) array with the transforms of the actors
+        :param box_locations: (n, 3) array with the location of each box, relative to its actor
+        :param box_extents: (n, 3) array with the extent of each box
+        :param box_rotations: (n, 3) array with the pitch, yaw and roll of each box, relative to its actor.
+            If None, the boxes aren't rotated
+        :return: (n, 8, 3) array of vertices
+    """
+    box_locations = np.asarray(box_locations, dtype=np.float64).reshape(-1, 3)
+    box_extents = np.asarray(box_extents, dtype=np.float64).reshape(-1, 3)
+    if box_rotations is None:
+        box_rotations = np.zeros_like(box_locations)
+    local_vertices = _BOX_SIGNS[np.newaxis] * box_extents[:, np.newaxis]
+    local_vertices = transform_points(local_vertices, np.hstack([box_locations, box_rotations]))
+    return transform_points(local_vertices, transforms)
+
+
+def corridor_polygons(left, right):
+    """
+    Splits a corridor, given by the points of its left and right borders, into the quadrilaterals
+    joining each pair of consecutive cross sections
+
+        :param left: (k, 2) array with the left border of the corridor
+        :param right: (k, 2) array with the right border of the corridor
+        :return: (k - 1, 4, 2) array of quadrilaterals
+    """
+    left = np.asarray(left, dtype=np.float64).reshape(-1, 2)
+    right = np.asarray(right, dtype=np.float64).reshape(-1, 2)
+    return np.stack([left[:-1], right[:-1], right[1:], left[1:]], axis=1)
+
+
+def _separating_axes(polygons):
+    """Normals of all the segments between pairs of points of each polygon, which include its hull edges"""
+    first, second = np.triu_indices(polygons.shape[1], k=1)
+    edges = polygons[:, second] - polygons[:, first]
+    return np.stack([-edges[..., 1], edges[..., 0]], axis=-1)
+
+
+def _separated(polygons, others, axes):
+    """(m, n) boolean array, True where an axis of the m polygons separates them from the n others"""
+    m, n, count = len(polygons), len(others), axes.shape[1]
+    own = np.matmul(polygons, axes.transpose(0, 2, 1))
+    projections = np.dot(others.reshape(-1, 2), axes.reshape(-1, 2).T).reshape(n, -1, m, count)
+    own_min, own_max = own.min(axis=1), own.max(axis=1)
+    other_min, other_max = projections.min(axis=1), projections.max(axis=1)
+    separated = (own_max[np.newaxis] < other_min) | (other_max < own_min[np.newaxis])
+    return np.any(separated, axis=2).T
+
+
+def convex_polygons_intersect(polygons_a, polygons_b):
+    """
+    Separating axis test between the convex hulls of two sets of polygons. Polygons that touch
+    are considered to intersect.
+
+        :param polygons_a: (m, k, 2) array with the points of m polygons
+        :param polygons_b: (n, l, 2) array with the points of n polygons
+        :return: (m, n) boolean array, True where the hulls of the polygons intersect
+    """
+    polygons_a = np.asarray(polygons_a, dtype=np.float64)[..., :2]
+    polygons_b = np.asarray(polygons_b, dtype=np.float64)[..., :2]
+    m, n = len(polygons_a), len(polygons_b)
+    if m == 0 or n == 0:
+        return np.zeros((m, n), dtype=bool)
+
+    # Each side projects all the polygons of the other one on its axes with a single matrix product
+    separated_a = _separated(polygons_a, polygons_b, _separating_axes(polygons_a))
+    separated_b = _separated(polygons_b, polygons_a, _separating_axes(polygons_b))
+    return ~(separated_a | separated_b.T)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" Module with an opt-in profiler of the phases of the agents and of the calls they make to the client API. """
+
+from bisect import bisect_right
+import functools
+import io
+import json
+import logging
+import threading
+import time
+
+import carla
+
+# Upper edges of the histogram bins, in milliseconds. The last bin holds the longer durations
+DEFAULT_BINS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0)
+
+# Client API methods timed by the profiler, as (class name, method name)
+RPC_METHODS = (('Map', 'get_waypoint'), ('Actor', 'get_transform'), ('World', 'get_actors'))
+
+
+class _NullPhase(object):
+    """Context manager that does nothing, returned by the phases of a disabled profiler"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    """Context manager that records its duration in a profiler"""
+
+    __slots__ = ('_profiler', '_name', '_begin')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._begin = None
+
+    def __enter__(self):
+        self._begin = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self._profiler.record('phases', self._name, time.time() - self._begin)
+        return False
+
+
+class _Histogram(object):
+    """Call count, total duration and histogram of the durations of a phase or method"""
+
+    def __init__(self, bins):
+        self.bins = bins
+        self.counts = [0] * (len(bins) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration_ms):
+        self.counts[bisect_right(self.bins, duration_ms)] += 1
+        self.count += 1
+        self.total += duration_ms
+        self.max = max(self.max, duration_ms)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'max_ms': self.max,
+            'bins_ms': list(self.bins),
+            'histogram': list(self.counts)}
+
+
+class AgentProfiler(object):
+    """
+    AgentProfiler records the wall time and the number of calls of the phases of the agents, such as
+    the obstacle detection or the local planning, and of the client API methods they end up calling.
+    Durations are aggregated into histograms, which can be printed or dumped as JSON.
+
+    The profiler is disabled by default. The agents then enter a context manager that does nothing,
+    and the client API isn't touched. Enabling it wraps the methods of RPC_METHODS at class level,
+    so every call made in the process is timed, whichever module makes it. Several agents can share
+    a profiler to get fleet wide figures.
+    """
+
+    # Profiler whose wrappers are currently installed in the client API
+    _instrumenting = None
+    _originals = {}
+    _instrument_lock = threading.Lock()
+
+    def __init__(self, enabled=False, bins=DEFAULT_BINS, rpcs=True):
+        """
+        :param enabled: whether the profiler starts recording right away
+        :param bins: upper edges of the histogram bins, in milliseconds
+        :param rpcs: whether the client API methods are timed while the profiler is enabled
+        """
+        self.enabled = False
+        self._bins = tuple(bins)
+        self._rpcs = rpcs
+        self._lock = threading.Lock()
+        self._data = {'phases': {}, 'rpcs': {}}
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        """Starts recording. Only one profiler at a time can time the client API methods"""
+        self.enabled = True
+        if self._rpcs:
+            self._instrument()
+
+    def disable(self):
+        """Stops recording, restoring the client API methods"""
+        self.enabled = False
+        self._restore()
+
+    def reset(self):
+        """Discards all the recorded data"""
+        with self._lock:
+            self._data = {'phases': {}, 'rpcs': {}}
+
+    def phase(self, name):
+        """
+        Returns a context manager that records its duration under a phase name.
+        Phases can be nested, in which case the time of the inner one is also part of the outer one
+
+            :param name (str): name of the phase
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def record(self, kind, name, duration):
+        """
+        Adds a duration to the data of a phase or method
+
+            :param kind (str): 'phases' or 'rpcs'
+            :param name (str): name of the phase or method
+            :param duration (float): duration, in seconds
+        """
+        with self._lock:
+            histogram = self._data[kind].get(name)
+            if histogram is None:
+                histogram = _Histogram(self._bins)
+                self._data[kind][name] = histogram
+            histogram.add(1000.0 * duration)
+
+    def summary(self):
+        """
+        Returns the recorded data as a dictionary
+        {'phases': {name: statistics}, 'rpcs': {name: statistics}}, where the statistics
+        are the call count, the total, mean and maximum durations and the histogram
+        """
+        with self._lock:
+            return {kind: {name: histogram.to_dict() for name, histogram in sorted(data.items())}
+                    for kind, data in self._data.items()}
+
+    def dump_json(self, path):
+        """
+        Writes the summary to a JSON file
+
+            :param path (str): path of the file
+        """
+        with io.open(path, 'w', encoding='utf-8') as json_file:
+            json_file.write(u'{}'.format(json.dumps(self.summary(), indent=2)))
+
+    def print_summary(self):
+        """Prints a table with the call count and durations of each phase and method"""
+        summary = self.summary()
+        print('{:<24} {:>10} {:>12} {:>10} {:>10}'.format('name', 'calls', 'total (ms)', 'mean', 'max'))
+        for kind in ('phases', 'rpcs'):
+            for name, statistics in summary[kind].items():
+                print('{:<24} {:>10} {:>12.2f} {:>10.3f} {:>10.3f}'.format(
+                    name if kind == 'phases' else 'rpc ' + name, statistics['count'],
+                    statistics['total_ms'], statistics['mean_ms'], statistics['max_ms']))
+
+    def _instrument(self):
+        """Wraps the client API methods so that their calls are recorded by this profiler"""
+        cls = AgentProfiler
+        with cls._instrument_lock:
+            if cls._instrumenting is not None:
+                if cls._instrumenting is not self:
+                    logging.warning("Another profiler is already timing the client API methods")
+                return
+            for class_name, method_name in RPC_METHODS:
+                carla_class = getattr(carla, class_name)
+                original = getattr(carla_class, method_name)
+                cls._originals[(class_name, method_name)] = original
+                setattr(carla_class, method_name, self._wrap(original, method_name))
+            cls._instrumenting = self
+
+    def _restore(self):
+        """Restores the client API methods wrapped by this profiler"""
+        cls = AgentProfiler
+        with cls._instrument_lock:
+            if cls._instrumenting is not self:
+                return
+            for (class_name, method_name), original in cls._originals.items():
+                setattr(getattr(carla, class_name), method_name, original)
+            cls._originals = {}
+            cls._instrumenting = None
+
+    def _wrap(self, method, name):
+        """Returns a version of a method that records the duration of its calls"""
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            begin = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record('rpcs', name, time.time() - begin)
+        return timed
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" Module with spatial indices to query nearby points without checking all of them. """
+
+import numpy as np
+
+
+class PointGrid(object):
+    """
+    Uniform grid over a static set of 3D points, hashed by the (x, y) cell they belong to.
+    Queries are vectorized, accepting arrays of locations.
+    """
+
+    def __init__(self, points, cell_size):
+        """
+        :param points: (n, 3) array of point locations
+        :param cell_size: side of the grid cells, in meters
+        """
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.cell_size = float(cell_size)
+
+        keys = self._keys(self._cells(self.points))
+        self._order = np.argsort(keys, kind='stable')
+        self._cell_keys, self._cell_start = np.unique(keys[self._order], return_index=True)
+        self._cell_end = np.append(self._cell_start[1:], len(keys))
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cells(self, locations):
+        return np.floor(locations[:, :2] / self.cell_size).astype(np.int64)
+
+    @staticmethod
+    def _keys(cells):
+        return cells[:, 0] * 4294967296 + (cells[:, 1] + 2147483648)
+
+    def candidates(self, locations, rings=1):
+        """
+        Returns the points in the block of (2 * rings + 1)^2 cells centered at the cell of each location.
+        Any point out of the block is farther than 'rings * cell_size' from the location.
+
+            :param locations: (m, 3) array of locations
+            :param rings: number of cells around the center one
+            :return: two arrays, with the index of the location and of the point of each candidate
+        """
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+        cells = self._cells(locations)
+        query_parts = []
+        point_parts = []
+        if len(self._cell_keys) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        for dx in range(-rings, rings + 1):
+            for dy in range(-rings, rings + 1):
+                keys = self._keys(cells + np.array([dx, dy]))
+                position = np.searchsorted(self._cell_keys, keys)
+                position = np.minimum(position, len(self._cell_keys) - 1)
+                found = self._cell_keys[position] == keys
+                start = np.where(found, self._cell_start[position], 0)
+                counts = np.where(found, self._cell_end[position] - self._cell_start[position], 0)
+
+                # Concatenated ranges [start, start + count) of each location
+                total = counts.sum()
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+                query_parts.append(np.repeat(np.arange(len(locations)), counts))
+                point_parts.append(self._order[offsets])
+
+        return np.concatenate(query_parts), np.concatenate(point_parts)
+
+    def nearest(self, locations):
+        """
+        Returns the index of the closest point to each location and its distance.
+
+            :param locations: (m, 3) array of locations
+        """
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+        indices = np.full(len(locations), -1, dtype=np.int64)
+        distances = np.full(len(locations), np.inf)
+
+        query, point = self.candidates(locations)
+        if len(query) > 0:
+            candidate_distances = np.linalg.norm(self.points[point] - locations[query], axis=1)
+            # Sorting by location and then by distance leaves the closest point first
+            order = np.lexsort((candidate_distances, query))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = query[order][1:] != query[order][:-1]
+            best = order[first]
+            indices[query[best]] = point[best]
+            distances[query[best]] = candidate_distances[best]
+
+        # Locations without a point close enough might have a closer one outside the checked cells
+        missing = np.nonzero(distances > self.cell_size)[0]
+        for i in missing:
+            all_distances = np.linalg.norm(self.points - locations[i], axis=1)
+            if len(all_distances) > 0:
+                indices[i] = np.argmin(all_distances)
+                distances[i] = all_distances[indices[i]]
+
+        return indices, distances
+
+    def query_radius(self, location, radius):
+        """
+        Returns the indices of the points closer than radius to a location.
+
+            :param location: (x, y, z) location
+            :param radius: maximum distance, in meters
+        """
+        location = np.asarray(location, dtype=np.float64).reshape(1, 3)
+        rings = int(np.ceil(radius / self.cell_size))
+        _, point = self.candidates(location, rings)
+        distances = np.linalg.norm(self.points[point] - location, axis=1)
+        return np.sort(point[distances < radius])
+
+
+class PolylineIndex(object):
+    """
+    Index of the segments of a set of polylines, used to project locations onto the closest one.
+    The polylines are given as a single array of points, along with a flag telling whether
+    each point is connected to the following one.
+    """
+
+    def __init__(self, points, connected, cell_size):
+        """
+        :param points: (n, 3) array with the points of all the polylines
+        :param connected: (n,) boolean array, True if the point is joined by a segment to the next one
+        :param cell_size: side of the grid cells, in meters
+        """
+        self._grid = PointGrid(points, cell_size)
+        self.points = self._grid.points
+        self._connected = np.array(connected, dtype=bool).reshape(-1)
+        self._connected[-1:] = False
+        self._segment_starts = np.nonzero(self._connected)[0]
+
+        lengths = np.linalg.norm(self.points[self._segment_starts + 1] - self.points[self._segment_starts], axis=1)
+        self._max_length = lengths.max() if len(lengths) > 0 else 0.0
+
+    def __len__(self):
+        return len(self._segment_starts)
+
+    def _closest(self, locations, query, starts):
+        """Projects each location onto its candidate segments, keeping the closest one"""
+        start_points = self.points[starts]
+        segments = self.points[starts + 1] - start_points
+        squared_lengths = np.einsum('ij,ij->i', segments, segments)
+        offsets = locations[query] - start_points
+        t = np.einsum('ij,ij->i', offsets, segments) / np.where(squared_lengths > 0, squared_lengths, 1.0)
+        projections = start_points + np.clip(t, 0.0, 1.0)[:, np.newaxis] * segments
+        distances = np.linalg.norm(locations[query] - projections, axis=1)
+
+        # Sorting by location, distance and segment leaves the closest segment first. On ties, like the
+        # point shared by two consecutive polylines, the segment starting at the location is preferred
+        order = np.lexsort((starts, t >= 1.0, distances, query))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = query[order][1:] != query[order][:-1]
+        best = order[first]
+        return query[best], starts[best], projections[best], distances[best]
+
+    def project(self, locations):
+        """
+        Projects each location onto the closest segment of the polylines.
+
+            :param locations: (m, 3) array of locations
+            :return: arrays with the index of the starting point of the closest segment of each location
+                (-1 if there are no segments), the (m, 3) projected locations and their distances
+        """
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+        starts = np.full(len(locations), -1, dtype=np.int64)
+        projections = np.array(locations)
+        distances = np.full(len(locations), np.inf)
+        if len(self._segment_starts) == 0:
+            return starts, projections, distances
+
+        # Candidates are the segments starting or ending at the points of the neighboring cells
+        query, point = self._grid.candidates(locations)
+        query = np.concatenate([query, query])
+        candidate_starts = np.concatenate([point, point - 1])
+        valid = candidate_starts >= 0
+        valid[valid] = self._connected[candidate_starts[valid]]
+        if np.any(valid):
+            found, found_starts, found_projections, found_distances = self._closest(
+                locations, query[valid], candidate_starts[valid])
+            starts[found] = found_starts
+            projections[found] = found_projections
+            distances[found] = found_distances
+
+        # A segment without points in the neighboring cells can still be closer than this
+        missing = np.nonzero(distances > self._grid.cell_size - self._max_length / 2.0)[0]
+        for i in missing:
+            query = np.full(len(self._segment_starts), i)
+            _, starts[i:i+1], projections[i:i+1], distances[i:i+1] = self._closest(
+                locations, query, self._segment_starts)
+
+        return starts, projections, distances
+
+
+class SpatialHash(object):
+    """
+    Uniform grid over a set of moving points, such as the actors of the world, identified by an id.
+    It is updated incrementally: only the points that change of cell between updates are moved.
+    Queries only check the points of the cells overlapping the queried area, and return their ids.
+    """
+
+    def __init__(self, cell_size):
+        """
+        :param cell_size: side of the grid cells, in meters
+        """
+        self.cell_size = float(cell_size)
+        self._cells = {}  # Cell key -> set of ids
+        self._cell_of = {}  # Id -> cell key
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.points = np.zeros((0, 3), dtype=np.float64)
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell_keys(self, points):
+        cells = np.floor(points[:, :2] / self.cell_size).astype(np.int64)
+        return PointGrid._keys(cells)
+
+    def update(self, ids, points):
+        """
+        Sets the current location of the points. Points whose id isn't given are removed.
+
+            :param ids: (n,) array with the ids of the points
+            :param points: (n, 3) array with their locations
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        keys = self._cell_keys(points).tolist()
+        id_list = ids.tolist()
+
+        for point_id in set(self._cell_of) - set(id_list):
+            self._move(point_id, self._cell_of.pop(point_id), None)
+        for point_id, key in zip(id_list, keys):
+            previous = self._cell_of.get(point_id)
+            if previous != key:
+                self._move(point_id, previous, key)
+                self._cell_of[point_id] = key
+
+        self.ids = ids
+        self.points = points
+        self._rows = {point_id: row for row, point_id in enumerate(id_list)}
+
+    def _move(self, point_id, previous, key):
+        if previous is not None:
+            cell = self._cells[previous]
+            cell.discard(point_id)
+            if not cell:
+                del self._cells[previous]
+        if key is not None:
+            self._cells.setdefault(key, set()).add(point_id)
+
+    def _candidates(self, location, radius):
+        """Rows of the points in the cells overlapping the square around a location"""
+        low = np.floor((location[:2] - radius) / self.cell_size).astype(np.int64)
+        high = np.floor((location[:2] + radius) / self.cell_size).astype(np.int64)
+        if (high[0] - low[0] + 1) * (high[1] - low[1] + 1) > len(self._cells):
+            # The area covers more cells than the occupied ones, checking all the points is faster
+            return np.arange(len(self.ids))
+        rows = []
+        for cell_x in range(low[0], high[0] + 1):
+            for cell_y in range(low[1], high[1] + 1):
+                # Same keys as PointGrid
+                cell = self._cells.get(int(cell_x) * 4294967296 + (int(cell_y) + 2147483648))
+                if cell:
+                    rows.extend(self._rows[point_id] for point_id in cell)
+        return np.array(rows, dtype=np.int64)
+
+    def query_radius(self, location, radius, planar=False):
+        """
+        Returns the ids of the points closer than a radius to a location.
+
+            :param location: (x, y, z) location
+            :param radius: maximum distance, in meters
+            :param planar: if True, the distance is measured in the ground plane, ignoring the z coordinate
+        """
+        location = np.asarray(location, dtype=np.float64).reshape(3)
+        rows = self._candidates(location, radius)
+        dimensions = 2 if planar else 3
+        distances = np.linalg.norm(self.points[rows, :dimensions] - location[:dimensions], axis=1)
+        return self.ids[rows[distances < radius]]
+
+    def query_cone(self, location, yaw, radius, angle_interval):
+        """
+        Returns the ids of the points within a distance of a location, in the ground plane, whose angle
+        with a heading is inside an interval, as tested by 'is_within_distance'. 0 is a point in front
+        and 180, one behind.
+
+            :param location: (x, y, z) location of the apex of the cone
+            :param yaw: heading of the cone, in degrees
+            :param radius: maximum distance, in meters
+            :param angle_interval: [min, max] angles, in degrees
+        """
+        location = np.asarray(location, dtype=np.float64).reshape(3)
+        rows = self._candidates(location, radius)
+        vectors = self.points[rows, :2] - location[:2]
+        norms = np.linalg.norm(vectors, axis=1)
+        heading = np.array([np.cos(np.radians(yaw)), np.sin(np.radians(yaw))])
+        cosines = np.dot(vectors, heading) / np.where(norms > 0, norms, 1.0)
+        angles = np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+        inside = (norms <= radius) & ((norms < 0.001) | ((angles > angle_interval[0]) & (angles < angle_interval[1])))
+        return self.ids[rows[inside]]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" Module with an index of the traffic light trigger volumes by road, shared by the agents of a process. """
+
+from collections import OrderedDict, namedtuple
+import threading
+
+from agents.tools.misc import get_trafficlight_trigger_location
+
+# Waypoint of the trigger volume of a traffic light, with its lane and forward vector
+TrafficLightTrigger = namedtuple(
+    'TrafficLightTrigger', ['traffic_light', 'waypoint', 'road_id', 'lane_id', 's', 'direction'])
+
+
+class TrafficLightIndex(object):
+    """
+    TrafficLightIndex computes once the waypoints of the trigger volumes of the traffic lights,
+    which never move, and indexes them by road_id. Checking the lights that affect a vehicle is
+    then a lookup of the lights of its road, plus reading their state.
+    """
+
+    _shared = OrderedDict()
+    _shared_lock = threading.Lock()
+
+    # Number of worlds whose index is kept by 'get'. The least recently used ones are dropped,
+    # along with their traffic light handles, as happens after reloading the world
+    MAX_SHARED = 4
+
+    @classmethod
+    def get(cls, world, wmap):
+        """
+        Returns the index shared by all the agents of the given world
+
+            :param world (carla.World): world of the traffic lights
+            :param wmap (carla.Map): map of the world
+        """
+        with cls._shared_lock:
+            index = cls._shared.pop(world.id, None)
+            if index is None:
+                index = cls(wmap, world.get_actors().filter("*traffic_light*"))
+            cls._shared[world.id] = index
+            while len(cls._shared) > cls.MAX_SHARED:
+                cls._shared.popitem(last=False)
+        return index
+
+    @classmethod
+    def clear(cls, world=None):
+        """
+        Drops the shared index of a world, so that the next call to 'get' creates a new one
+
+            :param world (carla.World): world whose index is dropped. If None, the indices of all the worlds are
+        """
+        with cls._shared_lock:
+            if world is None:
+                cls._shared.clear()
+            else:
+                cls._shared.pop(world.id, None)
+
+    def __init__(self, wmap, traffic_lights):
+        """
+        :param wmap: carla.Map of the traffic lights
+        :param traffic_lights: list of carla.TrafficLight to index
+        """
+        self._by_road = {}
+        for traffic_light in traffic_lights:
+            waypoint = wmap.get_waypoint(get_trafficlight_trigger_location(traffic_light))
+            forward = waypoint.transform.get_forward_vector()
+            trigger = TrafficLightTrigger(
+                traffic_light, waypoint, waypoint.road_id, waypoint.lane_id, waypoint.s,
+                (forward.x, forward.y, forward.z))
+            self._by_road.setdefault(waypoint.road_id, []).append(trigger)
+
+    def __len__(self):
+        return sum(len(triggers) for triggers in self._by_road.values())
+
+    def on_road(self, road_id):
+        """
+        Returns the TrafficLightTrigger of the lights whose trigger volume is on a road
+
+            :param road_id (int): id of the road
+        """
+        return self._by_road.get(road_id, [])
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" Module with a per frame cache of the state of the actors, shared by the agents of a process. """
+
+from collections import OrderedDict
+from fnmatch import fnmatch
+import threading
+
+import numpy as np
+import carla
+
+from agents.tools.geometry import box_vertices
+from agents.tools.spatial_index import SpatialHash
+
+
+class WorldStateCache(object):
+    """
+    WorldStateCache stores the state of the actors of the world at a given frame, read from a single
+    world snapshot. The ids, transforms, velocities and bounding box extents of the vehicles and walkers
+    are kept in numpy arrays, and their waypoints are computed at most once per frame. A spatial hash
+    of their locations answers the radius and cone queries without going through all of them.
+
+    The cache is keyed by the frame of the snapshot, so updating it several times during the same
+    frame is free, and the agents of a process share the same instance through 'get'.
+
+    Lists of actors are returned in the order of the snapshot, which is also the one of 'carla.World.get_actors'.
+    """
+
+    _shared = OrderedDict()
+    _shared_lock = threading.Lock()
+
+    # Number of worlds whose cache is kept by 'get'. The least recently used ones are dropped,
+    # along with their actor handles, as happens after reloading the world
+    MAX_SHARED = 4
+
+    # Actors whose transform and velocity are stored every frame
+    DYNAMIC_PATTERNS = ('*vehicle*', '*walker.pedestrian*')
+
+    @classmethod
+    def get(cls, world, wmap=None):
+        """
+        Returns the cache shared by all the agents of the given world
+
+            :param world (carla.World): world of the actors
+            :param wmap (carla.Map): map used to compute the waypoints of the actors.
+                If None, it is retrieved from the world when needed
+        """
+        with cls._shared_lock:
+            cache = cls._shared.pop(world.id, None)
+            if cache is None:
+                cache = cls(world, wmap)
+            elif cache._map is None:
+                cache._map = wmap
+            cls._shared[world.id] = cache
+            while len(cls._shared) > cls.MAX_SHARED:
+                cls._shared.popitem(last=False)
+        return cache
+
+    @classmethod
+    def clear(cls, world=None):
+        """
+        Drops the shared cache of a world, so that the next call to 'get' creates a new one
+
+            :param world (carla.World): world whose cache is dropped. If None, the caches of all the worlds are
+        """
+        with cls._shared_lock:
+            if world is None:
+                cls._shared.clear()
+            else:
+                cls._shared.pop(world.id, None)
+
+    def __init__(self, world, wmap=None, cell_size=20.0):
+        """
+        :param world: carla.World of the actors
+        :param wmap: carla.Map used to compute the waypoints of the actors. If None, it is retrieved from the world
+            the first time it is needed
+        :param cell_size: side of the cells of the spatial hash, in meters
+        """
+        self._world = world
+        self._map = wmap
+        self._lock = threading.RLock()
+        self.frame = None
+
+        # Static information of the actors, retrieved once per actor
+        self._actors = {}
+        self._bounding_boxes = {}
+
+        # Ids of the actors in the order of the snapshot, and their position in it
+        self._order = []
+        self._position = {}
+
+        # Dynamic actors of the current frame
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.locations = np.zeros((0, 3))
+        self.rotations = np.zeros((0, 3))  # pitch, yaw, roll
+        self.velocities = np.zeros((0, 3))
+        self.extents = np.zeros((0, 3))
+        self._index = {}
+        self._grid = SpatialHash(cell_size)
+
+        # Per frame memoization
+        self._filtered = {}
+        self._filtered_ids = {}
+        self._waypoints = {}
+
+    def update(self, snapshot=None):
+        """
+        Reads the state of the actors from a world snapshot, unless it is from the frame already cached
+
+            :param snapshot (carla.WorldSnapshot): snapshot to read. If None, the latest one of the world is used
+        """
+        if snapshot is None:
+            snapshot = self._world.get_snapshot()
+        if snapshot.frame == self.frame:
+            return
+
+        with self._lock:
+            if snapshot.frame == self.frame:
+                return
+
+            actor_snapshots = list(snapshot)
+            order = [actor_snapshot.id for actor_snapshot in actor_snapshots]
+            snapshot_ids = set(order)
+
+            # Register the new actors with a single query, and forget the destroyed ones
+            new_ids = [actor_id for actor_id in snapshot_ids if actor_id not in self._actors]
+            if new_ids:
+                for actor in self._world.get_actors(new_ids):
+                    self._actors[actor.id] = actor
+                    if any(fnmatch(actor.type_id, pattern) for pattern in self.DYNAMIC_PATTERNS):
+                        self._bounding_boxes[actor.id] = actor.bounding_box
+            for actor_id in [actor_id for actor_id in self._actors if actor_id not in snapshot_ids]:
+                del self._actors[actor_id]
+                self._bounding_boxes.pop(actor_id, None)
+
+            dynamic = [s for s in actor_snapshots if s.id in self._bounding_boxes]
+            ids = np.zeros(len(dynamic), dtype=np.int64)
+            locations = np.zeros((len(dynamic), 3))
+            rotations = np.zeros((len(dynamic), 3))
+            velocities = np.zeros((len(dynamic), 3))
+            extents = np.zeros((len(dynamic), 3))
+            for i, actor_snapshot in enumerate(dynamic):
+                transform = actor_snapshot.get_transform()
+                velocity = actor_snapshot.get_velocity()
+                extent = self._bounding_boxes[actor_snapshot.id].extent
+                ids[i] = actor_snapshot.id
+                locations[i] = (transform.location.x, transform.location.y, transform.location.z)
+                rotations[i] = (transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll)
+                velocities[i] = (velocity.x, velocity.y, velocity.z)
+                extents[i] = (extent.x, extent.y, extent.z)
+
+            self.ids, self.locations, self.rotations = ids, locations, rotations
+            self.velocities, self.extents = velocities, extents
+            self._index = {actor_id: i for i, actor_id in enumerate(ids.tolist())}
+            self._order = [actor_id for actor_id in order if actor_id in self._actors]
+            self._position = {actor_id: i for i, actor_id in enumerate(self._order)}
+            self._grid.update(ids, locations)
+            self._filtered = {}
+            self._filtered_ids = {}
+            self._waypoints = {}
+            self.frame = snapshot.frame
+
+    def index(self, actor):
+        """Returns the row of an actor in the arrays of the cache, or None if it isn't a cached dynamic actor"""
+        return self._index.get(actor.id)
+
+    def actor(self, actor_id):
+        """Returns the carla.Actor with the given id, or None if it isn't in the cache"""
+        return self._actors.get(actor_id)
+
+    def filter(self, pattern):
+        """
+        Returns the list of actors whose type id matches a pattern, like 'carla.ActorList.filter'
+
+            :param pattern (str): wildcard pattern of the type id
+        """
+        actors = self._filtered.get(pattern)
+        if actors is None:
+            actors = [self._actors[actor_id] for actor_id in self._order
+                      if fnmatch(self._actors[actor_id].type_id, pattern)]
+            self._filtered[pattern] = actors
+        return actors
+
+    def _matching(self, ids, pattern):
+        """Returns the actors of the given ids whose type id matches a pattern, in the order of the snapshot"""
+        matching_ids = self._filtered_ids.get(pattern)
+        if matching_ids is None:
+            matching_ids = set(actor.id for actor in self.filter(pattern))
+            self._filtered_ids[pattern] = matching_ids
+        return [self._actors[actor_id] for actor_id in sorted(ids.tolist(), key=self._position.get)
+                if actor_id in matching_ids]
+
+    def nearby(self, location, radius, pattern='*vehicle*', planar=False):
+        """
+        Returns the actors matching a pattern closer than a radius to a location
+
+            :param location (carla.Location): center of the query
+            :param radius (float): maximum distance, in meters
+            :param pattern (str): wildcard pattern of the type id
+            :param planar (bool): if True, the distance is measured in the ground plane
+        """
+        ids = self._grid.query_radius((location.x, location.y, location.z), radius, planar)
+        return self._matching(ids, pattern)
+
+    def in_cone(self, transform, radius, angle_interval, pattern='*vehicle*'):
+        """
+        Returns the actors matching a pattern within a distance of a transform, whose angle with
+        its heading is inside an interval, with the same criteria as 'is_within_distance'
+
+            :param transform (carla.Transform): apex and heading of the cone
+            :param radius (float): maximum distance, in meters
+            :param angle_interval (list): [min, max] angles, where 0 is in front and 180, behind
+            :param pattern (str): wildcard pattern of the type id
+        """
+        location = transform.location
+        ids = self._grid.query_cone(
+            (location.x, location.y, location.z), transform.rotation.yaw, radius, angle_interval)
+        return self._matching(ids, pattern)
+
+    def max_extent(self):
+        """Returns the largest half length of the bounding boxes of the cached actors"""
+        return float(self.extents[:, :2].max()) if len(self.extents) > 0 else 0.0
+
+    def transform(self, actor):
+        """Returns the carla.Transform of an actor. The returned object can be modified freely"""
+        i = self._index.get(actor.id)
+        if i is None:
+            return actor.get_transform()
+        x, y, z = self.locations[i].tolist()
+        pitch, yaw, roll = self.rotations[i].tolist()
+        return carla.Transform(carla.Location(x=x, y=y, z=z), carla.Rotation(pitch=pitch, yaw=yaw, roll=roll))
+
+    def location(self, actor):
+        """Returns the carla.Location of an actor"""
+        i = self._index.get(actor.id)
+        if i is None:
+            return actor.get_location()
+        x, y, z = self.locations[i].tolist()
+        return carla.Location(x=x, y=y, z=z)
+
+    def speed(self, actor):
+        """Returns the speed of an actor in Km/h"""
+        i = self._index.get(actor.id)
+        if i is None:
+            velocity = actor.get_velocity()
+            return 3.6 * np.linalg.norm([velocity.x, velocity.y, velocity.z])
+        return 3.6 * float(np.linalg.norm(self.velocities[i]))
+
+    def bounding_box(self, actor):
+        """Returns the carla.BoundingBox of an actor"""
+        bounding_box = self._bounding_boxes.get(actor.id)
+        return bounding_box if bounding_box is not None else actor.bounding_box
+
+    def bounding_box_vertices(self, actors):
+        """
+        Returns the world vertices of the bounding boxes of several actors, computed at once
+
+            :param actors (list): list of carla.Actor
+            :return: (n, 8, 3) array of vertices, in the order of 'carla.BoundingBox.get_world_vertices'
+        """
+        transforms = np.zeros((len(actors), 6))
+        boxes = np.zeros((len(actors), 9))
+        for i, actor in enumerate(actors):
+            row = self._index.get(actor.id)
+            if row is None:
+                transform = actor.get_transform()
+                transforms[i] = (transform.location.x, transform.location.y, transform.location.z,
+                                 transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll)
+            else:
+                transforms[i, :3] = self.locations[row]
+                transforms[i, 3:] = self.rotations[row]
+            bounding_box = self.bounding_box(actor)
+            boxes[i] = (bounding_box.location.x, bounding_box.location.y, bounding_box.location.z,
+                        bounding_box.extent.x, bounding_box.extent.y, bounding_box.extent.z,
+                        bounding_box.rotation.pitch, bounding_box.rotation.yaw, bounding_box.rotation.roll)
+        return box_vertices(transforms, boxes[:, :3], boxes[:, 3:6], boxes[:, 6:])
+
+    def waypoint(self, actor, lane_type=carla.LaneType.Driving):
+        """
+        Returns the waypoint of the map closest to an actor, computed once per frame
+
+            :param actor (carla.Actor): actor to localize
+            :param lane_type (carla.LaneType): type of lanes considered
+        """
+        key = (actor.id, lane_type)
+        waypoint = self._waypoints.get(key)
+        if waypoint is None:
+            if self._map is None:
+                self._map = self._world.get_map()
+            waypoint = self._map.get_waypoint(self.location(actor), lane_type=lane_type)
+            self._waypoints[key] = waypoint
+        return waypoint
@@ -0,0 +1,390 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import carla
+
+from collections import deque
+import math
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.navigation.controller import VehiclePIDController, VehiclePIDControllerBank
+from agents.navigation.multi_agent_runner import MultiAgentRunner
+from agents.tools.world_state import WorldStateCache
+
+LATERAL = {'K_P': 1.95, 'K_I': 0.05, 'K_D': 0.2, 'dt': 0.05}
+LONGITUDINAL = {'K_P': 1.0, 'K_I': 0.05, 'K_D': 0.1, 'dt': 0.05}
+
+
+class ReferencePIDController(object):
+    """The lateral and longitudinal PID controllers with a deque of errors, as before the bank"""
+
+    def __init__(self, offset=0.0, max_throttle=0.75, max_brake=0.3, max_steering=0.8):
+        self.offset = offset
+        self.limits = (max_throttle, max_brake, max_steering)
+        self.past_steering = 0.0
+        self.lon_errors = deque(maxlen=10)
+        self.lat_errors = deque(maxlen=10)
+
+    @staticmethod
+    def pid(errors, error, gains):
+        errors.append(error)
+        if len(errors) >= 2:
+            _de = (errors[-1] - errors[-2]) / gains['dt']
+            _ie = sum(errors) * gains['dt']
+        else:
+            _de = 0.0
+            _ie = 0.0
+        return np.clip((gains['K_P'] * error) + (gains['K_D'] * _de) + (gains['K_I'] * _ie), -1.0, 1.0)
+
+    def run_step(self, target_speed, current_speed, vehicle_transform, waypoint_transform):
+        acceleration = self.pid(self.lon_errors, target_speed - current_speed, LONGITUDINAL)
+
+        ego_loc = vehicle_transform.location
+        pitch, yaw = math.radians(vehicle_transform.rotation.pitch), math.radians(vehicle_transform.rotation.yaw)
+        v_vec = np.array([math.cos(pitch) * math.cos(yaw), math.cos(pitch) * math.sin(yaw), 0.0])
+        w_loc = waypoint_transform.location
+        w_x, w_y = w_loc.x, w_loc.y
+        if self.offset != 0:
+            rotation = waypoint_transform.rotation
+            pitch, yaw, roll = math.radians(rotation.pitch), math.radians(rotation.yaw), math.radians(rotation.roll)
+            w_x += self.offset * (math.cos(yaw) * math.sin(pitch) * math.sin(roll) - math.sin(yaw) * math.cos(roll))
+            w_y += self.offset * (math.sin(yaw) * math.sin(pitch) * math.sin(roll) + math.cos(yaw) * math.cos(roll))
+        w_vec = np.array([w_x - ego_loc.x, w_y - ego_loc.y, 0.0])
+        wv_linalg = np.linalg.norm(w_vec) * np.linalg.norm(v_vec)
+        if wv_linalg == 0:
+            _dot = 1
+        else:
+            _dot = math.acos(np.clip(np.dot(w_vec, v_vec) / (wv_linalg), -1.0, 1.0))
+        if np.cross(v_vec, w_vec)[2] < 0:
+            _dot *= -1.0
+        current_steering = self.pid(self.lat_errors, _dot, LATERAL)
+
+        max_throttle, max_brake, max_steering = self.limits
+        if acceleration >= 0.0:
+            throttle, brake = min(acceleration, max_throttle), 0.0
+        else:
+            throttle, brake = 0.0, min(abs(acceleration), max_brake)
+        if current_steering > self.past_steering + 0.1:
+            current_steering = self.past_steering + 0.1
+        elif current_steering < self.past_steering - 0.1:
+            current_steering = self.past_steering - 0.1
+        if current_steering >= 0:
+            steering = min(max_steering, current_steering)
+        else:
+            steering = max(-max_steering, current_steering)
+        self.past_steering = steering
+        return throttle, brake, steering
+
+
+class FakeVehicle(object):
+    def __init__(self, world, actor_id):
+        self.id = actor_id
+        self.type_id = 'vehicle.test'
+        self.bounding_box = carla.BoundingBox(carla.Location(), carla.Vector3D(2.0, 1.0, 0.8))
+        self.transform = carla.Transform()
+        self.velocity = carla.Vector3D()
+        self._world = world
+
+    def get_world(self):
+        return self._world
+
+    def get_control(self):
+        return carla.VehicleControl()
+
+    def get_transform(self):
+        return self.transform
+
+    def get_velocity(self):
+        return self.velocity
+
+
+class FakeSnapshot(object):
+    """World snapshot with the state of the vehicles of a FakeWorld"""
+
+    def __init__(self, frame, vehicles):
+        self.frame = frame
+        self._vehicles = dict(vehicles)
+
+    def __iter__(self):
+        return iter(self._vehicles.values())
+
+    def find(self, actor_id):
+        return self._vehicles.get(actor_id)
+
+
+class FakeWorld(object):
+    def __init__(self):
+        self.id = 1
+        self.frame = 0
+        self.vehicles = {}
+
+    def spawn(self, actor_id):
+        self.vehicles[actor_id] = FakeVehicle(self, actor_id)
+        return self.vehicles[actor_id]
+
+    def get_snapshot(self):
+        return FakeSnapshot(self.frame, self.vehicles)
+
+    def get_actors(self, actor_ids):
+        return [self.vehicles[actor_id] for actor_id in actor_ids]
+
+
+class FakeWaypoint(object):
+    def __init__(self, transform):
+        self.transform = transform
+
+
+def random_transform(rng, center=None, spread=50.0):
+    x, y = (center.x, center.y) if center is not None else (0.0, 0.0)
+    return carla.Transform(
+        carla.Location(x + rng.uniform(-spread, spread), y + rng.uniform(-spread, spread), rng.uniform(0.0, 1.0)),
+        carla.Rotation(rng.uniform(-5.0, 5.0), rng.uniform(-180.0, 180.0), rng.uniform(-5.0, 5.0)))
+
+
+def move_vehicles(rng, world):
+    """Gives new random states to the vehicles, and the targets they drive to"""
+    world.frame += 1
+    targets = {}
+    for actor_id, vehicle in world.vehicles.items():
+        vehicle.transform = random_transform(rng)
+        vehicle.velocity = carla.Vector3D(rng.uniform(-15.0, 15.0), rng.uniform(-15.0, 15.0), 0.0)
+        targets[actor_id] = FakeWaypoint(random_transform(rng, vehicle.transform.location, 5.0))
+    return targets
+
+
+def speed(vehicle):
+    velocity = vehicle.velocity
+    return 3.6 * math.sqrt(velocity.x ** 2 + velocity.y ** 2 + velocity.z ** 2)
+
+
+class ControlTestCase(unittest.TestCase):
+    def assertControlEqual(self, control, expected):
+        self.assertAlmostEqual(control.throttle, expected[0], places=5)
+        self.assertAlmostEqual(control.brake, expected[1], places=5)
+        self.assertAlmostEqual(control.steer, expected[2], places=5)
+
+
+class TestVehiclePIDController(ControlTestCase):
+    def test_views_match_reference(self):
+        rng = random.Random(0)
+        world = FakeWorld()
+        world_state = WorldStateCache(world)
+        bank = VehiclePIDControllerBank(capacity=2)
+        controllers = {}
+        references = {}
+        for actor_id in range(1, 6):
+            offset = 0.0 if actor_id % 2 else rng.uniform(-1.0, 1.0)
+            controllers[actor_id] = VehiclePIDController(
+                world.spawn(actor_id), LATERAL, LONGITUDINAL, offset=offset, bank=bank, world_state=world_state)
+            references[actor_id] = ReferencePIDController(offset)
+
+        for _ in range(40):
+            targets = move_vehicles(rng, world)
+            for actor_id, vehicle in world.vehicles.items():
+                target_speed = rng.uniform(0.0, 50.0)
+                control = controllers[actor_id].run_step(target_speed, targets[actor_id])
+                expected = references[actor_id].run_step(
+                    target_speed, speed(vehicle), vehicle.transform, targets[actor_id].transform)
+                self.assertControlEqual(control, expected)
+
+    def test_bank_matches_reference(self):
+        rng = random.Random(1)
+        world = FakeWorld()
+        bank = VehiclePIDControllerBank(capacity=4)
+        slots = {}
+        references = {}
+        for actor_id in range(1, 21):
+            offset = rng.uniform(-1.0, 1.0) if actor_id % 3 == 0 else 0.0
+            slots[actor_id] = bank.add_vehicle(world.spawn(actor_id), LATERAL, LONGITUDINAL, offset=offset)
+            references[actor_id] = ReferencePIDController(offset)
+
+        for step in range(40):
+            if step == 20:
+                # A destroyed vehicle gets no control, and the others keep working
+                del world.vehicles[7]
+            targets = move_vehicles(rng, world)
+            actor_ids = sorted(slots)
+            target_speeds = [rng.uniform(0.0, 50.0) for _ in actor_ids]
+            controls = bank.run_step(
+                [slots[actor_id] for actor_id in actor_ids], target_speeds,
+                [targets.get(actor_id, FakeWaypoint(carla.Transform())) for actor_id in actor_ids],
+                world.get_snapshot())
+
+            for actor_id, target_speed, control in zip(actor_ids, target_speeds, controls):
+                vehicle = world.vehicles.get(actor_id)
+                if vehicle is None:
+                    self.assertIsNone(control)
+                    continue
+                expected = references[actor_id].run_step(
+                    target_speed, speed(vehicle), vehicle.transform, targets[actor_id].transform)
+                self.assertControlEqual(control, expected)
+
+    def test_apply_skips_missing_vehicles(self):
+        world = FakeWorld()
+        bank = VehiclePIDControllerBank()
+        slots = [bank.add_vehicle(world.spawn(actor_id), LATERAL, LONGITUDINAL) for actor_id in (3, 4)]
+
+        class FakeClient(object):
+            batch = None
+
+            def apply_batch(self, batch):
+                self.batch = batch
+
+        client = FakeClient()
+        bank.apply(client, slots, [carla.VehicleControl(throttle=0.5), None])
+        self.assertEqual([command.actor_id for command in client.batch], [3])
+
+    def test_deferred_steps_match_reference(self):
+        rng = random.Random(2)
+        world = FakeWorld()
+        world_state = WorldStateCache(world)
+        bank = VehiclePIDControllerBank()
+        controllers = {}
+        references = {}
+        for actor_id in range(1, 9):
+            controllers[actor_id] = VehiclePIDController(
+                world.spawn(actor_id), LATERAL, LONGITUDINAL, bank=bank, world_state=world_state)
+            references[actor_id] = ReferencePIDController()
+
+        for step in range(20):
+            if step == 10:
+                del world.vehicles[5]
+            targets = move_vehicles(rng, world)
+            bank.defer()
+            controls = {}
+            for actor_id in controllers:
+                target = targets.get(actor_id, FakeWaypoint(carla.Transform()))
+                controls[actor_id] = controllers[actor_id].run_step(30.0, target)
+            # An emergency stop sets the throttle and brake, and keeps the computed steering
+            controls[2].throttle, controls[2].brake = 0.0, 0.3
+            missing = bank.run_deferred(world.get_snapshot())
+            self.assertFalse(bank.is_deferring())
+            self.assertEqual([bank.vehicle_id(slot) for slot in missing], [] if step < 10 else [5])
+
+            for actor_id, vehicle in world.vehicles.items():
+                expected = references[actor_id].run_step(
+                    30.0, speed(vehicle), vehicle.transform, targets[actor_id].transform)
+                if actor_id == 2:
+                    expected = (0.0, 0.3, expected[2])
+                self.assertControlEqual(controls[actor_id], expected)
+
+    def test_deferred_repeated_steps_match_reference(self):
+        rng = random.Random(4)
+        world = FakeWorld()
+        world_state = WorldStateCache(world)
+        bank = VehiclePIDControllerBank()
+        controllers = {}
+        references = {}
+        for actor_id in range(1, 7):
+            controllers[actor_id] = VehiclePIDController(
+                world.spawn(actor_id), LATERAL, LONGITUDINAL, bank=bank, world_state=world_state)
+            references[actor_id] = ReferencePIDController()
+
+        for _ in range(20):
+            move_vehicles(rng, world)
+            # Some vehicles are stepped several times in the frame, with different targets and speeds
+            steps = [(actor_id, rng.uniform(0.0, 50.0), FakeWaypoint(random_transform(rng)))
+                     for actor_id in controllers for _ in range(1 + actor_id % 3)]
+            rng.shuffle(steps)
+            bank.defer()
+            controls = [controllers[actor_id].run_step(target_speed, target)
+                        for actor_id, target_speed, target in steps]
+            self.assertEqual(bank.run_deferred(world.get_snapshot()), [])
+
+            for (actor_id, target_speed, target), control in zip(steps, controls):
+                vehicle = world.vehicles[actor_id]
+                expected = references[actor_id].run_step(
+                    target_speed, speed(vehicle), vehicle.transform, target.transform)
+                self.assertControlEqual(control, expected)
+
+        self.assertRaises(ValueError, bank.compute, [1, 1], [0.0, 0.0], [0.0, 0.0], np.zeros((2, 6)), np.zeros((2, 6)))
+
+
+class FakeLocalPlanner(object):
+    def __init__(self, controller):
+        self._vehicle_controller = controller
+        self.target = None
+
+    def run_step(self):
+        return self._vehicle_controller.run_step(30.0, self.target)
+
+
+class FakeAgent(object):
+    def __init__(self, vehicle, bank, world_state):
+        self._vehicle = vehicle
+        self._local_planner = FakeLocalPlanner(
+            VehiclePIDController(vehicle, LATERAL, LONGITUDINAL, bank=bank, world_state=world_state))
+
+    def get_local_planner(self):
+        return self._local_planner
+
+    def run_step(self):
+        return self._local_planner.run_step()
+
+
+class FakeResponse(object):
+    error = ''
+
+    def has_error(self):
+        return False
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.batches = []
+
+    def apply_batch_sync(self, batch):
+        self.batches.append(batch)
+        return [FakeResponse() for _ in batch]
+
+
+class TestMultiAgentRunner(ControlTestCase):
+    def test_runner_matches_reference(self):
+        for workers in (0, 3):
+            rng = random.Random(3)
+            world = FakeWorld()
+            client = FakeClient()
+            WorldStateCache.clear()
+            runner = MultiAgentRunner(client, world, workers=workers, cell_size=20.0)
+            references = {}
+            for actor_id in range(1, 13):
+                vehicle = world.spawn(actor_id)
+                runner.add_agent(FakeAgent(vehicle, runner.controller_bank, WorldStateCache.get(world)))
+                references[actor_id] = ReferencePIDController()
+            self.assertRaises(ValueError, runner.add_agent,
+                              FakeAgent(world.spawn(20), VehiclePIDControllerBank(), WorldStateCache.get(world)))
+            del world.vehicles[20]
+
+            # The controls of all the agents are computed in a single step of the bank
+            computed = []
+            compute = runner.controller_bank.compute
+            runner.controller_bank.compute = lambda slots, *args: computed.append(len(slots)) or compute(slots, *args)
+
+            for _ in range(10):
+                targets = move_vehicles(rng, world)
+                for agent in runner.agents:
+                    agent.get_local_planner().target = targets[agent._vehicle.id]
+                controls = runner.run_step()
+                self.assertEqual(computed, [12])
+                del computed[:]
+
+                batch = client.batches[-1]
+                self.assertEqual(sorted(command.actor_id for command in batch), list(range(1, 13)))
+                for command in batch:
+                    vehicle = world.vehicles[command.actor_id]
+                    expected = references[command.actor_id].run_step(
+                        30.0, speed(vehicle), vehicle.transform, targets[command.actor_id].transform)
+                    self.assertIs(command.control, controls[command.actor_id])
+                    self.assertControlEqual(command.control, expected)
+            runner.close()
+        WorldStateCache.clear()
@@ -0,0 +1,101 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import carla
+
+import math
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+from shapely.geometry import MultiPoint, Polygon
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.tools.geometry import box_vertices, convex_polygons_intersect, corridor_polygons
+
+
+def random_box(rng, center_range=20.0):
+    x, y = rng.uniform(-center_range, center_range), rng.uniform(-center_range, center_range)
+    yaw = math.radians(rng.uniform(-180, 180))
+    extent_x, extent_y = rng.uniform(0.3, 3.0), rng.uniform(0.3, 1.5)
+    corners = []
+    for sx, sy in [(-1, -1), (-1, 1), (1, 1), (1, -1)]:
+        corners.append([
+            x + sx * extent_x * math.cos(yaw) - sy * extent_y * math.sin(yaw),
+            y + sx * extent_x * math.sin(yaw) + sy * extent_y * math.cos(yaw)])
+    return corners
+
+
+def random_corridor(rng, points=15):
+    x, y = rng.uniform(-20, 20), rng.uniform(-20, 20)
+    yaw = rng.uniform(-math.pi, math.pi)
+    width = rng.uniform(0.8, 1.5)
+    left, right = [], []
+    for _ in range(points):
+        left.append([x - width * math.sin(yaw), y + width * math.cos(yaw)])
+        right.append([x + width * math.sin(yaw), y - width * math.cos(yaw)])
+        yaw += rng.uniform(-0.15, 0.15)
+        x += 2.0 * math.cos(yaw)
+        y += 2.0 * math.sin(yaw)
+    return left, right
+
+
+class TestConvexPolygonsIntersect(unittest.TestCase):
+    def test_boxes_match_shapely(self):
+        rng = random.Random(0)
+        boxes_a = [random_box(rng) for _ in range(40)]
+        boxes_b = [random_box(rng) for _ in range(40)]
+        result = convex_polygons_intersect(boxes_a, boxes_b)
+        for i, box_a in enumerate(boxes_a):
+            for j, box_b in enumerate(boxes_b):
+                expected = Polygon(box_a).intersects(Polygon(box_b))
+                self.assertEqual(result[i, j], expected)
+
+    def test_hulls_match_shapely(self):
+        rng = random.Random(1)
+        points_a = [[[rng.uniform(-5, 5), rng.uniform(-5, 5)] for _ in range(6)] for _ in range(30)]
+        points_b = [[[rng.uniform(-5, 5) + 6, rng.uniform(-5, 5)] for _ in range(8)] for _ in range(30)]
+        result = convex_polygons_intersect(points_a, points_b)
+        for i, hull_a in enumerate(points_a):
+            for j, hull_b in enumerate(points_b):
+                expected = MultiPoint(hull_a).convex_hull.intersects(MultiPoint(hull_b).convex_hull)
+                self.assertEqual(result[i, j], expected)
+
+    def test_corridor_matches_shapely(self):
+        rng = random.Random(2)
+        for _ in range(50):
+            left, right = random_corridor(rng)
+            corridor = Polygon(left + right[::-1])
+            boxes = [random_box(rng, 30.0) for _ in range(30)]
+            result = np.any(convex_polygons_intersect(corridor_polygons(left, right), boxes), axis=0)
+            for box, overlap in zip(boxes, result):
+                self.assertEqual(overlap, corridor.intersects(Polygon(box)))
+
+    def test_empty(self):
+        self.assertEqual(convex_polygons_intersect(np.zeros((0, 4, 2)), [random_box(random.Random())]).shape, (0, 1))
+
+
+class TestBoxVertices(unittest.TestCase):
+    def test_world_vertices(self):
+        rng = random.Random(3)
+        for _ in range(20):
+            transform = carla.Transform(
+                carla.Location(rng.uniform(-50, 50), rng.uniform(-50, 50), rng.uniform(0, 5)),
+                carla.Rotation(rng.uniform(-10, 10), rng.uniform(-180, 180), rng.uniform(-10, 10)))
+            bounding_box = carla.BoundingBox(
+                carla.Location(rng.uniform(-1, 1), 0.0, rng.uniform(0, 1)),
+                carla.Vector3D(rng.uniform(1, 3), rng.uniform(0.5, 1.5), rng.uniform(0.5, 1.0)))
+            expected = [[v.x, v.y, v.z] for v in bounding_box.get_world_vertices(transform)]
+
+            vertices = box_vertices(
+                [[transform.location.x, transform.location.y, transform.location.z,
+                  transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll]],
+                [[bounding_box.location.x, bounding_box.location.y, bounding_box.location.z]],
+                [[bounding_box.extent.x, bounding_box.extent.y, bounding_box.extent.z]])
+            np.testing.assert_allclose(vertices[0], expected, atol=1e-3)
@@ -0,0 +1,132 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import math
+import os
+import random
+import sys
+import unittest
+
+import networkx as nx
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.navigation.incremental_planner import DStarLite, MIN_WEIGHT
+from agents.navigation.route_graph import RouteGraph
+
+
+def random_lane_graph(rng, size=7, spacing=10.0):
+    """Grid of two way roads with two lanes per direction, joined by zero cost lane changes"""
+    graph = nx.DiGraph()
+
+    def add_node(node, x, y):
+        graph.add_node(node, vertex=(x + rng.uniform(-1.0, 1.0), y + rng.uniform(-1.0, 1.0), 0.0))
+
+    for i in range(size):
+        for j in range(size):
+            for lane in range(2):
+                add_node((i, j, lane), i * spacing, j * spacing + lane * 3.0)
+
+    def distance(n1, n2):
+        return math.sqrt(sum((a - b) ** 2 for a, b in zip(graph.nodes[n1]['vertex'], graph.nodes[n2]['vertex'])))
+
+    for i in range(size):
+        for j in range(size):
+            for di, dj in ((1, 0), (0, 1)):
+                if i + di >= size or j + dj >= size:
+                    continue
+                for lane in range(2):
+                    n1, n2 = (i, j, lane), (i + di, j + dj, lane)
+                    graph.add_edge(n1, n2, length=distance(n1, n2) * rng.uniform(1.0, 1.2))
+                    graph.add_edge(n2, n1, length=distance(n1, n2) * rng.uniform(1.0, 1.2))
+            graph.add_edge((i, j, 0), (i, j, 1), length=0.0)
+            graph.add_edge((i, j, 1), (i, j, 0), length=0.0)
+
+    return nx.convert_node_labels_to_integers(graph, label_attribute='key')
+
+
+def reference_length(graph, source, target):
+    """Dijkstra's distance with the current weights, where infinite weights block the edges"""
+    def weight(_n1, _n2, edge):
+        if edge['length'] == float('inf'):
+            return None
+        return max(edge['length'], MIN_WEIGHT)
+    return nx.dijkstra_path_length(graph, source, target, weight=weight)
+
+
+class TestDStarLite(unittest.TestCase):
+    def check_path(self, graph, planner, source, target):
+        try:
+            expected = reference_length(graph, source, target)
+        except nx.NetworkXNoPath:
+            self.assertRaises(nx.NetworkXNoPath, planner.search)
+            return None
+        path = planner.search()
+        self.assertEqual((path[0], path[-1]), (source, target))
+        lengths = [graph[n1][n2]['length'] for n1, n2 in zip(path[:-1], path[1:])]
+        self.assertNotIn(float('inf'), lengths)
+        self.assertAlmostEqual(sum(max(length, MIN_WEIGHT) for length in lengths), expected, places=6)
+        return path
+
+    def run_random_changes(self, seed, landmarks):
+        rng = random.Random(seed)
+        graph = random_lane_graph(rng)
+        route_graph = RouteGraph(graph)
+        if landmarks:
+            route_graph.set_landmarks(*route_graph.compute_landmarks(4))
+        edges = list(graph.edges)
+        lengths = {(n1, n2): length for n1, n2, length in graph.edges(data='length')}
+        nodes = list(graph.nodes)
+
+        for _ in range(5):
+            source, target = rng.choice(nodes), rng.choice(nodes)
+            planner = DStarLite(route_graph, source, target)
+            for _ in range(15):
+                path = self.check_path(graph, planner, source, target)
+
+                # Change the weights of some edges, most of them around the current route
+                changed = rng.sample(edges, 3)
+                if path is not None and len(path) > 1:
+                    changed += [(path[k], path[k + 1]) for k in rng.sample(range(len(path) - 1), 1)]
+                for n1, n2 in changed:
+                    choice = rng.random()
+                    if choice < 0.3:
+                        length = float('inf')
+                    elif choice < 0.6 or landmarks:
+                        # The landmarks are only valid while no weight is below the one they were computed with
+                        length = lengths[n1, n2] * rng.uniform(1.0, 3.0)
+                    else:
+                        length = lengths[n1, n2] * rng.uniform(0.5, 1.0)
+                    graph[n1][n2]['length'] = length
+                    route_graph.set_weight(n1, n2, length)
+                    planner.update_edge(n1, n2)
+                self.assertEqual(route_graph.landmarks is not None, landmarks)
+
+                # Move the origin along the route, as a vehicle following it
+                if path is not None and len(path) > 2 and rng.random() < 0.5:
+                    source = path[rng.randint(1, len(path) - 2)]
+                    planner.set_source(source)
+            self.check_path(graph, planner, source, target)
+
+    def test_matches_dijkstra(self):
+        for seed in range(4):
+            self.run_random_changes(seed, landmarks=False)
+
+    def test_matches_dijkstra_with_landmarks(self):
+        for seed in range(4):
+            self.run_random_changes(seed, landmarks=True)
+
+    def test_prefers_fewer_lane_changes(self):
+        graph = random_lane_graph(random.Random(5), size=3)
+        keys = {key: node for node, key in graph.nodes(data='key')}
+        for node in graph.nodes:
+            for neighbor in graph.successors(node):
+                if graph[node][neighbor]['length'] > 0.0:
+                    graph[node][neighbor]['length'] = 10.0
+        planner = DStarLite(RouteGraph(graph), keys[(0, 0, 0)], keys[(2, 0, 1)])
+        path = planner.search()
+        self.assertEqual(len(path), 4)
+        self.assertEqual(sum(graph[n1][n2]['length'] == 0.0 for n1, n2 in zip(path[:-1], path[1:])), 1)
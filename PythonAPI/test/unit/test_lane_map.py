@@ -0,0 +1,145 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import carla
+
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.navigation.lane_map import LaneMap
+
+
+class FakeWaypoint(object):
+    def __init__(self, road_id, lane_id, s, x, y, yaw):
+        self.road_id = road_id
+        self.section_id = 0
+        self.lane_id = lane_id
+        self.s = s
+        self.lane_width = 3.5
+        self.lane_type = carla.LaneType.Driving
+        self.is_junction = False
+        self.transform = carla.Transform(carla.Location(x, y, 0.0), carla.Rotation(0.0, yaw, 0.0))
+
+
+class FakeMap(object):
+    """
+    Straight road 1 along x, from 0 to 100, with two lanes per direction. Its lane -1 continues
+    into the single lane of road 2, a quarter of a circle turning right
+    """
+
+    RADIUS = 50.0
+
+    def __init__(self):
+        self.lanes = {}  # (road_id, lane_id) -> list of (s, x, y, yaw), in driving order
+        for lane_id, y in ((-1, 1.75), (-2, 5.25), (1, -1.75), (2, -5.25)):
+            points = [(s, s, y, 0.0 if lane_id < 0 else 180.0) for s in np.arange(0.0, 100.5, 1.0)]
+            self.lanes[1, lane_id] = points if lane_id < 0 else points[::-1]
+        center_x, center_y = 100.0, 1.75 + self.RADIUS
+        self.lanes[2, -1] = [
+            (s, center_x + self.RADIUS * math.sin(s / self.RADIUS), center_y - self.RADIUS * math.cos(s / self.RADIUS),
+             math.degrees(s / self.RADIUS)) for s in np.linspace(0.0, self.RADIUS * math.pi / 2.0, 80)]
+
+    def waypoints(self, key):
+        return [FakeWaypoint(key[0], key[1], s, x, y, yaw) for s, x, y, yaw in self.lanes[key]]
+
+    def generate_waypoints(self, _resolution):
+        return [waypoint for key in self.lanes for waypoint in self.waypoints(key)[:-1]]
+
+    def get_topology(self):
+        return [(self.waypoints(key)[0], self.waypoints(key)[-1]) for key in self.lanes]
+
+    def polylines(self):
+        """Centerline of each lane as (key, (n, 2) array of x, y, (n,) array of s)"""
+        return [(key, np.array([(x, y) for _, x, y, _ in points]), np.array([s for s, _, _, _ in points]))
+                for key, points in self.lanes.items()]
+
+
+def brute_force_projection(wmap, point):
+    """Closest point of the centerlines, as (distance, (road_id, lane_id), s)"""
+    best = (float('inf'), None, None)
+    for key, xy, s in wmap.polylines():
+        a, b = xy[:-1], xy[1:]
+        ab = b - a
+        t = np.clip(np.einsum('ij,ij->i', point - a, ab) / np.einsum('ij,ij->i', ab, ab), 0.0, 1.0)
+        distances = np.linalg.norm(a + t[:, np.newaxis] * ab - point, axis=1)
+        i = int(np.argmin(distances))
+        if distances[i] < best[0]:
+            best = (distances[i], key, s[i] + t[i] * (s[i + 1] - s[i]))
+    return best
+
+
+class TestLaneMap(unittest.TestCase):
+    def setUp(self):
+        self.map = FakeMap()
+        self.lane_map = LaneMap(LaneMap._sample(self.map, 1.0), cell_size=10.0, search_radius=5.0)
+        self.rows = {(road_id, lane_id): lane for lane, (road_id, _, lane_id)
+                     in enumerate(self.lane_map.lane_keys(np.arange(len(self.lane_map))).tolist())}
+
+    def test_project_matches_brute_force(self):
+        rng = random.Random(0)
+        # Points close to the lanes, answered by the grid, and far ones, answered by the full search
+        points = [(rng.uniform(-10.0, 160.0), rng.uniform(-20.0, 60.0), 0.0) for _ in range(300)]
+        points += [(rng.uniform(-500.0, 500.0), rng.uniform(-500.0, 500.0), 0.0) for _ in range(50)]
+        projections = self.lane_map.project(points)
+
+        for point, projection in zip(points, projections):
+            distance, key, s = brute_force_projection(self.map, np.array(point[:2]))
+            self.assertAlmostEqual(projection['distance'], distance, places=6)
+            if (projection['road_id'], projection['lane_id']) == key:
+                self.assertAlmostEqual(projection['s'], s, places=6)
+
+        # The offset is positive to the right of the driving direction, which is +y along +x
+        projection = self.lane_map.project([carla.Location(50.0, 3.0, 0.0), carla.Location(50.0, -3.0, 0.0)])
+        self.assertEqual([(road_id, lane_id) for road_id, lane_id in projection[['road_id', 'lane_id']].tolist()],
+                         [(1, -1), (1, 1)])
+        np.testing.assert_allclose(projection['offset'], [1.25, 1.25])
+        np.testing.assert_allclose(projection['s'], [50.0, 50.0])
+
+    def test_locate(self):
+        lanes = [self.rows[1, -1], self.rows[1, 1], self.rows[2, -1]]
+        s = [20.5, 20.5, self.map.RADIUS * math.pi / 4.0]
+        locations, yaws = self.lane_map.locate(lanes, s)
+        np.testing.assert_allclose(locations[:2, :2], [[20.5, 1.75], [20.5, -1.75]])
+        self.assertAlmostEqual(np.linalg.norm(locations[2, :2] - (100.0, 1.75 + self.map.RADIUS)),
+                               self.map.RADIUS, places=1)
+        np.testing.assert_allclose((yaws - [0.0, 180.0, 45.0] + 180.0) % 360.0 - 180.0, 0.0, atol=1.5)
+
+    def test_advance(self):
+        lanes = [self.rows[1, -1], self.rows[1, -1], self.rows[1, 1], self.rows[1, -2]]
+        lanes, s, ended = self.lane_map.advance(lanes, [10.0, 90.0, 10.0, 95.0], [5.0, 20.0, 30.0, 10.0])
+        self.assertEqual([tuple(key) for key in self.lane_map.lane_keys(lanes)[:, [0, 2]].tolist()],
+                         [(1, -1), (2, -1), (1, 1), (1, -2)])
+        np.testing.assert_allclose(s, [15.0, 10.0, 0.0, 100.0])
+        self.assertEqual(ended.tolist(), [False, False, True, True])
+        self.assertEqual(self.lane_map.successors(self.rows[1, -1]).tolist(), [self.rows[2, -1]])
+
+    def test_neighbours(self):
+        lanes = [self.rows[1, -1], self.rows[1, -2], self.rows[1, 1], self.rows[2, -1]]
+        self.assertEqual(self.lane_map.left(lanes).tolist(), [self.rows[1, 1], self.rows[1, -1], self.rows[1, -1], -1])
+        self.assertEqual(self.lane_map.right(lanes).tolist(), [self.rows[1, -2], -1, self.rows[1, 2], -1])
+        np.testing.assert_allclose(self.lane_map.lane_width(lanes, [1.0] * 4), [3.5] * 4)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'lanes.npz')
+            self.lane_map.save(path)
+            loaded = LaneMap.load(path)
+            for name, array in self.lane_map.to_arrays().items():
+                np.testing.assert_array_equal(loaded.to_arrays()[name], array)
+            points = np.random.RandomState(0).uniform(-10.0, 150.0, (100, 3))
+            np.testing.assert_array_equal(loaded.project(points), self.lane_map.project(points))
+        finally:
+            shutil.rmtree(directory)
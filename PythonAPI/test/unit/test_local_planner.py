@@ -0,0 +1,394 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import carla
+
+import math
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.navigation.local_planner import (
+    ROUTE_DTYPE, LocalPlanner, RoadOption, RouteArray, SpeedProfile, WaypointQueue, _retrieve_options)
+from agents.tools.world_state import WorldStateCache
+
+
+class StubLane(object):
+    """Lane of a StubMap, a line or an arc of a circle starting at (x, y) with the given yaw"""
+
+    def __init__(self, road_id, lane_id, x, y, yaw, length, curvature=0.0):
+        self.road_id = road_id
+        self.lane_id = lane_id
+        self.origin = (x, y, math.radians(yaw))
+        self.length = length
+        self.curvature = curvature
+        self.successors = []
+
+    def transform(self, s):
+        x, y, yaw = self.origin
+        if self.curvature == 0.0:
+            x, y = x + s * math.cos(yaw), y + s * math.sin(yaw)
+        else:
+            radius = 1.0 / self.curvature
+            x += radius * (math.sin(yaw + s * self.curvature) - math.sin(yaw))
+            y -= radius * (math.cos(yaw + s * self.curvature) - math.cos(yaw))
+            yaw += s * self.curvature
+        return carla.Transform(carla.Location(x, y, 0.0), carla.Rotation(0.0, math.degrees(yaw), 0.0))
+
+
+class StubWaypoint(object):
+    """Waypoint of a StubMap, only with the 'next' query of the LocalPlanner"""
+
+    def __init__(self, lane, s):
+        self.lane = lane
+        self.road_id = lane.road_id
+        self.lane_id = lane.lane_id
+        self.s = s
+        self.transform = lane.transform(s)
+
+    def next(self, distance):
+        s = self.s + distance
+        if s <= self.lane.length + 1e-9:
+            return [StubWaypoint(self.lane, min(s, self.lane.length))]
+        remaining = s - self.lane.length
+        waypoints = []
+        for successor in self.lane.successors:
+            waypoints.extend(StubWaypoint(successor, 0.0).next(remaining))
+        return waypoints
+
+
+class StubMap(object):
+    """
+    Road 1 has two lanes along x. Its lane -1 forks into road 2, which goes straight, and road 3, which
+    turns left and ends. Its lane -2 is dropped at x = 31, without successors
+    """
+
+    def __init__(self):
+        main = StubLane(1, -1, 0.0, 0.0, 0.0, 50.0)
+        dropped = StubLane(1, -2, 0.0, 3.5, 0.0, 31.0)
+        straight = StubLane(2, -1, 50.0, 0.0, 0.0, 200.0)
+        left = StubLane(3, -1, 50.0, 0.0, 0.0, 4.0 * math.pi / 2.0, curvature=-1.0 / 4.0)
+        main.successors = [straight, left]
+        self.lanes = [main, dropped, straight, left]
+
+    def get_waypoint(self, location):
+        candidates = [StubWaypoint(lane, s * 0.5) for lane in self.lanes for s in range(int(lane.length / 0.5) + 1)]
+        return min(candidates, key=lambda waypoint: waypoint.transform.location.distance(location))
+
+
+class FakeVehicle(object):
+    def __init__(self, world, location):
+        self.id = 1
+        self._world = world
+        self._location = location
+
+    def get_world(self):
+        return self._world
+
+    def get_location(self):
+        return self._location
+
+    def get_control(self):
+        return carla.VehicleControl()
+
+
+class FakeWorld(object):
+    def __init__(self, wmap):
+        self.id = 1
+        self._map = wmap
+
+    def get_map(self):
+        return self._map
+
+
+def reference_next_waypoints(start, k, sampling_radius):
+    """The waypoints added by '_compute_next_waypoints', one 'next' query at a time as before the ring buffer"""
+    plan = [(start, RoadOption.LANEFOLLOW)]
+    for _ in range(k):
+        last_waypoint = plan[-1][0]
+        next_waypoints = list(last_waypoint.next(sampling_radius))
+        if len(next_waypoints) == 0:
+            break
+        elif len(next_waypoints) == 1:
+            next_waypoint = next_waypoints[0]
+            road_option = RoadOption.LANEFOLLOW
+        else:
+            road_options_list = _retrieve_options(next_waypoints, last_waypoint)
+            road_option = random.choice(road_options_list)
+            next_waypoint = next_waypoints[road_options_list.index(road_option)]
+        plan.append((next_waypoint, road_option))
+    return plan
+
+
+def signature(plan):
+    return [(waypoint.road_id, waypoint.lane_id, round(waypoint.s, 6), road_option) for waypoint, road_option in plan]
+
+
+class TestLocalPlannerWaypoints(unittest.TestCase):
+    def setUp(self):
+        self.map = StubMap()
+        self.world = FakeWorld(self.map)
+
+    def tearDown(self):
+        WorldStateCache.clear()
+
+    def planner(self, location):
+        return LocalPlanner(FakeVehicle(self.world, location), {'sampling_radius': 2.0})
+
+    def test_dead_end_lane(self):
+        planner = self.planner(carla.Location(0.0, 3.5, 0.0))
+        planner._compute_next_waypoints(k=100)
+        plan = list(planner.get_plan())
+        self.assertEqual([waypoint.s for waypoint, _ in plan], [float(s) for s in range(0, 31, 2)])
+        self.assertEqual(set((waypoint.road_id, waypoint.lane_id) for waypoint, _ in plan), {(1, -2)})
+
+        # The end of the lane is reached, so no more waypoints are added
+        planner._compute_next_waypoints(k=100)
+        self.assertEqual(len(planner.get_plan()), len(plan))
+
+    def test_matches_reference(self):
+        for seed in range(20):
+            location = carla.Location(random.Random(seed).uniform(0.0, 50.0), 0.0, 0.0)
+            random.seed(seed)
+            planner = self.planner(location)
+            planner._compute_next_waypoints(k=30)
+            planner._compute_next_waypoints(k=70)
+
+            random.seed(seed)
+            reference = reference_next_waypoints(self.map.get_waypoint(location), 100, 2.0)
+            self.assertEqual(signature(planner.get_plan()), signature(reference))
+
+
+class PointWaypoint(object):
+    def __init__(self, x, y, road_id=1):
+        self.road_id = road_id
+        self.section_id = 0
+        self.lane_id = -1
+        self.s = x
+        self.transform = carla.Transform(carla.Location(x, y, 0.0), carla.Rotation())
+
+
+class RouteMap(object):
+    """Map of the rows of a RouteArray, counting the waypoints retrieved"""
+
+    def __init__(self):
+        self.queries = []
+
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        self.queries.append((road_id, lane_id, s))
+        return None if s < 0.0 else PointWaypoint(s, 0.0, road_id)
+
+    def get_waypoint(self, location):
+        self.queries.append(location)
+        return PointWaypoint(location.x, location.y)
+
+
+def random_route(rng, wmap, size):
+    data = np.zeros(size, dtype=ROUTE_DTYPE)
+    data['x'] = np.cumsum(rng.uniform(0.5, 3.0, size))
+    data['y'] = rng.uniform(-1.0, 1.0, size)
+    data['road_id'] = rng.randint(1, 4, size)
+    data['lane_id'] = -1
+    data['s'] = data['x']
+    data['option'] = [option.value for option in rng.choice(list(RoadOption)[1:], size)]
+    return RouteArray(data, wmap)
+
+
+def entry_location(entry):
+    location = entry[0].transform.location
+    return location.x, location.y, location.z
+
+
+class TestRouteArray(unittest.TestCase):
+    def test_waypoints_are_retrieved_once(self):
+        rng = np.random.RandomState(0)
+        wmap = RouteMap()
+        route = random_route(rng, wmap, 50)
+        self.assertEqual(len(route), 50)
+        np.testing.assert_array_equal(route.locations()[:, 0], route.data['x'])
+
+        waypoint, road_option = route[10]
+        self.assertEqual(road_option, RoadOption(int(route.data['option'][10])))
+        self.assertAlmostEqual(waypoint.transform.location.x, route.data['x'][10])
+        self.assertIs(route[10][0], waypoint)
+        self.assertIs(route[-40][0], waypoint)
+        self.assertEqual(len(wmap.queries), 1)
+
+        # Slices and chunks keep the waypoints already retrieved
+        self.assertIs(route[5:15][5][0], waypoint)
+        chunks = list(route.chunks(16))
+        self.assertEqual([len(chunk) for chunk in chunks], [16, 16, 16, 2])
+        self.assertIs(chunks[0][10][0], waypoint)
+        np.testing.assert_array_equal(np.concatenate([chunk.data for chunk in chunks]), route.data)
+        self.assertEqual(len(wmap.queries), 1)
+
+        self.assertEqual([entry_location(entry)[0] for entry in route.materialize()], route.data['x'].tolist())
+        self.assertEqual(len(wmap.queries), 50)
+
+        # Rows without a waypoint at their s are projected instead
+        route.data['s'][20] = -1.0
+        route._waypoints.pop(20)
+        self.assertEqual(entry_location(route[20])[:2], (route.data['x'][20], route.data['y'][20]))
+
+    def test_from_route(self):
+        wmap = RouteMap()
+        plan = [(PointWaypoint(float(i), 0.0), RoadOption.LANEFOLLOW) for i in range(10)]
+        route = RouteArray.from_route(plan, wmap)
+        self.assertEqual(list(route), plan)
+        self.assertEqual(wmap.queries, [])
+
+    def test_local_planner_queue(self):
+        rng = np.random.RandomState(1)
+        wmap = RouteMap()
+        route = random_route(rng, wmap, 300)
+        queue = WaypointQueue(maxlen=200)
+        queue.extend_route(route)
+
+        # The queue keeps the last rows, without retrieving their waypoints until they are accessed
+        self.assertEqual(len(queue), 200)
+        np.testing.assert_array_equal(queue.locations(), route.locations()[100:])
+        np.testing.assert_array_equal(queue.road_ids(), route.data['road_id'][100:])
+        self.assertEqual(queue.purge(carla.Location(*route.location(100)), 0.1), 1)
+        self.assertEqual(wmap.queries, [])
+
+        self.assertEqual(queue[0], route[101])
+        self.assertEqual(queue[-1], route[299])
+        self.assertEqual(len(wmap.queries), 2)
+
+
+class TestWaypointQueue(unittest.TestCase):
+    def test_matches_list(self):
+        rng = np.random.RandomState(2)
+        wmap = RouteMap()
+        queue = WaypointQueue(maxlen=37)
+        model = []  # (location, option, arc length) of the entries
+
+        def add(items):
+            items = items[-queue.maxlen:]
+            if len(items) == queue.maxlen:
+                # Nothing of the previous entries is left, the arc length starts again
+                del model[:]
+            for location, road_option in items:
+                previous, arc = (model[-1][0], model[-1][2]) if model else (location, 0.0)
+                model.append((location, road_option, arc + np.linalg.norm(np.subtract(location, previous))))
+            del model[:-queue.maxlen]
+
+        for step in range(500):
+            operation = rng.randint(6)
+            if operation == 0:
+                plan = [(PointWaypoint(*rng.uniform(-20.0, 20.0, 2)), RoadOption.LANEFOLLOW)
+                        for _ in range(rng.randint(1, 50))]
+                queue.extend(plan)
+                add([(entry_location(entry), entry[1]) for entry in plan])
+            elif operation == 1:
+                route = random_route(rng, wmap, rng.randint(1, 50))
+                queue.extend_route(route)
+                add([(tuple(location), route.road_option(i)) for i, location in enumerate(route.locations().tolist())])
+            elif operation == 2 and model:
+                count = rng.randint(0, len(model) + 2)
+                queue.discard(count)
+                del model[:count]
+            elif operation == 3 and model:
+                center = np.array(model[min(rng.randint(0, 5), len(model) - 1)][0]) + rng.uniform(-1.0, 1.0, 3)
+                min_distance = rng.uniform(0.5, 20.0)
+                count = 0
+                for i, (location, _, _) in enumerate(model):
+                    threshold = 1.0 if i == len(model) - 1 else min_distance
+                    if np.linalg.norm(np.array(location) - center) >= threshold:
+                        break
+                    count += 1
+                self.assertEqual(queue.purge(carla.Location(*center), min_distance, last_min_distance=1.0), count)
+                del model[:count]
+            elif operation == 4:
+                queue.resize(rng.randint(20, 60))
+                del model[:max(len(model) - queue.maxlen, 0)]
+            elif operation == 5 and step % 50 == 0:
+                queue.clear()
+                del model[:]
+
+            self.assertEqual(len(queue), len(model))
+            self.assertEqual([entry_location(entry)[0] for entry in queue], [location[0] for location, _, _ in model])
+            self.assertEqual([entry[1] for entry in queue], [road_option for _, road_option, _ in model])
+            if model:
+                np.testing.assert_allclose(queue.locations(), [location for location, _, _ in model])
+                np.testing.assert_allclose([queue.distance(i) for i in range(len(model))],
+                                           [arc - model[0][2] for _, _, arc in model], atol=1e-9)
+                index = rng.randint(len(model))
+                self.assertEqual(queue.location(index), model[index][0])
+                self.assertEqual(queue[index - len(model)][1], model[index][1])
+                self.assertRaises(IndexError, queue.__getitem__, len(model))
+
+                distance = rng.uniform(0.0, model[-1][2] - model[0][2] + 5.0)
+                expected = next((i for i, (_, _, arc) in enumerate(model) if arc - model[0][2] >= distance - 1e-9),
+                                len(model) - 1)
+                self.assertEqual(queue.index_at_distance(distance), expected)
+        self.assertLessEqual(queue._capacity, 60)
+
+
+def curved_plan(size):
+    """Points every meter of a path with straights, curves of several radii and a hairpin"""
+    points = []
+    x, y, yaw = 0.0, 0.0, 0.0
+    for i in range(size):
+        points.append((x, y, 0.0))
+        curvature = [0.0, 1.0 / 30.0, 0.0, -1.0 / 80.0, 0.0, 1.0 / 10.0][(i // 40) % 6]
+        yaw += curvature
+        x, y = x + math.cos(yaw), y + math.sin(yaw)
+    return [PointWaypoint(x, y) for x, y, _ in points]
+
+
+class TestSpeedProfile(unittest.TestCase):
+    def full_profile(self, profile, locations, limits):
+        locations = np.asarray(locations)
+        arc = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(locations, axis=0), axis=1))])
+        return profile.passes(arc, np.minimum(limits, profile.curve_speeds(locations)))
+
+    def test_chunks_match_full_profile(self):
+        rng = np.random.RandomState(3)
+        plan = curved_plan(600)
+        limits = np.repeat(rng.choice([30.0, 50.0, 90.0, np.inf], 12), 50)
+        for profile in (SpeedProfile(), SpeedProfile(max_deceleration=1.0, max_speed=60.0)):
+            queue = WaypointQueue(maxlen=10000)
+            start = 0
+            while start < len(plan):
+                stop = start + rng.randint(1, 60)
+                queue.extend([(waypoint, RoadOption.LANEFOLLOW) for waypoint in plan[start:stop]])
+                self.assertEqual(queue.unprofiled, len(plan[start:stop]))
+                profile.update(queue, limits[start:stop])
+                self.assertEqual(queue.unprofiled, 0)
+                start = stop
+
+                np.testing.assert_allclose(queue.speed_limits(), limits[:len(queue)])
+                np.testing.assert_allclose(queue.speeds(), self.full_profile(
+                    profile, queue.locations(), limits[:len(queue)]), rtol=1e-9, atol=1e-6)
+
+    def test_purged_queue_matches_full_profile(self):
+        rng = np.random.RandomState(4)
+        plan = curved_plan(600)
+        limits = np.repeat(rng.choice([30.0, 50.0, 90.0, np.inf], 12), 50)
+        profile = SpeedProfile()
+        queue = WaypointQueue(maxlen=10000)
+        start = 0
+        removed = 0
+        while start < len(plan):
+            stop = start + rng.randint(1, 60)
+            queue.extend([(waypoint, RoadOption.LANEFOLLOW) for waypoint in plan[start:stop]])
+            profile.update(queue, limits[start:stop])
+            start = stop
+
+            # The speeds of the entries that are left don't change when the first ones are reached
+            full = self.full_profile(profile, [entry_location((waypoint, None)) for waypoint in plan[:start]],
+                                     limits[:start])
+            np.testing.assert_allclose(queue.speeds(), full[removed:], rtol=1e-9, atol=1e-6)
+            # The last two entries are kept, as the curvature of the last one depends on its neighbours
+            count = rng.randint(0, len(queue) - 1) if len(queue) > 1 else 0
+            queue.discard(count)
+            removed += count
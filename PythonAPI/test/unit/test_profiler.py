@@ -0,0 +1,109 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import carla
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.tools.profiler import AgentProfiler, RPC_METHODS
+
+
+def stub_method(*args, **kwargs):
+    return args
+
+
+class TestAgentProfiler(unittest.TestCase):
+    def setUp(self):
+        # The client API methods need a server, so they are replaced by a stub during the tests
+        self.originals = {}
+        for class_name, method_name in RPC_METHODS:
+            carla_class = getattr(carla, class_name)
+            self.originals[(class_name, method_name)] = getattr(carla_class, method_name)
+            setattr(carla_class, method_name, stub_method)
+
+    def tearDown(self):
+        for (class_name, method_name), original in self.originals.items():
+            setattr(getattr(carla, class_name), method_name, original)
+        AgentProfiler._instrumenting = None
+        AgentProfiler._originals = {}
+
+    def methods(self):
+        return [getattr(getattr(carla, class_name), method_name) for class_name, method_name in RPC_METHODS]
+
+    def test_enable_and_disable(self):
+        profiler = AgentProfiler()
+        self.assertEqual(self.methods(), [stub_method] * len(RPC_METHODS))
+
+        profiler.enable()
+        self.assertTrue(all(method is not stub_method for method in self.methods()))
+        profiler.disable()
+        self.assertEqual(self.methods(), [stub_method] * len(RPC_METHODS))
+        self.assertIsNone(AgentProfiler._instrumenting)
+
+        # Without rpcs, the client API isn't touched
+        profiler = AgentProfiler(enabled=True, rpcs=False)
+        self.assertEqual(self.methods(), [stub_method] * len(RPC_METHODS))
+        profiler.disable()
+
+    def test_second_profiler(self):
+        first = AgentProfiler(enabled=True)
+        wrappers = self.methods()
+
+        with self.assertLogs(level='WARNING'):
+            second = AgentProfiler(enabled=True)
+        self.assertEqual(self.methods(), wrappers)
+        second.disable()
+        self.assertEqual(self.methods(), wrappers)
+
+        carla.Map.get_waypoint(None, carla.Location())
+        self.assertEqual(first.summary()['rpcs']['get_waypoint']['count'], 1)
+        self.assertEqual(second.summary()['rpcs'], {})
+
+        first.disable()
+        self.assertEqual(self.methods(), [stub_method] * len(RPC_METHODS))
+
+    def test_summary(self):
+        profiler = AgentProfiler(enabled=True)
+        for _ in range(2):
+            with profiler.phase('outer'):
+                with profiler.phase('inner'):
+                    for _ in range(3):
+                        carla.Map.get_waypoint(None, carla.Location())
+                carla.World.get_actors(None)
+        profiler.disable()
+
+        # Nothing is recorded while disabled
+        with profiler.phase('outer'):
+            carla.World.get_actors(None)
+
+        summary = profiler.summary()
+        self.assertEqual({name: statistics['count'] for name, statistics in summary['phases'].items()},
+                         {'outer': 2, 'inner': 2})
+        self.assertEqual({name: statistics['count'] for name, statistics in summary['rpcs'].items()},
+                         {'get_waypoint': 6, 'get_actors': 2})
+        for statistics in list(summary['phases'].values()) + list(summary['rpcs'].values()):
+            self.assertEqual(sum(statistics['histogram']), statistics['count'])
+            self.assertEqual(len(statistics['histogram']), len(statistics['bins_ms']) + 1)
+        self.assertGreaterEqual(summary['phases']['outer']['total_ms'], summary['phases']['inner']['total_ms'])
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'profile.json')
+            profiler.dump_json(path)
+            with open(path, encoding='utf-8') as json_file:
+                self.assertEqual(json.load(json_file), summary)
+        finally:
+            shutil.rmtree(directory)
+
+        profiler.reset()
+        self.assertEqual(profiler.summary(), {'phases': {}, 'rpcs': {}})
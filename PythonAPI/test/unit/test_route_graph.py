@@ -0,0 +1,134 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import math
+import os
+import random
+import sys
+import unittest
+
+import networkx as nx
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.navigation.route_graph import RouteGraph
+
+
+def random_road_graph(rng, size=8, spacing=10.0, jitter=2.0, integer_lengths=False):
+    """Grid of jittered nodes linked by one or two way roads, like the GlobalRoutePlanner graph"""
+    graph = nx.DiGraph()
+    for i in range(size):
+        for j in range(size):
+            vertex = (i * spacing + rng.uniform(-jitter, jitter), j * spacing + rng.uniform(-jitter, jitter), 0.0)
+            graph.add_node(i * size + j, vertex=vertex)
+
+    def add_road(n1, n2):
+        chord = math.sqrt(sum((a - b) ** 2 for a, b in zip(graph.nodes[n1]['vertex'], graph.nodes[n2]['vertex'])))
+        # Roads are never shorter than the chord, which keeps the euclidean heuristic admissible
+        length = chord * rng.uniform(1.0, 1.3)
+        if integer_lengths:
+            length = float(math.ceil(length))
+        graph.add_edge(n1, n2, length=length)
+
+    for i in range(size):
+        for j in range(size):
+            node = i * size + j
+            for neighbor in ([node + 1] if j + 1 < size else []) + ([node + size] if i + 1 < size else []):
+                direction = rng.random()
+                if direction < 0.6:
+                    add_road(node, neighbor)
+                    add_road(neighbor, node)
+                elif direction < 0.8:
+                    add_road(node, neighbor)
+                elif direction < 0.95:
+                    add_road(neighbor, node)
+    return graph
+
+
+def networkx_astar(graph, source, target, weight='length'):
+    def heuristic(n1, n2):
+        return np.linalg.norm(np.array(graph.nodes[n1]['vertex']) - np.array(graph.nodes[n2]['vertex']))
+    return nx.astar_path(graph, source, target, heuristic=heuristic, weight=weight)
+
+
+def path_length(graph, path, weight='length'):
+    return sum(graph[n1][n2][weight] for n1, n2 in zip(path[:-1], path[1:]))
+
+
+def route_pairs(rng, graph, count):
+    nodes = list(graph.nodes)
+    pairs = []
+    while len(pairs) < count:
+        source, target = rng.choice(nodes), rng.choice(nodes)
+        if nx.has_path(graph, source, target):
+            pairs.append((source, target))
+    return pairs
+
+
+class TestRouteGraph(unittest.TestCase):
+    def test_astar_matches_networkx(self):
+        rng = random.Random(0)
+        for integer_lengths in (False, True):
+            for _ in range(5):
+                graph = random_road_graph(rng, integer_lengths=integer_lengths)
+                route_graph = RouteGraph(graph)
+                for source, target in route_pairs(rng, graph, 40):
+                    self.assertEqual(route_graph.astar(source, target), networkx_astar(graph, source, target))
+
+    def test_alt_and_dijkstra_are_shortest(self):
+        rng = random.Random(1)
+        graph = random_road_graph(rng, size=10)
+        route_graph = RouteGraph(graph)
+        route_graph.set_landmarks(*route_graph.compute_landmarks(4))
+        for source, target in route_pairs(rng, graph, 100):
+            expected = nx.shortest_path_length(graph, source, target, weight='length')
+            for path in (route_graph.alt(source, target), route_graph.dijkstra(source, target)):
+                self.assertEqual((path[0], path[-1]), (source, target))
+                self.assertAlmostEqual(path_length(graph, path), expected, places=6)
+
+    def test_landmark_bounds(self):
+        rng = random.Random(2)
+        graph = random_road_graph(rng)
+        route_graph = RouteGraph(graph)
+        route_graph.set_landmarks(*route_graph.compute_landmarks(3))
+        lengths = dict(nx.all_pairs_dijkstra_path_length(graph, weight='length'))
+        for source in graph.nodes:
+            for target, length in lengths[source].items():
+                bound = route_graph.lower_bound(route_graph.index(source), route_graph.index(target))
+                self.assertLessEqual(bound, length + 1e-9)
+
+    def test_set_weight(self):
+        rng = random.Random(3)
+        graph = random_road_graph(rng)
+        route_graph = RouteGraph(graph)
+        route_graph.set_landmarks(*route_graph.compute_landmarks(2))
+        for source, target in route_pairs(rng, graph, 20):
+            path = route_graph.astar(source, target)
+            if len(path) < 2:
+                continue
+            # Block the first edge of the route, as if it were closed
+            route_graph.set_weight(path[0], path[1], float('inf'))
+            weight = graph[path[0]][path[1]]['length']
+            graph.remove_edge(path[0], path[1])
+            if nx.has_path(graph, source, target):
+                self.assertEqual(route_graph.astar(source, target), networkx_astar(graph, source, target))
+            else:
+                self.assertRaises(nx.NetworkXNoPath, route_graph.astar, source, target)
+            graph.add_edge(path[0], path[1], length=weight)
+            route_graph.set_weight(path[0], path[1], weight)
+
+        # Decreasing a weight below the one used by the landmarks invalidates them
+        n1, n2 = next(iter(graph.edges))
+        route_graph.set_weight(n1, n2, 0.0)
+        self.assertIsNone(route_graph.landmarks)
+        self.assertRaises(KeyError, route_graph.set_weight, -1, n2, 1.0)
+
+    def test_unknown_nodes(self):
+        graph = random_road_graph(random.Random(4), size=3)
+        route_graph = RouteGraph(graph)
+        self.assertRaises(nx.NodeNotFound, route_graph.astar, -1, 0)
+        self.assertRaises(nx.NodeNotFound, route_graph.astar, 0, -1)
@@ -0,0 +1,160 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import math
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.tools.spatial_index import PointGrid, PolylineIndex, SpatialHash
+
+
+def random_polylines(rng, count=20, points=15):
+    """Random walks in the plane, like the lanes of a map, as one array of points and their connection flags"""
+    all_points = []
+    connected = []
+    for _ in range(count):
+        location = rng.uniform(-100.0, 100.0, 3) * np.array([1.0, 1.0, 0.05])
+        yaw = rng.uniform(-math.pi, math.pi)
+        for i in range(points):
+            all_points.append(location.copy())
+            connected.append(i < points - 1)
+            yaw += rng.uniform(-0.3, 0.3)
+            location += rng.uniform(0.5, 3.0) * np.array([math.cos(yaw), math.sin(yaw), 0.0])
+    return np.array(all_points), np.array(connected)
+
+
+def brute_force_segment_distances(points, connected, location):
+    starts = np.nonzero(connected)[0]
+    distances = []
+    for start in starts:
+        a, b = points[start], points[start + 1]
+        t = np.clip(np.dot(location - a, b - a) / max(np.dot(b - a, b - a), 1e-12), 0.0, 1.0)
+        distances.append(np.linalg.norm(location - (a + t * (b - a))))
+    return starts, np.array(distances)
+
+
+class TestPointGrid(unittest.TestCase):
+    def test_nearest(self):
+        rng = np.random.RandomState(0)
+        points = rng.uniform(-50.0, 50.0, (500, 3))
+        grid = PointGrid(points, 5.0)
+        # Near and far away locations, the latter need the fallback to all the points
+        locations = np.concatenate([rng.uniform(-60.0, 60.0, (300, 3)), rng.uniform(200.0, 300.0, (20, 3))])
+        indices, distances = grid.nearest(locations)
+        for location, index, distance in zip(locations, indices, distances):
+            expected = np.linalg.norm(points - location, axis=1)
+            self.assertAlmostEqual(distance, expected.min())
+            self.assertAlmostEqual(expected[index], expected.min())
+
+    def test_query_radius(self):
+        rng = np.random.RandomState(1)
+        points = rng.uniform(-50.0, 50.0, (500, 3))
+        grid = PointGrid(points, 4.0)
+        for location in rng.uniform(-60.0, 60.0, (50, 3)):
+            for radius in (1.0, 7.5, 30.0):
+                expected = np.nonzero(np.linalg.norm(points - location, axis=1) < radius)[0]
+                self.assertEqual(grid.query_radius(location, radius).tolist(), expected.tolist())
+
+    def test_empty(self):
+        grid = PointGrid(np.zeros((0, 3)), 2.0)
+        indices, distances = grid.nearest([[1.0, 2.0, 3.0]])
+        self.assertEqual(indices.tolist(), [-1])
+        self.assertTrue(np.isinf(distances[0]))
+        self.assertEqual(len(grid.query_radius([0.0, 0.0, 0.0], 10.0)), 0)
+
+
+class TestPolylineIndex(unittest.TestCase):
+    def test_project(self):
+        rng = np.random.RandomState(2)
+        points, connected = random_polylines(rng)
+        for cell_size in (2.0, 10.0):
+            index = PolylineIndex(points, connected, cell_size)
+            locations = np.concatenate([rng.uniform(-120.0, 120.0, (200, 3)), rng.uniform(500.0, 600.0, (10, 3))])
+            starts, projections, distances = index.project(locations)
+            for location, start, projection, distance in zip(locations, starts, projections, distances):
+                segment_starts, expected = brute_force_segment_distances(points, connected, location)
+                self.assertIn(start, segment_starts.tolist())
+                self.assertAlmostEqual(distance, expected.min())
+                self.assertAlmostEqual(np.linalg.norm(location - projection), distance)
+                # The projection lies on the returned segment
+                a, b = points[start], points[start + 1]
+                self.assertAlmostEqual(
+                    np.linalg.norm(projection - a) + np.linalg.norm(b - projection), np.linalg.norm(b - a))
+
+    def test_polylines_are_not_joined(self):
+        points = np.array([[0.0, 0.0, 0.0], [10.0, 0.0, 0.0], [10.0, 10.0, 0.0], [20.0, 10.0, 0.0]])
+        index = PolylineIndex(points, [True, False, True, True], 2.0)
+        self.assertEqual(len(index), 2)
+        # The gap between (10, 0) and (10, 10) would be the closest segment
+        starts, _, distances = index.project([[9.5, 4.0, 0.0]])
+        self.assertEqual(starts.tolist(), [0])
+        self.assertAlmostEqual(distances[0], 4.0)
+
+    def test_no_segments(self):
+        index = PolylineIndex(np.zeros((1, 3)), [True], 2.0)
+        starts, projections, distances = index.project([[1.0, 1.0, 1.0]])
+        self.assertEqual(starts.tolist(), [-1])
+        self.assertEqual(projections.tolist(), [[1.0, 1.0, 1.0]])
+        self.assertTrue(np.isinf(distances[0]))
+
+
+class TestSpatialHash(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(3)
+        self.spatial_hash = SpatialHash(10.0)
+        self.ids = np.arange(100, 400)
+        self.points = self.rng.uniform(-100.0, 100.0, (len(self.ids), 3))
+        self.spatial_hash.update(self.ids, self.points)
+
+    def move(self):
+        """Moves some points, removes others and adds new ones"""
+        keep = self.rng.uniform(size=len(self.ids)) > 0.2
+        self.ids = np.concatenate([self.ids[keep], np.arange(1000, 1050) + self.ids.max()])
+        self.points = np.concatenate([self.points[keep], self.rng.uniform(-100.0, 100.0, (50, 3))])
+        self.points += self.rng.uniform(-8.0, 8.0, self.points.shape)
+        self.spatial_hash.update(self.ids, self.points)
+
+    def test_query_radius(self):
+        for _ in range(3):
+            for location in self.rng.uniform(-120.0, 120.0, (30, 3)):
+                for radius, planar in ((5.0, False), (25.0, True), (400.0, False)):
+                    dimensions = 2 if planar else 3
+                    distances = np.linalg.norm(self.points[:, :dimensions] - location[:dimensions], axis=1)
+                    expected = self.ids[distances < radius]
+                    self.assertEqual(sorted(self.spatial_hash.query_radius(location, radius, planar).tolist()),
+                                     sorted(expected.tolist()))
+            self.move()
+
+    def test_query_cone(self):
+        for _ in range(3):
+            for location in self.rng.uniform(-120.0, 120.0, (30, 3)):
+                yaw = self.rng.uniform(-180.0, 180.0)
+                for radius, interval in ((15.0, [0, 90]), (40.0, [0, 30]), (40.0, [160, 180])):
+                    # Same test as 'is_within_distance'
+                    expected = []
+                    forward = np.array([math.cos(math.radians(yaw)), math.sin(math.radians(yaw))])
+                    for point_id, point in zip(self.ids, self.points):
+                        vector = point[:2] - location[:2]
+                        norm = np.linalg.norm(vector)
+                        if norm < 0.001:
+                            expected.append(point_id)
+                        elif norm <= radius:
+                            angle = math.degrees(math.acos(np.clip(np.dot(forward, vector) / norm, -1.0, 1.0)))
+                            if interval[0] < angle < interval[1]:
+                                expected.append(point_id)
+                    self.assertEqual(sorted(self.spatial_hash.query_cone(location, yaw, radius, interval).tolist()),
+                                     sorted(expected))
+            self.move()
+
+    def test_removed_points(self):
+        self.spatial_hash.update([], np.zeros((0, 3)))
+        self.assertEqual(len(self.spatial_hash), 0)
+        self.assertEqual(len(self.spatial_hash.query_radius([0.0, 0.0, 0.0], 1000.0)), 0)
@@ -0,0 +1,175 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import carla
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.navigation.basic_agent import BasicAgent
+from agents.tools.traffic_light_index import TrafficLightIndex
+
+
+class FakeWaypoint(object):
+    def __init__(self, road_id, transform):
+        self.road_id = road_id
+        self.lane_id = -1 if transform.rotation.yaw == 0.0 else 1
+        self.s = transform.location.x
+        self.transform = transform
+
+
+class FakeMap(object):
+    """Roads of 100 meters along x, with the lanes driven towards +x at y > 0 and towards -x at y < 0"""
+
+    def get_waypoint(self, location):
+        rotation = carla.Rotation(0.0, 0.0 if location.y >= 0.0 else 180.0, 0.0)
+        location = carla.Location(location.x, 1.75 if location.y >= 0.0 else -1.75, 0.0)
+        return FakeWaypoint(int(location.x // 100.0) + 1, carla.Transform(location, rotation))
+
+
+class FakeTrafficLight(object):
+    def __init__(self, actor_id, x, y, state=carla.TrafficLightState.Red):
+        self.id = actor_id
+        self.type_id = 'traffic.traffic_light'
+        self.state = state
+        self.trigger_volume = carla.BoundingBox(carla.Location(), carla.Vector3D(1.0, 1.0, 0.0))
+        self._transform = carla.Transform(carla.Location(x, y, 0.0), carla.Rotation())
+
+    def get_transform(self):
+        return self._transform
+
+
+class FakeActorList(list):
+    def filter(self, pattern):
+        return FakeActorList(actor for actor in self if pattern.strip('*') in actor.type_id)
+
+
+class FakeWorld(object):
+    def __init__(self, world_id, traffic_lights):
+        self.id = world_id
+        self.traffic_lights = traffic_lights
+        self.queries = 0
+
+    def get_actors(self):
+        self.queries += 1
+        return FakeActorList(self.traffic_lights)
+
+
+class FakeVehicle(object):
+    def __init__(self, x, y, yaw):
+        self.id = 100
+        self.transform = carla.Transform(carla.Location(x, y, 0.0), carla.Rotation(0.0, yaw, 0.0))
+
+
+class FakeWorldState(object):
+    def __init__(self, wmap):
+        self._map = wmap
+
+    def update(self):
+        pass
+
+    def waypoint(self, vehicle):
+        return self._map.get_waypoint(vehicle.transform.location)
+
+    def transform(self, vehicle):
+        return vehicle.transform
+
+
+def make_traffic_lights():
+    return [
+        FakeTrafficLight(1, 50.0, 1.75),
+        FakeTrafficLight(2, 52.0, 1.75),
+        FakeTrafficLight(3, 150.0, 1.75),
+        FakeTrafficLight(4, 48.0, -1.75)]
+
+
+class TestTrafficLightIndex(unittest.TestCase):
+    def tearDown(self):
+        TrafficLightIndex.clear()
+
+    def test_on_road(self):
+        index = TrafficLightIndex(FakeMap(), make_traffic_lights())
+        self.assertEqual(len(index), 4)
+        self.assertEqual([trigger.traffic_light.id for trigger in index.on_road(1)], [1, 2, 4])
+        self.assertEqual([trigger.traffic_light.id for trigger in index.on_road(2)], [3])
+        self.assertEqual(index.on_road(7), [])
+
+        trigger = index.on_road(1)[2]
+        self.assertEqual((trigger.road_id, trigger.lane_id, trigger.s), (1, 1, 48.0))
+        self.assertAlmostEqual(trigger.direction[0], -1.0)
+
+    def test_shared_indices(self):
+        wmap = FakeMap()
+        worlds = [FakeWorld(world_id, make_traffic_lights()) for world_id in range(TrafficLightIndex.MAX_SHARED + 1)]
+        index = TrafficLightIndex.get(worlds[0], wmap)
+        self.assertIs(TrafficLightIndex.get(worlds[0], wmap), index)
+        self.assertEqual(worlds[0].queries, 1)
+
+        # The index of the least recently used world is dropped
+        for world in worlds[1:]:
+            TrafficLightIndex.get(world, wmap)
+        self.assertIsNot(TrafficLightIndex.get(worlds[0], wmap), index)
+        self.assertEqual(worlds[0].queries, 2)
+        self.assertEqual(len(TrafficLightIndex._shared), TrafficLightIndex.MAX_SHARED)
+
+        index = TrafficLightIndex.get(worlds[0], wmap)
+        TrafficLightIndex.clear(worlds[0])
+        self.assertIsNot(TrafficLightIndex.get(worlds[0], wmap), index)
+        TrafficLightIndex.clear()
+        self.assertEqual(len(TrafficLightIndex._shared), 0)
+
+
+class TestAffectedByTrafficLight(unittest.TestCase):
+    def setUp(self):
+        wmap = FakeMap()
+        self.traffic_lights = make_traffic_lights()
+
+        # Only the attributes used by the traffic light check, instead of the planners of the agent
+        self.agent = BasicAgent.__new__(BasicAgent)
+        self.agent._vehicle = FakeVehicle(45.0, 1.0, 0.0)
+        self.agent._ignore_traffic_lights = False
+        self.agent._base_tlight_threshold = 5.0
+        self.agent._world_state = FakeWorldState(wmap)
+        self.agent._traffic_light_index = TrafficLightIndex(wmap, self.traffic_lights)
+
+    def affected(self, lights_list=None, max_distance=10.0):
+        self.agent._last_traffic_light = None
+        affected, traffic_light = self.agent._affected_by_traffic_light(lights_list, max_distance)
+        return affected, traffic_light.id if traffic_light is not None else None
+
+    def test_red_lights_ahead(self):
+        self.assertEqual(self.affected(), (True, 1))
+        self.assertEqual(self.affected(max_distance=2.0), (False, None))
+
+        self.traffic_lights[0].state = carla.TrafficLightState.Green
+        self.assertEqual(self.affected(), (True, 2))
+
+        # The light of the opposite lane is red, but doesn't affect the vehicle
+        self.traffic_lights[1].state = carla.TrafficLightState.Yellow
+        self.assertEqual(self.affected(), (False, None))
+
+        self.agent._ignore_traffic_lights = True
+        self.traffic_lights[0].state = carla.TrafficLightState.Red
+        self.assertEqual(self.affected(), (False, None))
+
+    def test_lights_list(self):
+        self.assertEqual(self.affected([self.traffic_lights[1]]), (True, 2))
+        self.assertEqual(self.affected([self.traffic_lights[2], self.traffic_lights[3]]), (False, None))
+
+        # An empty list uses all the traffic lights, like None
+        self.assertEqual(self.affected([]), (True, 1))
+
+    def test_last_traffic_light(self):
+        self.assertEqual(self.affected(), (True, 1))
+
+        # The vehicle keeps stopping at the last red light, even after crossing its trigger volume
+        self.agent._vehicle = FakeVehicle(60.0, 1.0, 0.0)
+        self.assertEqual(self.agent._affected_by_traffic_light(max_distance=10.0)[1].id, 1)
+        self.traffic_lights[0].state = carla.TrafficLightState.Green
+        self.assertEqual(self.agent._affected_by_traffic_light(max_distance=10.0), (False, None))
@@ -0,0 +1,86 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import carla
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.tools.world_state import WorldStateCache
+
+
+class FakeActor(object):
+    def __init__(self, actor_id, type_id, location):
+        self.id = actor_id
+        self.type_id = type_id
+        self.bounding_box = carla.BoundingBox(carla.Location(), carla.Vector3D(2.0, 1.0, 0.8))
+        self.transform = carla.Transform(location, carla.Rotation())
+
+    def get_transform(self):
+        return self.transform
+
+    def get_velocity(self):
+        return carla.Vector3D()
+
+
+class FakeSnapshot(object):
+    def __init__(self, frame, actors):
+        self.frame = frame
+        self._actors = list(actors)
+
+    def __iter__(self):
+        return iter(self._actors)
+
+
+class FakeWorld(object):
+    def __init__(self, world_id, actors):
+        self.id = world_id
+        self.actors = actors
+
+    def get_snapshot(self):
+        return FakeSnapshot(1, self.actors)
+
+    def get_actors(self, actor_ids):
+        return [actor for actor in self.actors if actor.id in actor_ids]
+
+
+class TestWorldStateCache(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.actors = []
+        for actor_id in rng.sample(range(1, 1000), 60):
+            type_id = rng.choice(['vehicle.audi.tt', 'walker.pedestrian.0001', 'traffic.traffic_light'])
+            location = carla.Location(rng.uniform(-50.0, 50.0), rng.uniform(-50.0, 50.0), 0.0)
+            self.actors.append(FakeActor(actor_id, type_id, location))
+        self.world = FakeWorld(1, self.actors)
+        WorldStateCache.clear()
+
+    def test_order_of_the_snapshot(self):
+        cache = WorldStateCache(self.world)
+        cache.update()
+        vehicles = [actor for actor in self.actors if actor.type_id.startswith('vehicle')]
+        self.assertEqual([actor.id for actor in cache.filter('*vehicle*')], [actor.id for actor in vehicles])
+
+        center = carla.Location(5.0, -3.0, 0.0)
+        expected = [actor.id for actor in vehicles if actor.transform.location.distance(center) < 30.0]
+        self.assertEqual([actor.id for actor in cache.nearby(center, 30.0)], expected)
+
+    def test_shared_caches(self):
+        cache = WorldStateCache.get(self.world)
+        self.assertIs(WorldStateCache.get(self.world), cache)
+        WorldStateCache.clear(self.world)
+        self.assertIsNot(WorldStateCache.get(self.world), cache)
+
+        # The caches of the least recently used worlds are dropped
+        cache = WorldStateCache.get(self.world)
+        for world_id in range(2, 2 + WorldStateCache.MAX_SHARED):
+            WorldStateCache.get(FakeWorld(world_id, []))
+        self.assertIsNot(WorldStateCache.get(self.world), cache)
+        WorldStateCache.clear()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Benchmark of the client side LaneMap.
+
+Compares the latency of 'carla.Map.get_waypoint' and 'carla.Waypoint.next' with the batched
+projection and lane following queries of the LaneMap, over random locations near the roads,
+and reports how often both agree on the lane and on the s.
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
+import carla
+
+from agents.navigation.lane_map import LaneMap  # pylint: disable=import-error
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        '--host',
+        metavar='H',
+        default='127.0.0.1',
+        help='IP of the host server (default: 127.0.0.1)')
+    argparser.add_argument(
+        '-p', '--port',
+        metavar='P',
+        default=2000,
+        type=int,
+        help='TCP port to listen to (default: 2000)')
+    argparser.add_argument(
+        '--map',
+        default=None,
+        help='load a new map (default: current map)')
+    argparser.add_argument(
+        '-n', '--queries',
+        default=10000,
+        type=int,
+        help='number of locations (default: 10000)')
+    argparser.add_argument(
+        '-r', '--resolution',
+        default=1.0,
+        type=float,
+        help='distance between the points of the lane map (default: 1.0)')
+    argparser.add_argument(
+        '-d', '--distance',
+        default=2.0,
+        type=float,
+        help='distance of the lane following queries (default: 2.0)')
+    argparser.add_argument(
+        '--cache-dir',
+        default=None,
+        help='folder where the lane map is cached (default: not cached)')
+    argparser.add_argument(
+        '-s', '--seed',
+        default=0,
+        type=int,
+        help='random seed (default: 0)')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(60.0)
+    world = client.load_world(args.map) if args.map else client.get_world()
+    wmap = world.get_map()
+
+    begin = time.time()
+    lane_map = LaneMap.from_map(wmap, args.resolution, cache_dir=args.cache_dir)
+    print('Lane map of {} lanes built in {:.2f} s'.format(len(lane_map), time.time() - begin))
+
+    # Random locations around the centerline of the lanes
+    random.seed(args.seed)
+    waypoints = wmap.generate_waypoints(2.0)
+    locations = []
+    for waypoint in random.sample(waypoints, min(args.queries, len(waypoints))):
+        location = waypoint.transform.location
+        locations.append(carla.Location(
+            location.x + random.uniform(-1.0, 1.0), location.y + random.uniform(-1.0, 1.0), location.z))
+
+    begin = time.time()
+    reference = [wmap.get_waypoint(location) for location in locations]
+    map_time = time.time() - begin
+
+    begin = time.time()
+    points = np.array([[location.x, location.y, location.z] for location in locations])
+    projections = lane_map.project(points)
+    lane_map_time = time.time() - begin
+
+    keys = lane_map.lane_keys(projections['lane'])
+    same_lane = np.array([(waypoint.road_id, waypoint.section_id, waypoint.lane_id) == tuple(key)
+                          for waypoint, key in zip(reference, keys.tolist())])
+    s_error = np.abs(projections['s'] - np.array([waypoint.s for waypoint in reference]))[same_lane]
+
+    print('\n{:<24} {:>12} {:>12}'.format('query', 'total (ms)', 'per query (us)'))
+    print('{:<24} {:>12.2f} {:>12.2f}'.format('get_waypoint', map_time * 1000.0, map_time * 1e6 / len(locations)))
+    print('{:<24} {:>12.2f} {:>12.2f}'.format('LaneMap.project', lane_map_time * 1000.0,
+                                              lane_map_time * 1e6 / len(locations)))
+
+    begin = time.time()
+    following = [waypoint.next(args.distance) for waypoint in reference]
+    next_time = time.time() - begin
+
+    begin = time.time()
+    lanes, s, _ = lane_map.advance(projections['lane'], projections['s'], args.distance)
+    advance_time = time.time() - begin
+
+    print('{:<24} {:>12.2f} {:>12.2f}'.format('Waypoint.next', next_time * 1000.0, next_time * 1e6 / len(locations)))
+    print('{:<24} {:>12.2f} {:>12.2f}'.format('LaneMap.advance', advance_time * 1000.0,
+                                              advance_time * 1e6 / len(locations)))
+
+    next_keys = lane_map.lane_keys(lanes).tolist()
+    comparable = [i for i, next_waypoints in enumerate(following) if same_lane[i] and len(next_waypoints) == 1]
+    next_agree = [i for i in comparable if
+                  (following[i][0].road_id, following[i][0].section_id, following[i][0].lane_id) == tuple(next_keys[i])
+                  and abs(following[i][0].s - s[i]) < 0.05]
+
+    if len(s_error) == 0:
+        s_error = np.zeros(1)
+    print('\nSame lane as get_waypoint: {:.2f} %, s error: mean {:.4f} m, max {:.4f} m'.format(
+        100.0 * np.mean(same_lane), np.mean(s_error), np.max(s_error)))
+    print('Same position as next: {:.2f} % of {} unambiguous queries'.format(
+        100.0 * len(next_agree) / max(len(comparable), 1), len(comparable)))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        print('\nCancelled by user. Bye!')
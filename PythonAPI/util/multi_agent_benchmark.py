@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Scaling benchmark of the MultiAgentRunner.
+
+Spawns fleets of BasicAgents of increasing size in synchronous mode and measures the client time
+per frame when each agent applies its own control, and when they are stepped by the MultiAgentRunner,
+which shares the world snapshot and applies all the controls with one batch.
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
+import carla
+
+from agents.navigation.basic_agent import BasicAgent  # pylint: disable=import-error
+from agents.navigation.multi_agent_runner import MultiAgentRunner  # pylint: disable=import-error
+
+
+def spawn_vehicles(client, world, count):
+    """Spawns up to 'count' vehicles at random spawn points, returning them"""
+    blueprints = [bp for bp in world.get_blueprint_library().filter('vehicle.*')
+                  if int(bp.get_attribute('number_of_wheels')) == 4]
+    spawn_points = world.get_map().get_spawn_points()
+    random.shuffle(spawn_points)
+    if count > len(spawn_points):
+        print('  only {} spawn points available, spawning {} vehicles'.format(len(spawn_points), len(spawn_points)))
+
+    batch = [carla.command.SpawnActor(random.choice(blueprints), transform)
+             for transform in spawn_points[:count]]
+    vehicle_ids = [response.actor_id for response in client.apply_batch_sync(batch, True) if not response.error]
+    return list(world.get_actors(vehicle_ids))
+
+
+def run_individual(world, agents, frames):
+    """Each agent applies its own control, returning the client time of each frame"""
+    times = []
+    for _ in range(frames):
+        world.tick()
+        begin = time.time()
+        for agent in agents:
+            agent._vehicle.apply_control(agent.run_step())
+        times.append(time.time() - begin)
+    return times
+
+
+def run_runner(world, runner, frames):
+    """The runner steps all the agents, returning the client time of each frame"""
+    times = []
+    for _ in range(frames):
+        world.tick()
+        begin = time.time()
+        runner.run_step()
+        times.append(time.time() - begin)
+    return times
+
+
+def print_times(count, mode, times):
+    """Prints the statistics of the frame times, in milliseconds"""
+    times = np.array(times) * 1000.0
+    print('{:<8} {:<20} {:>10.2f} {:>10.2f} {:>10.2f} {:>12.3f}'.format(
+        count, mode, np.mean(times), np.median(times), np.percentile(times, 95), np.mean(times) / count))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        '--host',
+        metavar='H',
+        default='127.0.0.1',
+        help='IP of the host server (default: 127.0.0.1)')
+    argparser.add_argument(
+        '-p', '--port',
+        metavar='P',
+        default=2000,
+        type=int,
+        help='TCP port to listen to (default: 2000)')
+    argparser.add_argument(
+        '--map',
+        default=None,
+        help='load a new map (default: current map)')
+    argparser.add_argument(
+        '-n', '--agents',
+        default='10,100,500',
+        help='comma separated fleet sizes (default: 10,100,500)')
+    argparser.add_argument(
+        '-f', '--frames',
+        default=200,
+        type=int,
+        help='number of frames per run (default: 200)')
+    argparser.add_argument(
+        '-w', '--workers',
+        default=4,
+        type=int,
+        help='threads of the runner, in addition to the sequential run (default: 4)')
+    argparser.add_argument(
+        '-s', '--seed',
+        default=0,
+        type=int,
+        help='random seed (default: 0)')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(60.0)
+    world = client.load_world(args.map) if args.map else client.get_world()
+
+    original_settings = world.get_settings()
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = 0.05
+    world.apply_settings(settings)
+
+    print('{:<8} {:<20} {:>10} {:>10} {:>10} {:>12}'.format(
+        'agents', 'mode', 'mean (ms)', 'median', 'p95', 'per agent'))
+    vehicles = []
+    try:
+        for count in [int(n) for n in args.agents.split(',')]:
+            modes = [('individual', None), ('runner', 0)]
+            if args.workers > 0:
+                modes.append(('runner {} threads'.format(args.workers), args.workers))
+
+            for mode, workers in modes:
+                random.seed(args.seed)
+                vehicles = spawn_vehicles(client, world, count)
+                world.tick()
+
+                if workers is None:
+                    agents = [BasicAgent(vehicle) for vehicle in vehicles]
+                    times = run_individual(world, agents, args.frames)
+                else:
+                    runner = MultiAgentRunner(client, world, workers=workers)
+                    for vehicle in vehicles:
+                        runner.add_agent(BasicAgent(vehicle, opt_dict={'controller_bank': runner.controller_bank}))
+                    times = run_runner(world, runner, args.frames)
+                    runner.close()
+                print_times(len(vehicles), mode, times)
+                if workers is not None:
+                    print('{:<8} {:<20} {}'.format('', '', ', '.join(
+                        '{} {:.2f}'.format(phase, timing[0]) for phase, timing in runner.get_phase_timing().items())))
+
+                client.apply_batch_sync([carla.command.DestroyActor(vehicle.id) for vehicle in vehicles], True)
+                vehicles = []
+    finally:
+        if vehicles:
+            client.apply_batch_sync([carla.command.DestroyActor(vehicle.id) for vehicle in vehicles], True)
+        world.apply_settings(original_settings)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        print('\nCancelled by user. Bye!')
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Benchmark of the junction obstacle check of the agents.
+
+Compares the latency of testing a route corridor against the bounding boxes of the surrounding
+vehicles with shapely polygons, as the agents used to do, and with the numpy separating axis test,
+over synthetic scenes. It doesn't need a running simulator.
+"""
+
+from __future__ import print_function
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
+from agents.tools.geometry import convex_polygons_intersect, corridor_polygons  # pylint: disable=import-error
+
+
+def random_scene(rng, vehicles, points):
+    """Returns the borders of a curved corridor and the corners of the boxes of the vehicles around it"""
+    x, y, yaw = 0.0, 0.0, 0.0
+    left, right = [], []
+    for _ in range(points):
+        left.append([x - 1.5 * math.sin(yaw), y + 1.5 * math.cos(yaw)])
+        right.append([x + 1.5 * math.sin(yaw), y - 1.5 * math.cos(yaw)])
+        yaw += rng.uniform(-0.1, 0.1)
+        x += 2.0 * math.cos(yaw)
+        y += 2.0 * math.sin(yaw)
+
+    boxes = []
+    for _ in range(vehicles):
+        bx, by = rng.uniform(-10, 2.0 * points), rng.uniform(-2.0 * points, 2.0 * points)
+        byaw = rng.uniform(-math.pi, math.pi)
+        corners = []
+        for sx, sy in [(-1, -1), (-1, 1), (1, 1), (1, -1)]:
+            corners.append([bx + sx * 2.4 * math.cos(byaw) - sy * 1.0 * math.sin(byaw),
+                            by + sx * 2.4 * math.sin(byaw) + sy * 1.0 * math.cos(byaw)])
+        boxes.append(corners)
+    return left, right, boxes
+
+
+def shapely_check(left, right, boxes):
+    """Polygon based check, building one shapely polygon per vehicle"""
+    from shapely.geometry import Polygon  # pylint: disable=import-outside-toplevel
+    route_polygon = Polygon(left + right[::-1])
+    return [route_polygon.intersects(Polygon(box)) for box in boxes]
+
+
+def numpy_check(left, right, boxes):
+    """Separating axis check of all the vehicles at once"""
+    return np.any(convex_polygons_intersect(corridor_polygons(left, right), boxes), axis=0).tolist()
+
+
+def time_check(check, scenes):
+    """Runs a check over all the scenes, returning its latencies in milliseconds and its results"""
+    latencies = []
+    results = []
+    for left, right, boxes in scenes:
+        begin = time.time()
+        results.append(check(left, right, boxes))
+        latencies.append(time.time() - begin)
+    return np.array(latencies) * 1000.0, results
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        '-n', '--scenes',
+        default=500,
+        type=int,
+        help='number of scenes (default: 500)')
+    argparser.add_argument(
+        '-v', '--vehicles',
+        default='1,10,50,200',
+        help='comma separated numbers of vehicles per scene (default: 1,10,50,200)')
+    argparser.add_argument(
+        '--points',
+        default=20,
+        type=int,
+        help='cross sections of the route corridor (default: 20)')
+    argparser.add_argument(
+        '-s', '--seed',
+        default=0,
+        type=int,
+        help='random seed (default: 0)')
+    args = argparser.parse_args()
+
+    try:
+        import shapely  # pylint: disable=import-outside-toplevel,unused-import
+        checks = [('shapely', shapely_check), ('numpy SAT', numpy_check)]
+    except ImportError:
+        print('shapely is not installed, only the numpy check is timed')
+        checks = [('numpy SAT', numpy_check)]
+
+    print('{:<10} {:<10} {:>10} {:>10} {:>10}'.format('vehicles', 'check', 'mean (ms)', 'median', 'p95'))
+    for vehicles in [int(v) for v in args.vehicles.split(',')]:
+        rng = random.Random(args.seed)
+        scenes = [random_scene(rng, vehicles, args.points) for _ in range(args.scenes)]
+        reference = None
+        for name, check in checks:
+            latencies, results = time_check(check, scenes)
+            print('{:<10} {:<10} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                vehicles, name, np.mean(latencies), np.median(latencies), np.percentile(latencies, 95)))
+            if reference is None:
+                reference = results
+            elif results != reference:
+                print('  warning: {} disagrees with {}'.format(name, checks[0][0]))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        print('\nCancelled by user. Bye!')
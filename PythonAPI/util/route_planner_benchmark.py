@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Benchmark of the route searches of the GlobalRoutePlanner.
+
+Compares the query latency and the number of expanded nodes of the networkx A* search,
+the array based (CSR) A* search and the landmark (ALT) search, over random pairs of spawn points.
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import networkx as nx
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
+import carla
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner  # pylint: disable=import-error
+
+
+def search_benchmark(name, search, edge_pairs, expanded=None):
+    """Runs a search function over all the pairs, printing its latency and expanded nodes"""
+    latencies = []
+    expanded_nodes = []
+    for start, end in edge_pairs:
+        begin = time.time()
+        try:
+            search(start[0], end[0])
+        except nx.NetworkXNoPath:
+            continue
+        latencies.append(time.time() - begin)
+        if expanded is not None:
+            expanded_nodes.append(expanded())
+
+    latencies = np.array(latencies) * 1000.0
+    print('{:<16} {:>10.3f} {:>10.3f} {:>10.3f} {:>12}'.format(
+        name, np.mean(latencies), np.median(latencies), np.percentile(latencies, 95),
+        '{:.1f}'.format(np.mean(expanded_nodes)) if expanded_nodes else '-'))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        '--host',
+        metavar='H',
+        default='127.0.0.1',
+        help='IP of the host server (default: 127.0.0.1)')
+    argparser.add_argument(
+        '-p', '--port',
+        metavar='P',
+        default=2000,
+        type=int,
+        help='TCP port to listen to (default: 2000)')
+    argparser.add_argument(
+        '--map',
+        default=None,
+        help='load a new map (default: current map)')
+    argparser.add_argument(
+        '-n', '--queries',
+        default=1000,
+        type=int,
+        help='number of route queries (default: 1000)')
+    argparser.add_argument(
+        '-l', '--landmarks',
+        default=8,
+        type=int,
+        help='number of landmarks of the ALT search (default: 8)')
+    argparser.add_argument(
+        '-r', '--resolution',
+        default=2.0,
+        type=float,
+        help='sampling resolution of the planner (default: 2.0)')
+    argparser.add_argument(
+        '-s', '--seed',
+        default=0,
+        type=int,
+        help='random seed (default: 0)')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(60.0)
+    world = client.load_world(args.map) if args.map else client.get_world()
+    wmap = world.get_map()
+
+    begin = time.time()
+    planner = GlobalRoutePlanner(wmap, args.resolution)
+    print('Graph built in {:.2f} s ({} nodes, {} edges)'.format(
+        time.time() - begin, planner._graph.number_of_nodes(), planner._graph.number_of_edges()))
+
+    route_graph = planner._route_graph
+    begin = time.time()
+    route_graph.set_landmarks(*route_graph.compute_landmarks(args.landmarks))
+    print('{} landmarks computed in {:.2f} s'.format(args.landmarks, time.time() - begin))
+
+    random.seed(args.seed)
+    spawn_points = wmap.get_spawn_points()
+    edge_pairs = []
+    for _ in range(args.queries):
+        origin, destination = random.sample(spawn_points, 2)
+        start = planner._localize(origin.location)
+        end = planner._localize(destination.location)
+        if start is not None and end is not None:
+            edge_pairs.append((start, end))
+
+    print('\n{:<16} {:>10} {:>10} {:>10} {:>12}'.format('search', 'mean (ms)', 'median', 'p95', 'expanded'))
+    search_benchmark(
+        'networkx A*',
+        lambda source, target: nx.astar_path(planner._graph, source, target,
+                                             heuristic=planner._distance_heuristic, weight='length'),
+        edge_pairs)
+    # The networkx search expands the same nodes as the CSR one
+    search_benchmark('CSR A*', route_graph.astar, edge_pairs, lambda: route_graph.expanded_nodes)
+    search_benchmark('CSR Dijkstra', route_graph.dijkstra, edge_pairs, lambda: route_graph.expanded_nodes)
+    search_benchmark('CSR ALT', route_graph.alt, edge_pairs, lambda: route_graph.expanded_nodes)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        print('\nCancelled by user. Bye!')